@@ -0,0 +1,16 @@
+"""Automates checking out files and folders from a remote git repository.
+
+The Configuration and Syncer classes form the library API for running checkouts
+in-process:
+
+    from subtreeutil import Configuration, Syncer
+
+    configuration = Configuration(remote_url='...', branch='main', source_paths=['Assets'])
+    result = Syncer([configuration], repository_folder='path/to/repository').run()
+"""
+
+from .config import Configuration
+from .core import Syncer, SyncResult
+
+
+__all__ = ['Configuration', 'Syncer', 'SyncResult']
@@ -8,14 +8,25 @@ import argparse
 from argparse import Namespace
 
 import logging
-import logging.config
+import logging.handlers
 
 from pathlib import Path
 
+import queue
 import sys
 
 from . import core as core
 from . import config as config
+from . import progress as progress
+
+
+# Log record formats for the console and the log file
+_DISPLAY_FORMAT = '{message}'
+_TIMESTAMP_FORMAT = '[{asctime}][{levelname}] {name}: {message}'
+
+# Size in bytes at which the log file is rotated, and the number of rotated files to keep
+_LOG_MAX_BYTES = 5 * 1024 * 1024
+_LOG_BACKUP_COUNT = 3
 
 
 class Command:
@@ -41,22 +52,268 @@ class Command:
 
 class Checkout(Command):
     def execute(self, args):
-        """Executes a full checkout command using a configuration file.
+        """Executes a full checkout command using one or more configuration files.
 
         Args:
           args: A Namespace object containing a parsed argument for the configuration
-          file to load.
+          files to load.
         """
 
-        config_path = Path(args.file)
+        config_paths = [Path(file) for file in args.file]
+
+        progress_callback = None
+        if args.progress == 'json':
+            progress_callback = progress.JsonLinesWriter(sys.stdout)
+        else:
+            print('')
+
+        textfile_path = Path(args.metrics_textfile) if args.metrics_textfile else None
+        core.perform_checkouts(config_paths, progress_callback, textfile_path)
+
+    @staticmethod
+    def configure(subparser):
+        subparser.add_argument(
+            'file',
+            type=str,
+            nargs='+',
+            help='Configuration file(s) to use for checkout operation. Configurations '
+            'sharing a remote URL are fetched only once.',
+        )
+        subparser.add_argument(
+            '--progress',
+            choices=['none', 'json'],
+            default='none',
+            help='Write progress events for fetch, checkout and move operations to stdout '
+            'as JSON lines',
+        )
+        subparser.add_argument(
+            '--metrics-textfile',
+            type=str,
+            default=None,
+            help='Update this Prometheus textfile collector file (*.prom) with the '
+            'metrics history after the checkout',
+        )
+
+
+class Export(Command):
+    def execute(self, args):
+        """Executes an export command writing the sources of one or more configuration
+        files to a tar archive.
+
+        Args:
+          args: A Namespace object containing parsed arguments for the configuration
+          files to export, the archive to write and its compression.
+        """
+
+        config_paths = [Path(file) for file in args.file]
+        compression = None if args.compression == 'auto' else args.compression
+
+        core.perform_export(config_paths, args.output, compression)
+
+    @staticmethod
+    def configure(subparser):
+        subparser.add_argument('file', type=str, nargs='+', help='Configuration file(s) to export')
+        subparser.add_argument(
+            '-o',
+            '--output',
+            type=str,
+            required=True,
+            help='The archive to write, or \'-\' to write to stdout',
+        )
+        subparser.add_argument(
+            '--compression',
+            choices=['auto', 'none', 'gzip', 'zstd'],
+            default='auto',
+            help='The archive\'s compression. Chosen from the archive\'s file extension '
+            'by default. zstd requires the \'zstandard\' package',
+        )
+
+
+class Import(Command):
+    def execute(self, args):
+        """Executes an import command writing the files in an exported archive.
+
+        Args:
+          args: A Namespace object containing parsed arguments for the archive to read,
+          the folder to write to and the number of workers.
+        """
+
+        print('')
+        core.perform_import(args.archive, args.destination, args.workers)
+        print('')
+
+    @staticmethod
+    def configure(subparser):
+        subparser.add_argument(
+            'archive', type=str, help='The archive to import, or \'-\' to read from stdin'
+        )
+        subparser.add_argument(
+            '--destination',
+            type=str,
+            default=None,
+            help='The folder to write files to. Defaults to the current folder',
+        )
+        subparser.add_argument(
+            '--workers',
+            type=positive_int,
+            default=None,
+            help='The maximum number of files to write at once. Defaults to the number '
+            'of processors',
+        )
+
+
+class Bundle(Command):
+    def execute(self, args):
+        """Executes a bundle command writing the commits fetched for one or more
+        configuration files to a git bundle file.
+
+        Args:
+          args: A Namespace object containing parsed arguments for the configuration
+          files to bundle, the bundle to write and the commits to create it relative to.
+        """
+
+        config_paths = [Path(file) for file in args.file]
+
+        print('')
+        core.perform_bundle(config_paths, args.output, args.since, args.full)
+        print('')
+
+    @staticmethod
+    def configure(subparser):
+        subparser.add_argument('file', type=str, nargs='+', help='Configuration file(s) to bundle')
+        subparser.add_argument(
+            '-o', '--output', type=str, required=True, help='The bundle file to write'
+        )
+
+        base_group = subparser.add_mutually_exclusive_group()
+        base_group.add_argument(
+            '--since',
+            type=str,
+            default=None,
+            help='Only bundle commits made since this commit. Defaults to the commit each '
+            'configuration was last checked out from',
+        )
+        base_group.add_argument(
+            '--full',
+            action='store_true',
+            help='Bundle the full history of the fetched commits',
+        )
+
+
+class Rollback(Command):
+    def execute(self, args):
+        """Executes a rollback command restoring destinations from the snapshots taken
+        before their last checkout. Exits with status 1 if a configuration has no
+        snapshot.
+
+        Args:
+          args: A Namespace object containing parsed arguments for the configuration
+          files to roll back and whether to only list their snapshots.
+        """
+
+        config_paths = [Path(file) for file in args.file]
+
+        print('')
+        success = core.perform_rollback(config_paths, args.list)
+        print('')
+
+        if not success:
+            sys.exit(1)
+
+    @staticmethod
+    def configure(subparser):
+        subparser.add_argument(
+            'file', type=str, nargs='+', help='Configuration file(s) to roll back'
+        )
+        subparser.add_argument(
+            '--list',
+            action='store_true',
+            help='List the available snapshots instead of restoring the latest one',
+        )
+
+
+class Verify(Command):
+    def execute(self, args):
+        """Executes a verify command comparing destinations with the manifests written
+        by their last checkout. Exits with status 1 if any destination drifted.
+
+        Args:
+          args: A Namespace object containing a parsed argument for the configuration
+          files to verify.
+        """
+
+        config_paths = [Path(file) for file in args.file]
 
         print('')
-        core.perform_checkout(config_path)
+        clean = core.perform_verify(config_paths)
+        print('')
+
+        if not clean:
+            sys.exit(1)
 
     @staticmethod
     def configure(subparser):
         subparser.add_argument(
-            'file', type=str, help='Configuration file to use for checkout operation'
+            'file',
+            type=str,
+            nargs='+',
+            help='Configuration file(s) whose destinations should be verified',
+        )
+
+
+class Stats(Command):
+    def execute(self, args):
+        """Executes a stats command summarizing the metrics history of recent checkouts.
+        Exits with status 1 if the latest run of a configuration regressed, or 2 if the
+        metrics history could not be read.
+
+        Args:
+          args: A Namespace object containing parsed arguments for the configuration
+          files to summarize, the baseline window, the regression threshold and the
+          Prometheus textfile to write.
+        """
+
+        config_paths = [Path(file) for file in args.file] or None
+        textfile_path = Path(args.textfile) if args.textfile else None
+
+        print('')
+        clean = core.perform_stats(config_paths, args.window, args.threshold, textfile_path)
+        print('')
+
+        if clean is None:
+            sys.exit(2)
+
+        if not clean:
+            sys.exit(1)
+
+    @staticmethod
+    def configure(subparser):
+        subparser.add_argument(
+            'file',
+            type=str,
+            nargs='*',
+            help='Configuration file(s) to summarize, as passed to checkout. Defaults to '
+            'every recorded configuration',
+        )
+        subparser.add_argument(
+            '--window',
+            type=positive_int,
+            default=20,
+            help='The number of earlier runs forming the baseline',
+        )
+        subparser.add_argument(
+            '--threshold',
+            type=float,
+            default=1.5,
+            help='The multiple of the baseline\'s median at which a value is reported as '
+            'a regression',
+        )
+        subparser.add_argument(
+            '--textfile',
+            type=str,
+            default=None,
+            help='Write the metrics history to this Prometheus textfile collector file '
+            '(*.prom)',
         )
 
 
@@ -111,6 +368,44 @@ def get_args(argv):
     Checkout.configure(checkout_parser)
     checkout_parser.set_defaults(command=Checkout)
 
+    export_parser = subparsers.add_parser(
+        'export', help='Write the files a checkout would produce to a tar archive'
+    )
+    Export.configure(export_parser)
+    export_parser.set_defaults(command=Export)
+
+    import_parser = subparsers.add_parser(
+        'import', help='Write the files in an archive created by the export command'
+    )
+    Import.configure(import_parser)
+    import_parser.set_defaults(command=Import)
+
+    bundle_parser = subparsers.add_parser(
+        'bundle', help='Write the commits a checkout would fetch to a git bundle file'
+    )
+    Bundle.configure(bundle_parser)
+    bundle_parser.set_defaults(command=Bundle)
+
+    rollback_parser = subparsers.add_parser(
+        'rollback', help='Restore destinations to their state before the last checkout'
+    )
+    Rollback.configure(rollback_parser)
+    rollback_parser.set_defaults(command=Rollback)
+
+    verify_parser = subparsers.add_parser(
+        'verify',
+        aliases=['status'],
+        help='Report files in destinations that changed since the last checkout',
+    )
+    Verify.configure(verify_parser)
+    verify_parser.set_defaults(command=Verify)
+
+    stats_parser = subparsers.add_parser(
+        'stats', help='Summarize recent checkout metrics and report regressions'
+    )
+    Stats.configure(stats_parser)
+    stats_parser.set_defaults(command=Stats)
+
     config_parser = subparsers.add_parser('config', help='Create or edit a checkout operation configuration file')
     EditConfig.configure(config_parser)
     config_parser.set_defaults(command=EditConfig)
@@ -123,34 +418,41 @@ def get_args(argv):
     return args
 
 
+def positive_int(value):
+    """Parses a command line argument that must be a whole number of at least 1.
+
+    Args:
+      value: The argument's string value.
+
+    Returns:
+      The parsed integer.
+
+    Raises:
+      ArgumentTypeError: The value is not a whole number of at least 1.
+    """
+
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'invalid positive integer value: \'{value}\'')
+
+    return number
+
+
 def configure_log():
     """Configures subtreeutil's logging. The log file will be created in a log folder as
     a sibling of this script.
-    """
 
-    log_config = {
-        "version": 1,
-        "disable_existing_loggers": False,
-        "formatters": {
-            "default": {"style": "{", "format": "{levelname}:{name}:{message}"},
-            "display": {"style": "{", "format": "{message}"},
-            "timestamp": {"style": "{", "format": "[{asctime}][{levelname}] {name}: {message}"},
-        },
-        "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stderr",
-                "formatter": "display",
-            },
-            "file": {"class": "logging.FileHandler", "filename": "", "formatter": "timestamp"},
-        },
-        "loggers": {
-            "subtreeutil.core": {"handlers": ["console", "file"]},
-            "subtreeutil.config": {"handlers": ["console", "file"]},
-            "subtreeutil.command": {"handlers": ["console", "file"]},
-        },
-        "root": {"level": "INFO"},
-    }
+    Loggers only place records on a queue. A background listener thread formats them
+    and writes them to the console and to a rotating log file, so log I/O does not slow
+    down checkouts.
+
+    Returns:
+      The started QueueListener. Stop it before exiting to flush pending records.
+    """
 
     path = Path(__file__).parent
     log_path = path / 'logs' / 'subtreeutil.log'
@@ -158,11 +460,32 @@ def configure_log():
     if not log_path.parent.exists():
         log_path.parent.mkdir(parents=True)
 
-    log_config['handlers']['file']['filename'] = log_path
-    logging.config.dictConfig(log_config)
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter(_DISPLAY_FORMAT, style='{'))
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_path, maxBytes=_LOG_MAX_BYTES, backupCount=_LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter(_TIMESTAMP_FORMAT, style='{'))
+
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
+    )
+
+    # Note: Attaching the queue handler to the package logger covers every module's logger.
+    package_log = logging.getLogger('subtreeutil')
+    package_log.addHandler(logging.handlers.QueueHandler(log_queue))
+    logging.getLogger().setLevel(logging.INFO)
+
+    listener.start()
+    return listener
 
 
 if __name__ == '__main__':
-    configure_log()
-    main()
-    logging.shutdown()
+    log_listener = configure_log()
+    try:
+        main()
+    finally:
+        log_listener.stop()
+        logging.shutdown()
@@ -0,0 +1,499 @@
+"""Exports configurations' sources to tar archives and imports them on other machines.
+
+An export reads files straight from fetched commits, applies each configuration's
+destination paths and cleanup paths, and streams them into a tar archive without
+touching the working tree. Archives can be compressed with gzip or, if the
+'zstandard' package is installed, zstd. Importing an archive writes its files in
+parallel with a pool of worker threads.
+"""
+
+import concurrent.futures
+import contextlib
+import io
+import json
+import logging
+import os
+import posixpath
+import sys
+import tarfile
+import threading
+import time
+
+from pathlib import Path, PurePosixPath
+
+from . import blobstore
+
+try:
+    import zstandard
+except ImportError:
+    # Note: zstd compression is optional.
+    zstandard = None
+
+
+# Name of the archive member describing the export
+_METADATA_NAME = '.subtreeutil-export.json'
+
+# Archive suffixes and the compression they imply
+_COMPRESSION_SUFFIXES = {
+    '.gz': 'gzip',
+    '.tgz': 'gzip',
+    '.zst': 'zstd',
+    '.tzst': 'zstd',
+}
+
+# Magic number at the start of zstd frames
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Maximum number of files read from an archive that may wait for a worker to write them
+_PENDING_FILES_PER_WORKER = 8
+
+
+archive_log = logging.getLogger('subtreeutil.archive')
+
+
+class ArchiveError(Exception):
+    """Base error for archive module exceptions."""
+
+
+class UnsafeArchiveError(ArchiveError):
+    """An archive member would be written outside of the destination folder."""
+
+
+class ArchiveEntry:
+    """A file to write to an archive.
+
+    Attributes:
+      blob: The Blob object holding the file's contents.
+      name: The file's path in the archive, relative to the repository's root folder.
+      object_path: A Path object for a file whose contents are written instead of the
+        blob's, such as the Git LFS object a pointer blob points to, or None.
+    """
+
+    __slots__ = ('blob', 'name', 'object_path')
+
+    def __init__(self, blob, name, object_path=None):
+        self.blob = blob
+        self.name = name
+        self.object_path = object_path
+
+    def __repr__(self):
+        return (
+            f'ArchiveEntry(blob={self.blob!r}, name={self.name!r}, '
+            f'object_path={self.object_path!r})'
+        )
+
+
+def get_compression(archive_path):
+    """Fetches the compression implied by an archive's file name.
+
+    Args:
+      archive_path: The archive's path.
+
+    Returns:
+      'gzip', 'zstd' or 'none'.
+    """
+
+    return _COMPRESSION_SUFFIXES.get(Path(archive_path).suffix.lower(), 'none')
+
+
+def check_compression(compression):
+    """Checks whether a compression is available.
+
+    Args:
+      compression: 'none', 'gzip' or 'zstd'.
+
+    Raises:
+      ArchiveError: The compression is unknown or its package is not installed.
+    """
+
+    if compression not in ('none', 'gzip', 'zstd'):
+        archive_log.error(f'Unknown compression \'{compression}\'')
+        raise ArchiveError(f'Unknown compression \'{compression}\'')
+
+    if compression == 'zstd' and zstandard is None:
+        archive_log.error('zstd compression requires the \'zstandard\' package')
+        raise ArchiveError('zstd compression requires the \'zstandard\' package')
+
+
+def get_member_name(path):
+    """Converts a configuration path to an archive member name.
+
+    Args:
+      path: A path relative to the repository's root folder.
+
+    Returns:
+      The normalized path with forward slashes.
+
+    Raises:
+      UnsafeArchiveError: The path is absolute or outside of the repository.
+    """
+
+    name = posixpath.normpath(str(path).replace('\\', '/'))
+    if PurePosixPath(name).is_absolute() or name == '..' or name.startswith('../'):
+        raise UnsafeArchiveError(f'\'{path}\' can not be exported, it is not in the repository')
+
+    return name
+
+
+def list_entries(commit_hash, source_paths, destination_paths, cleanup_paths, cwd=None):
+    """Lists the files a checkout of a commit would leave in the working tree.
+
+    Sources are mapped to their destination paths, or kept at their source paths if
+    no destination paths are defined. Files inside cleanup paths are excluded.
+
+    Args:
+      commit_hash: The fetched commit hash to export.
+      source_paths: A list of source file and folder paths.
+      destination_paths: A list of destination paths matching the source paths.
+      cleanup_paths: A list of paths to exclude.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A list of ArchiveEntry objects.
+
+    Raises:
+      UnsafeArchiveError: A destination path is absolute or outside of the repository.
+    """
+
+    excluded = [get_member_name(cleanup_path) for cleanup_path in cleanup_paths]
+
+    entries = []
+    for source_path, destination_path in zip(source_paths, destination_paths or source_paths):
+        source_path = Path(source_path)
+        destination_name = get_member_name(destination_path)
+
+        blobs = blobstore.list_blobs(commit_hash, source_path, cwd)
+        if not blobs:
+            archive_log.warning(f'\'{source_path}\' does not exist in {commit_hash}')
+            continue
+
+        for blob in blobs:
+            if len(blobs) == 1 and blob.path == source_path:
+                name = destination_name
+            else:
+                relative_name = blob.path.relative_to(source_path).as_posix()
+                name = posixpath.join(destination_name, relative_name)
+
+            if not any(_is_inside(name, excluded_name) for excluded_name in excluded):
+                entries.append(ArchiveEntry(blob, name))
+
+    return entries
+
+
+def write_archive(archive_path, exports, compression='none', cwd=None):
+    """Streams exported files into a tar archive.
+
+    The archive is written to a temporary file and renamed into place once complete.
+
+    Args:
+      archive_path: The archive's path, or '-' to write to standard output.
+      exports: A list of tuples containing a dictionary describing each export and its
+        list of ArchiveEntry objects.
+      compression:  (Default value = 'none') 'none', 'gzip' or 'zstd'.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      The number of files written to the archive.
+
+    Raises:
+      ArchiveError: The compression is not available.
+    """
+
+    check_compression(compression)
+
+    if archive_path == '-':
+        return _write_tar(sys.stdout.buffer, exports, compression, cwd)
+
+    archive_path = Path(archive_path)
+    temporary_path = archive_path.with_name(f'{archive_path.name}.{os.getpid()}.tmp')
+
+    try:
+        with temporary_path.open('wb') as f:
+            count = _write_tar(f, exports, compression, cwd)
+
+        temporary_path.replace(archive_path)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+
+    archive_log.info(f'Exported {count} file(s) to \'{archive_path}\'')
+    return count
+
+
+def import_archive(archive_path, destination_folder: Path, workers=None):
+    """Writes the files in an archive to a destination folder.
+
+    Members are read from the archive in order and written by a pool of worker
+    threads. Each file is written to a temporary file and renamed into place.
+
+    Args:
+      archive_path: The archive's path, or '-' to read from standard input.
+      destination_folder: Path: A Path object for the folder to write files to,
+        usually the local repository's root folder.
+      workers:  (Default value = None) The maximum number of files to write at once.
+        Defaults to the number of processors.
+
+    Returns:
+      A tuple containing a list of the export dictionaries recorded in the archive and
+      a list of Path objects for the files written.
+
+    Raises:
+      ArchiveError: The archive could not be read or a file could not be written.
+      UnsafeArchiveError: A member would be written outside of the destination folder.
+    """
+
+    workers = workers or os.cpu_count()
+    destination_folder = Path(destination_folder).resolve()
+
+    if archive_path == '-':
+        stream = io.BufferedReader(sys.stdin.buffer)
+    else:
+        stream = open(archive_path, 'rb')
+
+    exports = []
+    written = []
+    pending = threading.BoundedSemaphore(workers * _PENDING_FILES_PER_WORKER)
+
+    try:
+        with _open_tar(stream) as tar, concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = []
+
+            def submit(function, *args):
+                pending.acquire()
+                future = executor.submit(function, *args)
+                future.add_done_callback(lambda f: pending.release())
+                futures.append(future)
+
+            links = set()
+            for member in tar:
+                if member.name == _METADATA_NAME:
+                    exports = json.load(tar.extractfile(member))['exports']
+                    continue
+
+                # Note: Never write through a link the archive created.
+                name = posixpath.normpath(member.name)
+                if any(str(parent) in links for parent in PurePosixPath(name).parents):
+                    raise UnsafeArchiveError(f'Archive member \'{name}\' is inside a link')
+
+                path = _get_destination(destination_folder, name)
+
+                if member.isdir():
+                    path.mkdir(parents=True, exist_ok=True)
+                elif member.issym():
+                    links.add(name)
+                    submit(_write_symlink, path, member.linkname)
+                    written.append(path)
+                elif member.isfile():
+                    submit(_write_file, path, tar.extractfile(member).read(), member.mode)
+                    written.append(path)
+                else:
+                    archive_log.warning(f'Skipping unsupported archive member \'{member.name}\'')
+
+            for future in futures:
+                future.result()
+    except (tarfile.TarError, ValueError) as exception:
+        archive_log.error(f'Unable to read archive \'{archive_path}\', {exception}')
+        raise ArchiveError(f'Unable to read archive \'{archive_path}\'') from exception
+    except OSError as exception:
+        # Note: Includes errors raised by the workers writing files.
+        archive_log.error(f'Unable to import archive \'{archive_path}\', {exception}')
+        raise ArchiveError(f'Unable to import archive \'{archive_path}\'') from exception
+    finally:
+        stream.close()
+
+    for export in exports:
+        archive_log.info(
+            f'Imported {export["remote_url"]} {export["branch"]} ({export["commit"]})'
+        )
+
+    archive_log.info(f'Imported {len(written)} file(s) to \'{destination_folder}\'')
+    return exports, written
+
+
+def _write_tar(stream, exports, compression, cwd):
+    """Writes exported files to a stream as a tar archive.
+
+    Args:
+      stream: A binary file-like object to write to.
+      exports: A list of tuples containing a dictionary describing each export and its
+        list of ArchiveEntry objects.
+      compression: 'none', 'gzip' or 'zstd'.
+      cwd: The local repository's root folder.
+
+    Returns:
+      The number of files written to the archive.
+    """
+
+    compressor = None
+    if compression == 'zstd':
+        compressor = zstandard.ZstdCompressor(threads=-1).stream_writer(stream, closefd=False)
+        stream = compressor
+
+    mode = 'w|gz' if compression == 'gzip' else 'w|'
+
+    count = 0
+    with tarfile.open(fileobj=stream, mode=mode, format=tarfile.PAX_FORMAT) as tar:
+        metadata = json.dumps({'exports': [export for export, _ in exports]}, indent=4)
+        _add_member(tar, _METADATA_NAME, metadata.encode('utf-8'), 0o644, time.time())
+
+        for export, entries in exports:
+            mtime = export.get('time', 0)
+
+            # Note: Entries written from other files do not need their blobs read.
+            blobs = [entry.blob for entry in entries if entry.object_path is None]
+            with contextlib.closing(blobstore.read_blobs(blobs, cwd)) as contents_reader:
+                for entry in entries:
+                    mode = 0o755 if entry.blob.is_executable else 0o644
+                    if entry.object_path is not None:
+                        _add_file(tar, entry.name, entry.object_path, mode, mtime)
+                    else:
+                        blob, contents = next(contents_reader)
+                        if blob.is_symlink:
+                            link_target = contents.decode('utf-8')
+                            _add_member(tar, entry.name, b'', 0o777, mtime, link_target)
+                        else:
+                            _add_member(tar, entry.name, contents, mode, mtime)
+
+                    count += 1
+
+    if compressor is not None:
+        compressor.close()
+
+    return count
+
+
+def _add_member(tar, name, contents, mode, mtime, link_target=None):
+    """Adds a file or symbolic link to a tar archive.
+
+    Args:
+      tar: The TarFile object to add to.
+      name: The member's name.
+      contents: The file's contents as bytes.
+      mode: The file's permissions.
+      mtime: The member's modification time as a Unix timestamp.
+      link_target:  (Default value = None) The target of a symbolic link.
+    """
+
+    info = tarfile.TarInfo(name)
+    info.mode = mode
+    info.mtime = int(mtime)
+
+    if link_target is not None:
+        info.type = tarfile.SYMTYPE
+        info.linkname = link_target
+        tar.addfile(info)
+        return
+
+    info.size = len(contents)
+    tar.addfile(info, io.BytesIO(contents))
+
+
+def _add_file(tar, name, file_path: Path, mode, mtime):
+    """Streams a file into a tar archive without reading it into memory.
+
+    Args:
+      tar: The TarFile object to add to.
+      name: The member's name.
+      file_path: Path: A Path object for the file to add.
+      mode: The member's permissions.
+      mtime: The member's modification time as a Unix timestamp.
+    """
+
+    info = tarfile.TarInfo(name)
+    info.mode = mode
+    info.mtime = int(mtime)
+
+    with file_path.open('rb') as f:
+        info.size = os.fstat(f.fileno()).st_size
+        tar.addfile(info, f)
+
+
+def _open_tar(stream):
+    """Opens a possibly compressed tar archive for streamed reading.
+
+    Args:
+      stream: A buffered binary file-like object to read from.
+
+    Returns:
+      A TarFile object.
+
+    Raises:
+      ArchiveError: The archive is zstd compressed and zstandard is not installed.
+    """
+
+    if stream.peek(4)[:4] == _ZSTD_MAGIC:
+        check_compression('zstd')
+
+        return tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(stream), mode='r|')
+
+    return tarfile.open(fileobj=stream, mode='r|*')
+
+
+def _is_inside(name, folder_name):
+    """Checks whether an archive member name is, or is inside, another.
+
+    Args:
+      name: The member name to check.
+      folder_name: The member name of the folder.
+
+    Returns:
+      True if the names are equal or the first is inside the second.
+    """
+
+    return folder_name == '.' or name == folder_name or name.startswith(folder_name + '/')
+
+
+def _get_destination(destination_folder: Path, name):
+    """Fetches the path an archive member is written to.
+
+    Args:
+      destination_folder: Path: A resolved Path object for the destination folder.
+      name: The member's name.
+
+    Returns:
+      A Path object for the member's destination.
+
+    Raises:
+      UnsafeArchiveError: The member would be written outside of the destination
+        folder.
+    """
+
+    path = Path(os.path.normpath(os.path.join(str(destination_folder), name)))
+    if path != destination_folder and destination_folder not in path.parents:
+        raise UnsafeArchiveError(f'Archive member \'{name}\' is outside of the destination')
+
+    return path
+
+
+def _write_file(path: Path, contents, mode):
+    """Atomically writes a file.
+
+    Args:
+      path: Path: A Path object for the file.
+      contents: The file's contents as bytes.
+      mode: The file's permissions.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    temporary_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with temporary_path.open('wb') as f:
+        f.write(contents)
+
+    os.chmod(temporary_path, mode & 0o777)
+    temporary_path.replace(path)
+
+
+def _write_symlink(path: Path, target):
+    """Atomically creates a symbolic link.
+
+    Args:
+      path: Path: A Path object for the link.
+      target: The link's target.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    temporary_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    os.symlink(target, str(temporary_path))
+    temporary_path.replace(path)
@@ -0,0 +1,447 @@
+"""Materializes checked out files from a shared, content-addressed blob store.
+
+The store keeps one read-only file per git blob id, so working copies on the same
+host that sync identical files share a single copy of their contents. Destination
+files are reflinked from the store where the file system supports it, hard linked if
+allowed, and copied otherwise.
+"""
+
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+
+from pathlib import Path
+
+from . import command as commandutil
+
+
+# Folder (relative to the store) holding blob files
+_OBJECTS_FOLDER = 'objects'
+
+# Suffix distinguishing executable blobs, which need their own file when hard linked
+_EXECUTABLE_SUFFIX = '.x'
+
+# Git tree entry modes
+_MODE_EXECUTABLE = '100755'
+_MODE_SYMLINK = '120000'
+_MODE_SUBMODULE = '160000'
+
+
+blobstore_log = logging.getLogger('subtreeutil.blobstore')
+
+
+class BlobStoreError(Exception):
+    """Base error for blob store module exceptions."""
+
+
+class BlobReadError(BlobStoreError):
+    """An error occurred while reading blobs from the local repository."""
+
+
+class BlobWriteError(BlobStoreError):
+    """An error occurred while writing blobs to the store."""
+
+
+class Blob:
+    """A file entry of a git tree.
+
+    Attributes:
+      mode: The entry's git file mode.
+      blob_id: The entry's git blob id.
+      path: A Path object for the entry's path relative to the repository root.
+    """
+
+    __slots__ = ('mode', 'blob_id', 'path')
+
+    def __init__(self, mode, blob_id, path: Path):
+        self.mode = mode
+        self.blob_id = blob_id
+        self.path = path
+
+    @property
+    def is_executable(self):
+        return self.mode == _MODE_EXECUTABLE
+
+    @property
+    def is_symlink(self):
+        return self.mode == _MODE_SYMLINK
+
+
+def list_blobs(commit_hash, source_path: Path, cwd=None):
+    """Executes a 'git ls-tree' command to list the files under a source path.
+
+    Args:
+      commit_hash: The commit hash to list files from.
+      source_path: Path: A Path object for the file or folder to list, relative to the
+        repository's root folder.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A list of Blob objects. Submodule entries are skipped.
+    """
+
+    command = ['git', 'ls-tree', '-r', '-z', '--full-tree', commit_hash, '--', str(source_path)]
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+
+    blobs = []
+    for entry in o.split('\0'):
+        if not entry:
+            continue
+
+        metadata, path = entry.split('\t', 1)
+        mode, object_type, blob_id = metadata.split(' ')
+        if mode == _MODE_SUBMODULE:
+            continue
+
+        blobs.append(Blob(mode, blob_id, Path(path)))
+
+    return blobs
+
+
+def get_blob_path(store_folder: Path, blob: Blob):
+    """Fetches the path of a blob's file in the store.
+
+    Args:
+      store_folder: Path: A Path object for the blob store.
+      blob: Blob: The blob to locate.
+
+    Returns:
+      A Path object for the blob's file.
+    """
+
+    name = blob.blob_id[2:]
+    if blob.is_executable:
+        name += _EXECUTABLE_SUFFIX
+
+    return store_folder / _OBJECTS_FOLDER / blob.blob_id[:2] / name
+
+
+def add_blobs(store_folder: Path, blobs, cwd=None):
+    """Adds blobs missing from the store by reading them from the local repository.
+
+    Missing blobs are read with a single 'git cat-file --batch' process.
+
+    Args:
+      store_folder: Path: A Path object for the blob store.
+      blobs: A list of Blob objects to add.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      The number of blobs added to the store.
+
+    Raises:
+      BlobReadError: A blob could not be read from the local repository.
+      BlobWriteError: An OSError occurred while writing a blob to the store.
+    """
+
+    missing = {}
+    for blob in blobs:
+        blob_path = get_blob_path(store_folder, blob)
+        if not blob.is_symlink and not blob_path.exists():
+            missing[blob_path] = blob
+
+    if not missing:
+        return 0
+
+    blobstore_log.info(f'Adding {len(missing)} blob(s) to \'{store_folder}\'')
+
+    # Note: Closing the reader as soon as a write fails stops its 'git cat-file' process.
+    with contextlib.closing(read_blobs(missing.values(), cwd)) as contents_reader:
+        for blob_path, (blob, contents) in zip(missing, contents_reader):
+            try:
+                _write_blob(blob_path, contents, blob.is_executable)
+            except OSError as exception:
+                blobstore_log.warning(f'Unable to write blob \'{blob_path}\', {exception}')
+                raise BlobWriteError(f'Unable to write blob \'{blob_path}\', {exception}')
+
+    return len(missing)
+
+
+def read_blobs(blobs, cwd=None):
+    """Reads the contents of blobs from the local repository.
+
+    Blobs are read with a single 'git cat-file --batch' process.
+
+    Args:
+      blobs: A list of Blob objects to read.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A generator of tuples containing each Blob object and its contents as bytes, in
+      the order the blobs were given.
+
+    Raises:
+      BlobReadError: A blob could not be read from the local repository.
+    """
+
+    blobs = list(blobs)
+    if not blobs:
+        return
+
+    process = commandutil.open_command(['git', 'cat-file', '--batch'], display=False, cwd=cwd)
+
+    # Note: Write requests from a separate thread so that a full stdout pipe can not
+    # block the process while we are still writing to it.
+    requests = ''.join(f'{blob.blob_id}\n' for blob in blobs).encode('ascii')
+    writer = threading.Thread(target=_write_requests, args=(process, requests))
+    writer.start()
+
+    try:
+        for blob in blobs:
+            header = process.stdout.readline().decode('ascii').split()
+            if len(header) != 3 or header[1] != 'blob':
+                message = f'Unable to read blob \'{blob.blob_id}\' ({" ".join(header)})'
+                blobstore_log.warning(message)
+                raise BlobReadError(message)
+
+            contents = process.stdout.read(int(header[2]))
+            process.stdout.read(1)
+            yield blob, contents
+    finally:
+        # Note: Closing stdout first unblocks the writer if reading stopped early.
+        process.stdout.close()
+        writer.join()
+        process.wait()
+
+
+def read_blob_sizes(blobs, cwd=None):
+    """Reads the sizes of blobs from the local repository without reading their
+    contents.
+
+    Blobs are looked up with a single 'git cat-file --batch-check' process.
+
+    Args:
+      blobs: A list of Blob objects to look up.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A dictionary mapping each blob id to the blob's size in bytes.
+
+    Raises:
+      BlobReadError: A blob could not be found in the local repository.
+    """
+
+    blob_ids = list(dict.fromkeys(blob.blob_id for blob in blobs))
+    if not blob_ids:
+        return {}
+
+    command = ['git', 'cat-file', '--batch-check']
+    process = commandutil.open_command(command, display=False, cwd=cwd)
+
+    requests = ''.join(f'{blob_id}\n' for blob_id in blob_ids).encode('ascii')
+    writer = threading.Thread(target=_write_requests, args=(process, requests))
+    writer.start()
+
+    sizes = {}
+    try:
+        for blob_id in blob_ids:
+            header = process.stdout.readline().decode('ascii').split()
+            if len(header) != 3 or header[1] != 'blob':
+                message = f'Unable to read blob \'{blob_id}\' ({" ".join(header)})'
+                blobstore_log.warning(message)
+                raise BlobReadError(message)
+
+            sizes[blob_id] = int(header[2])
+    finally:
+        process.stdout.close()
+        writer.join()
+        process.wait()
+
+    return sizes
+
+
+def read_symlink_target(blob: Blob, cwd=None):
+    """Executes a 'git cat-file' command to read a symbolic link blob's target.
+
+    Args:
+      blob: Blob: The symbolic link blob to read.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A string containing the link's target.
+    """
+
+    command = ['git', 'cat-file', 'blob', blob.blob_id]
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+    return o
+
+
+def materialize_blob(
+    store_folder: Path, blob: Blob, destination_file: Path, hardlink=False, cwd=None
+):
+    """Writes a blob from the store to a destination file.
+
+    Args:
+      store_folder: Path: A Path object for the blob store.
+      blob: Blob: The blob to write.
+      destination_file: Path: A Path object for the file to write.
+      hardlink:  (Default value = False) Allows hard linking the destination to the
+        store if True.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A string naming how the file was written: 'reflink', 'hardlink', 'copy' or
+      'symlink', or 'unchanged' if the destination is already hard linked to the blob.
+
+    Raises:
+      MoveCommandError: An OSError occurred while attempting to write the file.
+    """
+
+    if blob.is_symlink:
+        try:
+            if destination_file.is_symlink() or destination_file.exists():
+                destination_file.unlink()
+
+            destination_file.parent.mkdir(parents=True, exist_ok=True)
+            os.symlink(read_symlink_target(blob, cwd), destination_file)
+        except OSError as exception:
+            blobstore_log.warning(f'Unable to write \'{destination_file}\', {exception}')
+            raise commandutil.MoveCommandError(
+                f'Unable to write \'{destination_file}\', {exception}'
+            )
+
+        return 'symlink'
+
+    blob_path = get_blob_path(store_folder, blob)
+    if hardlink and _is_same_file(blob_path, destination_file):
+        return 'unchanged'
+
+    mode = 0o755 if blob.is_executable else 0o644
+    return commandutil.materialize_file(blob_path, destination_file, hardlink, mode)
+
+
+def get_store_size(store_folder: Path):
+    """Fetches the total size of the blob files in the store.
+
+    Args:
+      store_folder: Path: A Path object for the blob store.
+
+    Returns:
+      The store's size in bytes.
+    """
+
+    return sum(stat.st_size for path, stat in _list_blob_files(store_folder))
+
+
+def collect_garbage(store_folder: Path, size_limit):
+    """Deletes blobs from the store until it is no larger than a size limit.
+
+    Blobs that are not hard linked into any working copy are deleted before those that
+    are, and older blobs are deleted before newer ones. Deleting a hard linked blob
+    does not affect the working copies linked to it.
+
+    Args:
+      store_folder: Path: A Path object for the blob store.
+      size_limit: The store's maximum size in bytes.
+
+    Returns:
+      The number of blobs deleted.
+    """
+
+    blob_files = _list_blob_files(store_folder)
+    store_size = sum(stat.st_size for path, stat in blob_files)
+    if store_size <= size_limit:
+        return 0
+
+    blob_files.sort(key=lambda item: (item[1].st_nlink > 1, item[1].st_mtime))
+
+    deleted = 0
+    for path, stat in blob_files:
+        if store_size <= size_limit:
+            break
+
+        try:
+            os.chmod(path, 0o644)
+            path.unlink()
+        except OSError as exception:
+            blobstore_log.warning(f'Unable to delete blob \'{path}\', {exception}')
+            continue
+
+        store_size -= stat.st_size
+        deleted += 1
+
+    blobstore_log.info(f'Deleted {deleted} blob(s) from \'{store_folder}\'')
+    return deleted
+
+
+def _list_blob_files(store_folder: Path):
+    """Lists the blob files in the store.
+
+    Args:
+      store_folder: Path: A Path object for the blob store.
+
+    Returns:
+      A list of (Path, os.stat_result) tuples.
+    """
+
+    objects_folder = store_folder / _OBJECTS_FOLDER
+    if not objects_folder.exists():
+        return []
+
+    return [(path, path.stat()) for path in objects_folder.glob('*/*') if path.is_file()]
+
+
+def _is_same_file(first_path: Path, second_path: Path):
+    """Checks whether two paths are links to the same file.
+
+    Args:
+      first_path: Path: A Path object for the first file.
+      second_path: Path: A Path object for the second file.
+
+    Returns:
+      True if both paths exist and refer to the same file.
+    """
+
+    try:
+        return os.path.samefile(first_path, second_path)
+    except OSError:
+        return False
+
+
+def _write_requests(process, requests):
+    """Writes blob requests to a 'git cat-file' process and closes its input.
+
+    Args:
+      process: The Popen object for the process.
+      requests: Bytes containing one blob id per line.
+    """
+
+    # Note: The process exits early, closing its input, if reading stopped early.
+    try:
+        process.stdin.write(requests)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def _write_blob(blob_path: Path, contents, executable):
+    """Atomically writes a read-only blob file to the store.
+
+    Args:
+      blob_path: Path: A Path object for the blob file.
+      contents: The blob's contents.
+      executable: Marks the blob file as executable if True.
+    """
+
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Note: Threads and processes adding the same blob each write their own temporary file.
+    fd, temporary_name = tempfile.mkstemp(
+        suffix='.tmp', prefix=f'{blob_path.name}.', dir=blob_path.parent
+    )
+    temporary_path = Path(temporary_name)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(contents)
+
+        os.chmod(temporary_path, 0o555 if executable else 0o444)
+        temporary_path.replace(blob_path)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
@@ -0,0 +1,155 @@
+"""Reads git bundle files used to seed fetches without reaching a remote URL.
+
+A bundle's header lists the commits it requires to already be present in the local
+repository (its prerequisites) and the refs it contains. Full bundles have no
+prerequisites, while incremental bundles only contain the commits made since their
+prerequisites and can only be fetched once those commits have been fetched.
+"""
+
+import re
+
+from pathlib import Path
+
+
+# Signatures at the start of the supported bundle formats
+_SIGNATURES = {
+    b'# v2 git bundle\n': 2,
+    b'# v3 git bundle\n': 3,
+}
+
+# Maximum size of a bundle header in bytes
+_MAX_HEADER_SIZE = 16 * 1024 * 1024
+
+# Matches prerequisite and ref lines in a bundle header
+_PREREQUISITE_PATTERN = re.compile(r'^-(?P<oid>[0-9a-f]{40,64})(?: .*)?$')
+_REF_PATTERN = re.compile(r'^(?P<oid>[0-9a-f]{40,64}) (?P<ref>\S+)$')
+
+
+class BundleError(Exception):
+    """Base error for bundle module exceptions."""
+
+
+class InvalidBundleError(BundleError):
+    """A file is not a readable git bundle."""
+
+
+class BundleHeader:
+    """The header of a git bundle file.
+
+    Attributes:
+      version: The bundle format version.
+      capabilities: A dictionary of the bundle's capabilities, such as 'object-format'.
+      prerequisites: A list of commit hashes that must be present to fetch the bundle.
+      refs: A dictionary mapping the bundle's ref names to commit hashes.
+    """
+
+    __slots__ = ('version', 'capabilities', 'prerequisites', 'refs')
+
+    def __init__(self, version, capabilities=None, prerequisites=None, refs=None):
+        self.version = version
+        self.capabilities = capabilities or {}
+        self.prerequisites = prerequisites or []
+        self.refs = refs or {}
+
+    def __repr__(self):
+        return (
+            f'BundleHeader(version={self.version}, prerequisites={len(self.prerequisites)}, '
+            f'refs={sorted(self.refs)})'
+        )
+
+    @property
+    def is_incremental(self):
+        """True if the bundle requires commits to already be present."""
+
+        return bool(self.prerequisites)
+
+
+def read_bundle_header(bundle_path: Path):
+    """Reads the header of a git bundle file.
+
+    Args:
+      bundle_path: Path: A Path object for the bundle file.
+
+    Returns:
+      A BundleHeader object.
+
+    Raises:
+      InvalidBundleError: The file is not a readable git bundle.
+    """
+
+    try:
+        with bundle_path.open('rb') as f:
+            version = _SIGNATURES.get(f.readline(64))
+            if version is None:
+                raise InvalidBundleError(f'\'{bundle_path}\' is not a git bundle')
+
+            header = BundleHeader(version)
+            size = 0
+            for line in iter(f.readline, b''):
+                size += len(line)
+                if size > _MAX_HEADER_SIZE:
+                    raise InvalidBundleError(f'\'{bundle_path}\' has an invalid header')
+
+                line = line.decode('utf-8').rstrip('\n')
+                if not line:
+                    return header
+
+                _parse_header_line(header, line, bundle_path)
+    except (OSError, UnicodeDecodeError) as exception:
+        raise InvalidBundleError(f'Unable to read bundle \'{bundle_path}\'') from exception
+
+    raise InvalidBundleError(f'\'{bundle_path}\' is truncated')
+
+
+def get_branch_refs(header: BundleHeader, namespace):
+    """Fetches the refs in a bundle that hold branches.
+
+    Both ordinary branch refs ('refs/heads/<branch>') and refs in a private ref
+    namespace ('<namespace>/<branch>') are recognized.
+
+    Args:
+      header: BundleHeader: The bundle's header.
+      namespace: The private ref namespace of the remote the bundle belongs to.
+
+    Returns:
+      A dictionary mapping branch names to the ref names holding them. Namespace refs
+      take precedence over ordinary branch refs.
+    """
+
+    branches = {}
+    for prefix in ('refs/heads/', f'{namespace}/'):
+        for ref in header.refs:
+            if ref.startswith(prefix):
+                branches[ref[len(prefix) :]] = ref
+
+    return branches
+
+
+def _parse_header_line(header: BundleHeader, line, bundle_path: Path):
+    """Parses a capability, prerequisite or ref line of a bundle header.
+
+    Args:
+      header: BundleHeader: The header to add the line's contents to.
+      line: The line without its line ending.
+      bundle_path: Path: A Path object for the bundle file, used for error messages.
+
+    Raises:
+      InvalidBundleError: The line is not valid.
+    """
+
+    if header.version >= 3 and line.startswith('@'):
+        key, _, value = line[1:].partition('=')
+        header.capabilities[key] = value
+        return
+
+    match = _PREREQUISITE_PATTERN.match(line)
+    if match is not None:
+        header.prerequisites.append(match.group('oid'))
+        return
+
+    match = _REF_PATTERN.match(line)
+    if match is not None:
+        header.refs[match.group('ref')] = match.group('oid')
+        return
+
+    raise InvalidBundleError(f'\'{bundle_path}\' has an invalid header line \'{line}\'')
@@ -1,11 +1,55 @@
 """Executes commands using the subprocess module and handles OS level operations."""
 
+import ctypes
+import ctypes.util
+import errno
 import logging
 import os
+import re
 import subprocess
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Note: fcntl is not available on Windows.
+    fcntl = None
 
 from pathlib import Path
-from shutil import rmtree
+from shutil import copy2, rmtree
+
+
+# Maximum number of characters of a command's output to log
+_OUTPUT_LOG_LIMIT = 4096
+
+# Number of bytes to read at a time when streaming a command's output
+_STREAM_CHUNK_SIZE = 8192
+
+# Suffix appended to a destination folder's name to create its staging folder
+_STAGING_SUFFIX = '.subtreeutil-staging'
+
+# Suffix appended to a destination folder's name while swapping it without an atomic
+# exchange
+_BACKUP_SUFFIX = '.subtreeutil-backup'
+
+# Flags for exchanging two paths with renameat2() (Linux) and renamex_np() (macOS)
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+_RENAME_SWAP = 2
+
+# ioctl request for cloning a file on Linux
+_FICLONE = 0x40049409
+
+# Suffix appended to a file's name while it is being written
+_TEMPORARY_SUFFIX = '.subtreeutil-tmp'
+
+
+_libc = None
+
+# Number of subprocesses started by this process
+_subprocess_count = 0
+_subprocess_count_lock = threading.Lock()
 
 
 command_log = logging.getLogger('subtreeutil.command')
@@ -23,7 +67,7 @@ class DeleteCommandError(CommandError):
     """An error occured while attempting to delete a file or folder."""
 
 
-def execute_command(command: list, display=True):
+def execute_command(command: list, display=True, cwd=None):
     """Executes a command process using the subprocesses module.
 
     Used primarily for executing git commands.
@@ -31,28 +75,153 @@ def execute_command(command: list, display=True):
     Args:
       command: list: The command to execute.
       display:  (Default value = True) Displays the command parameter in the console if True.
+      cwd:  (Default value = None) The folder to execute the command in. Defaults to the
+        current working directory.
 
     Returns:
         A tuple containing stdout and stderr for the executed command.
     """
 
-    if display:
-        command_log.info(' '.join(command))
-    else:
-        command_log.debug(' '.join(command))
+    level = logging.INFO if display else logging.DEBUG
+    if command_log.isEnabledFor(level):
+        command_log.log(level, ' '.join(command))
 
-    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+    _count_subprocess()
+    with subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd
+    ) as process:
         o, e = process.communicate()
 
-    if display and o:
-        command_log.info(o.decode('ascii'))
-    else:
-        command_log.debug(o.decode('ascii'))
+    o = o.decode('utf-8', errors='replace')
+    e = e.decode('utf-8', errors='replace')
+
+    # Note: Only truncate and log output when it would actually be emitted, as listing
+    # commands can produce megabytes of it.
+    level = logging.INFO if display and o else logging.DEBUG
+    if o and command_log.isEnabledFor(level):
+        command_log.log(level, truncate_output(o))
 
     if e:
-        command_log.error(e.decode('ascii'))
+        command_log.error(truncate_output(e))
+
+    return o, e
+
+
+def execute_command_streamed(command: list, line_callback, display=True, cwd=None):
+    """Executes a command process, passing each line of its stderr to a callback as it
+    is written.
+
+    Used for git commands run with '--progress', which rewrite their progress line
+    in place using carriage returns. Each rewrite is passed to the callback as a line.
+
+    Args:
+      command: list: The command to execute.
+      line_callback: A callable receiving each line of stderr as a string.
+      display:  (Default value = True) Displays the command parameter in the console if True.
+      cwd:  (Default value = None) The folder to execute the command in. Defaults to the
+        current working directory.
 
-    return o.decode('ascii'), e.decode('ascii')
+    Returns:
+        A tuple containing stdout and stderr for the executed command. Progress
+        rewrites are collapsed so that stderr only contains each line's final text.
+    """
+
+    level = logging.INFO if display else logging.DEBUG
+    if command_log.isEnabledFor(level):
+        command_log.log(level, ' '.join(command))
+
+    _count_subprocess()
+    with subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd
+    ) as process:
+        stdout = []
+        reader = threading.Thread(target=lambda: stdout.append(process.stdout.read()))
+        reader.start()
+
+        lines = []
+        pending = b''
+        for chunk in iter(lambda: process.stderr.read1(_STREAM_CHUNK_SIZE), b''):
+            pending += chunk
+            *complete, pending = re.split(rb'(\r|\n)', pending)
+
+            # Note: re.split() keeps separators at odd indices, so complete lines pair
+            # with the separator that ended them.
+            for text, separator in zip(complete[::2], complete[1::2]):
+                line = text.decode('utf-8', errors='replace')
+                line_callback(line)
+                if separator == b'\n':
+                    lines.append(line)
+
+        if pending:
+            line = pending.decode('utf-8', errors='replace')
+            line_callback(line)
+            lines.append(line)
+
+        reader.join()
+        process.wait()
+
+    o = stdout[0].decode('utf-8', errors='replace')
+    e = '\n'.join(line for line in lines if line)
+
+    level = logging.INFO if display and o else logging.DEBUG
+    if o and command_log.isEnabledFor(level):
+        command_log.log(level, truncate_output(o))
+
+    if e:
+        command_log.error(truncate_output(e))
+
+    return o, e
+
+
+def truncate_output(output: str, limit=None):
+    """Truncates command output for logging.
+
+    Args:
+      output: str: The command output to truncate.
+      limit:  (Default value = None) The maximum number of characters to keep. Defaults
+        to the command module's output log limit.
+
+    Returns:
+      The output, or its first characters followed by a note of how much was dropped.
+    """
+
+    if limit is None:
+        limit = _OUTPUT_LOG_LIMIT
+
+    if len(output) <= limit:
+        return output
+
+    return f'{output[:limit]}... ({len(output) - limit} more characters truncated)'
+
+
+def open_command(command: list, display=True, cwd=None):
+    """Starts a command process with binary pipes for streaming its input and output.
+
+    Used for git commands whose output can not be decoded as text, such as
+    'git cat-file --batch'.
+
+    Args:
+      command: list: The command to execute.
+      display:  (Default value = True) Displays the command parameter in the console if True.
+      cwd:  (Default value = None) The folder to execute the command in. Defaults to the
+        current working directory.
+
+    Returns:
+      A Popen object for the started process.
+    """
+
+    level = logging.INFO if display else logging.DEBUG
+    if command_log.isEnabledFor(level):
+        command_log.log(level, ' '.join(command))
+
+    _count_subprocess()
+    return subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        cwd=cwd,
+    )
 
 
 def open_file(file_path: Path):
@@ -72,12 +241,17 @@ def open_file(file_path: Path):
         execute_command(command)
 
 
-def move_folder(source_folder: Path, destination_folder: Path):
+def move_folder(source_folder: Path, destination_folder: Path, callback=None):
     """Moves a folder and its contents to a new location.
 
     Args:
       source_folder: Path: A Path object for the source folder to move.
       destination_folder: Path: A Path object for the source folder's destination.
+      callback:  (Default value = None) A callable receiving a Path object for each
+        destination file after it is written.
+
+    Returns:
+      A list of Path objects for the destination files written.
 
     Raises:
       MoveCommandError: An OSError occurred while attempting to move the folder's
@@ -85,12 +259,13 @@ def move_folder(source_folder: Path, destination_folder: Path):
     """
 
     if source_folder == destination_folder:
-        return
+        return []
 
     if not source_folder.exists():
         command_log.warning(f'Unable to move \'{source_folder}\', folder does not exist')
         raise MoveCommandError(f'Unable to move \'{source_folder}\', folder does not exist')
 
+    written = []
     for file in source_folder.rglob('*'):
         source_file = Path(file)
 
@@ -101,8 +276,328 @@ def move_folder(source_folder: Path, destination_folder: Path):
 
         destination_file = destination_folder / source_file.relative_to(source_folder)
         move_file(source_file, destination_file)
+        written.append(destination_file)
+
+        if callback is not None:
+            callback(destination_file)
 
     delete_folder(source_folder)
+    return written
+
+
+def move_folder_staged(source_folder: Path, destination_folder: Path, callback=None):
+    """Moves a folder and its contents to a new location through a staging folder.
+
+    The destination's new contents are materialized in a sibling staging folder which
+    is then swapped into place, so consumers of the destination never observe a
+    partially updated folder.
+
+    Args:
+      source_folder: Path: A Path object for the source folder to move.
+      destination_folder: Path: A Path object for the source folder's destination.
+      callback:  (Default value = None) A callable receiving a Path object for each
+        staged file after it is written.
+
+    Returns:
+      A list of Path objects for the destination files written.
+
+    Raises:
+      MoveCommandError: An OSError occurred while attempting to stage or swap the
+        folder, or the folder does not exist.
+    """
+
+    staging_folder, written = stage_folder(source_folder, destination_folder, callback)
+    if staging_folder is not None:
+        swap_folder(staging_folder, destination_folder)
+
+    return written
+
+
+def stage_folder(source_folder: Path, destination_folder: Path, callback=None):
+    """Moves a folder's contents into its destination's staging folder without swapping
+    it into place.
+
+    The staging folder starts out with the destination's current contents. Swap it into
+    place with swap_folder() once it is complete.
+
+    Args:
+      source_folder: Path: A Path object for the source folder to move.
+      destination_folder: Path: A Path object for the source folder's destination.
+      callback:  (Default value = None) A callable receiving a Path object for each
+        staged file after it is written.
+
+    Returns:
+      A tuple containing a Path object for the staging folder, or None if the source
+      folder is its own destination, and a list of Path objects for the destination
+      files written.
+
+    Raises:
+      MoveCommandError: An OSError occurred while attempting to stage the folder, or the
+        folder does not exist.
+    """
+
+    if source_folder == destination_folder:
+        return None, []
+
+    if not source_folder.exists():
+        command_log.warning(f'Unable to move \'{source_folder}\', folder does not exist')
+        raise MoveCommandError(f'Unable to move \'{source_folder}\', folder does not exist')
+
+    staging_folder = prepare_staging_folder(destination_folder)
+
+    written = []
+    for file in source_folder.rglob('*'):
+        source_file = Path(file)
+        if source_file.is_dir():
+            continue
+
+        relative_path = source_file.relative_to(source_folder)
+        move_file(source_file, staging_folder / relative_path)
+        written.append(destination_folder / relative_path)
+
+        if callback is not None:
+            callback(staging_folder / relative_path)
+
+    delete_folder(source_folder)
+    return staging_folder, written
+
+
+def prepare_staging_folder(destination_folder: Path):
+    """Creates a destination's staging folder containing its current contents.
+
+    Existing destination files are hard linked (or copied if linking fails) into the
+    staging folder so that new files can be written over them without touching the
+    destination.
+
+    Args:
+      destination_folder: Path: A Path object for the destination folder.
+
+    Returns:
+      A Path object for the staging folder.
+
+    Raises:
+      MoveCommandError: An OSError occurred while attempting to create the staging
+        folder.
+    """
+
+    staging_folder = get_staging_folder(destination_folder)
+    if staging_folder.exists():
+        delete_folder(staging_folder)
+
+    try:
+        staging_folder.mkdir(parents=True)
+
+        if destination_folder.is_dir():
+            for file in destination_folder.rglob('*'):
+                staged_file = staging_folder / file.relative_to(destination_folder)
+                if file.is_dir():
+                    staged_file.mkdir(parents=True, exist_ok=True)
+                else:
+                    link_file(file, staged_file)
+
+    except OSError as exception:
+        command_log.warning(f'Unable to stage \'{destination_folder}\', {exception}')
+        raise MoveCommandError(f'Unable to stage \'{destination_folder}\', {exception}')
+
+    return staging_folder
+
+
+def swap_folder(staging_folder: Path, destination_folder: Path):
+    """Swaps a staging folder into place at its destination and deletes the folder it
+    replaces.
+
+    Uses an atomic exchange where the platform supports one and falls back to a pair of
+    renames elsewhere.
+
+    Args:
+      staging_folder: Path: A Path object for the staging folder.
+      destination_folder: Path: A Path object for the folder to replace.
+
+    Raises:
+      MoveCommandError: An OSError occurred while attempting to swap the folders.
+    """
+
+    try:
+        if not destination_folder.exists():
+            staging_folder.replace(destination_folder)
+            return
+
+        if not exchange_paths(staging_folder, destination_folder):
+            backup_folder = destination_folder.with_name(destination_folder.name + _BACKUP_SUFFIX)
+            destination_folder.replace(backup_folder)
+            staging_folder.replace(destination_folder)
+            backup_folder.replace(staging_folder)
+
+    except OSError as exception:
+        command_log.warning(
+            f'Unable to swap \'{staging_folder}\' into \'{destination_folder}\', {exception}'
+        )
+        raise MoveCommandError(
+            f'Unable to swap \'{staging_folder}\' into \'{destination_folder}\', {exception}'
+        )
+
+    # Note: After the swap, the staging folder contains the destination's old contents.
+    delete_folder(staging_folder)
+
+
+def exchange_paths(first_path: Path, second_path: Path):
+    """Atomically exchanges two paths.
+
+    Args:
+      first_path: Path: A Path object for the first path to exchange.
+      second_path: Path: A Path object for the second path to exchange.
+
+    Returns:
+      True if the paths were exchanged, or False if the platform or file system does
+      not support atomic exchanges.
+
+    Raises:
+      OSError: The exchange is supported but failed.
+    """
+
+    libc = _get_libc()
+    if libc is None:
+        return False
+
+    first = os.fsencode(first_path)
+    second = os.fsencode(second_path)
+
+    if sys.platform.startswith('linux') and hasattr(libc, 'renameat2'):
+        result = libc.renameat2(_AT_FDCWD, first, _AT_FDCWD, second, _RENAME_EXCHANGE)
+    elif sys.platform == 'darwin' and hasattr(libc, 'renamex_np'):
+        result = libc.renamex_np(first, second, _RENAME_SWAP)
+    else:
+        return False
+
+    if result == 0:
+        return True
+
+    error = ctypes.get_errno()
+    if error in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP):
+        return False
+
+    raise OSError(error, os.strerror(error), str(first_path))
+
+
+def get_staging_folder(destination_folder: Path):
+    """Fetches the staging folder for a destination folder.
+
+    Args:
+      destination_folder: Path: A Path object for the destination folder.
+
+    Returns:
+      A Path object for a hidden sibling of the destination folder.
+    """
+
+    return destination_folder.with_name(f'.{destination_folder.name}{_STAGING_SUFFIX}')
+
+
+def link_file(source_file: Path, destination_file: Path):
+    """Hard links a file to a new location, copying it if it can not be linked.
+
+    Args:
+      source_file: Path: A Path object for the file to link.
+      destination_file: Path: A Path object for the new link.
+
+    Raises:
+      OSError: The file could neither be linked nor copied.
+    """
+
+    try:
+        os.link(source_file, destination_file)
+    except OSError:
+        copy2(source_file, destination_file)
+
+
+def clone_file(source_file: Path, destination_file: Path):
+    """Creates a copy-on-write clone (reflink) of a file.
+
+    Uses the FICLONE ioctl on Linux and clonefile() on macOS. Clones share their data
+    with the source file until either of them is modified.
+
+    Args:
+      source_file: Path: A Path object for the file to clone.
+      destination_file: Path: A Path object for the clone to create. Must not exist.
+
+    Returns:
+      True if the clone was created, or False if the platform or file system does not
+      support cloning files.
+    """
+
+    if sys.platform.startswith('linux') and fcntl is not None:
+        try:
+            with source_file.open('rb') as source, destination_file.open('xb') as destination:
+                try:
+                    fcntl.ioctl(destination.fileno(), _FICLONE, source.fileno())
+                    return True
+                except OSError:
+                    pass
+        except OSError:
+            return False
+
+        destination_file.unlink()
+        return False
+
+    libc = _get_libc()
+    if sys.platform == 'darwin' and libc is not None and hasattr(libc, 'clonefile'):
+        return libc.clonefile(os.fsencode(source_file), os.fsencode(destination_file), 0) == 0
+
+    return False
+
+
+def materialize_file(source_file: Path, destination_file: Path, hardlink=False, mode=0o644):
+    """Writes a copy of a file to a destination without modifying the source.
+
+    The file is reflinked where supported, otherwise hard linked if allowed, and
+    otherwise copied. It is written beside the destination and renamed into place, so
+    the destination is replaced atomically.
+
+    Args:
+      source_file: Path: A Path object for the file to materialize.
+      destination_file: Path: A Path object for the file's destination.
+      hardlink:  (Default value = False) Allows hard linking the destination to the
+        source file if True. Hard linked files share the source's permissions.
+      mode:  (Default value = 0o644) Permissions for reflinked or copied files.
+
+    Returns:
+      A string naming how the file was written: 'reflink', 'hardlink' or 'copy'.
+
+    Raises:
+      MoveCommandError: An OSError occurred while attempting to write the file.
+    """
+
+    temporary_file = destination_file.with_name(f'.{destination_file.name}{_TEMPORARY_SUFFIX}')
+
+    try:
+        if not destination_file.parent.exists():
+            destination_file.parent.mkdir(parents=True)
+
+        if temporary_file.exists():
+            temporary_file.unlink()
+
+        method = 'copy'
+        if clone_file(source_file, temporary_file):
+            method = 'reflink'
+        elif hardlink:
+            try:
+                os.link(source_file, temporary_file)
+                method = 'hardlink'
+            except OSError:
+                pass
+
+        if method == 'copy':
+            copy2(source_file, temporary_file)
+
+        if method != 'hardlink':
+            os.chmod(temporary_file, mode)
+
+        temporary_file.replace(destination_file)
+
+    except OSError as exception:
+        command_log.warning(f'Unable to write \'{destination_file}\', {exception}')
+        raise MoveCommandError(f'Unable to write \'{destination_file}\', {exception}')
+
+    return method
 
 
 def move_file(source_file: Path, destination_file: Path):
@@ -171,3 +666,44 @@ def delete_file(file_path: Path):
     except OSError as exception:
         command_log.warning(f'Unable to delete \'{file_path}\', {exception}')
         raise DeleteCommandError(f'Unable to delete \'{file_path}\', {exception}')
+
+
+def get_subprocess_count():
+    """Fetches the number of subprocesses started by this process.
+
+    Returns:
+      The number of commands executed or opened so far.
+    """
+
+    return _subprocess_count
+
+
+def _count_subprocess():
+    """Counts a subprocess about to be started."""
+
+    global _subprocess_count
+
+    with _subprocess_count_lock:
+        _subprocess_count += 1
+
+
+def _get_libc():
+    """Loads the C library for calling platform file system functions.
+
+    Returns:
+      A ctypes CDLL object, or None if the C library is not available.
+    """
+
+    global _libc
+
+    if _libc is None:
+        library = ctypes.util.find_library('c')
+        if library is None:
+            return None
+
+        try:
+            _libc = ctypes.CDLL(library, use_errno=True)
+        except OSError:
+            return None
+
+    return _libc
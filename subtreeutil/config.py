@@ -15,6 +15,19 @@ _BRANCH = 'branch'
 _SOURCE_PATHS = 'source_paths'
 _DESTINATION_PATHS = 'destination_paths'
 _CLEANUP_PATHS = 'cleanup_paths'
+_USE_REF_NAMESPACE = 'use_ref_namespace'
+_PRUNE_REFS = 'prune_refs'
+_STAGED_WRITES = 'staged_writes'
+_BLOB_STORE = 'blob_store'
+_BLOB_STORE_HARDLINKS = 'blob_store_hardlinks'
+_BLOB_STORE_SIZE_LIMIT_MB = 'blob_store_size_limit_mb'
+_LFS = 'lfs'
+_LFS_ENDPOINT = 'lfs_endpoint'
+_LFS_WORKERS = 'lfs_workers'
+_PARTIAL_FETCH = 'partial_fetch'
+_BUNDLES = 'bundles'
+_BUNDLES_OFFLINE = 'bundles_offline'
+_SNAPSHOT_RETENTION = 'snapshot_retention'
 
 # Default configuration values
 _DEFAULT_CONFIG = {
@@ -24,6 +37,36 @@ _DEFAULT_CONFIG = {
     _SOURCE_PATHS: [],
     _DESTINATION_PATHS: [],
     _CLEANUP_PATHS: [],
+    _USE_REF_NAMESPACE: False,
+    _PRUNE_REFS: True,
+    _STAGED_WRITES: False,
+    _BLOB_STORE: '',
+    _BLOB_STORE_HARDLINKS: False,
+    _BLOB_STORE_SIZE_LIMIT_MB: 0,
+    _LFS: False,
+    _LFS_ENDPOINT: '',
+    _LFS_WORKERS: 8,
+    _PARTIAL_FETCH: False,
+    _BUNDLES: [],
+    _BUNDLES_OFFLINE: False,
+    _SNAPSHOT_RETENTION: 0,
+}
+
+# Configuration variables that may be omitted, falling back to their default values
+_OPTIONAL_KEYS = {
+    _USE_REF_NAMESPACE,
+    _PRUNE_REFS,
+    _STAGED_WRITES,
+    _BLOB_STORE,
+    _BLOB_STORE_HARDLINKS,
+    _BLOB_STORE_SIZE_LIMIT_MB,
+    _LFS,
+    _LFS_ENDPOINT,
+    _LFS_WORKERS,
+    _PARTIAL_FETCH,
+    _BUNDLES,
+    _BUNDLES_OFFLINE,
+    _SNAPSHOT_RETENTION,
 }
 
 
@@ -46,6 +89,145 @@ class EmptyConfigurationError(ConfigurationError):
     configuration was loaded."""
 
 
+class Configuration:
+    """An immutable checkout configuration.
+
+    Unlike the loaded configuration, Configuration objects are created independently of
+    each other and can be shared between threads. Values are accessed as attributes or,
+    like configuration dictionaries, by key, so Configuration objects can be passed to
+    this module's get_* functions. List values are stored as tuples.
+    """
+
+    __slots__ = tuple(_DEFAULT_CONFIG)
+
+    def __init__(self, **values):
+        """Creates a configuration, using default values for omitted variables.
+
+        Args:
+          values: Configuration variable names and their values.
+
+        Raises:
+          TypeError: An unknown configuration variable name was given.
+          InvalidConfigurationError: The configuration is not valid.
+        """
+
+        unknown = set(values) - set(_DEFAULT_CONFIG)
+        if unknown:
+            raise TypeError(f'Unknown configuration variable(s) {", ".join(sorted(unknown))}')
+
+        for key, default in _DEFAULT_CONFIG.items():
+            value = values.get(key, default)
+            if isinstance(value, list):
+                value = tuple(value)
+
+            object.__setattr__(self, key, value)
+
+        if not validate_configuration(self.to_dict()):
+            raise InvalidConfigurationError('Configuration is invalid')
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Configuration objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Configuration objects are immutable')
+
+    def __getitem__(self, key):
+        if key not in _DEFAULT_CONFIG:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, Configuration):
+            return NotImplemented
+
+        return self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, key) for key in self.__slots__))
+
+    def __repr__(self):
+        values = ', '.join(f'{key}={getattr(self, key)!r}' for key in self.__slots__)
+        return f'Configuration({values})'
+
+    def get(self, key, default=None):
+        """Fetches a configuration value.
+
+        Args:
+          key: The configuration variable name.
+          default:  (Default value = None) The value to return for unknown names.
+        """
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def replace(self, **values):
+        """Creates a copy of the configuration with some values replaced.
+
+        Args:
+          values: Configuration variable names and their new values.
+
+        Returns:
+          A new Configuration object.
+        """
+
+        configuration = self.to_dict()
+        configuration.update(values)
+        return Configuration(**configuration)
+
+    def to_dict(self):
+        """Creates a configuration dictionary from the configuration.
+
+        Returns:
+          A dictionary mapping configuration variable names to values.
+        """
+
+        return {
+            key: list(value) if isinstance(value, tuple) else value
+            for key, value in ((key, getattr(self, key)) for key in self.__slots__)
+        }
+
+    @classmethod
+    def from_dict(cls, configuration):
+        """Creates a configuration from a configuration dictionary.
+
+        Unknown configuration variables are ignored, matching configuration files.
+
+        Args:
+          configuration: The configuration dictionary.
+
+        Returns:
+          A new Configuration object.
+
+        Raises:
+          InvalidConfigurationError: The configuration dictionary is not valid.
+        """
+
+        if not validate_configuration(configuration):
+            raise InvalidConfigurationError('Configuration is invalid')
+
+        return cls(**{key: configuration[key] for key in _DEFAULT_CONFIG if key in configuration})
+
+    @classmethod
+    def from_file(cls, config_path: Path):
+        """Creates a configuration from a configuration file.
+
+        Args:
+          config_path: Path: Path object for the configuration file to read.
+
+        Returns:
+          A new Configuration object.
+
+        Raises:
+          FileNotFoundError: An error occurred while attempting to read a configuration file.
+          InvalidConfigurationError: The specified configuration file is not valid.
+        """
+
+        return cls.from_dict(read_config_file(config_path))
+
+
 def edit_config_file(config_path: Path):
     """Opens the specified configuration file with the system's default editor.
 
@@ -98,6 +280,22 @@ def load_config_file(config_path: Path):
     """
 
     global _loaded_config
+    _loaded_config = read_config_file(config_path)
+
+
+def read_config_file(config_path: Path):
+    """Reads and validates a configuration file without loading it into memory.
+
+    Args:
+      config_path: Path: Path object for the configuration file to read.
+
+    Returns:
+      The validated configuration dictionary.
+
+    Raises:
+      FileNotFoundError: An error occurred while attempting to read a configuration file.
+      InvalidConfigurationError: The specified configuration file is not valid.
+    """
 
     config_log.info(f'Loading configuration file \'{config_path}\'')
     try:
@@ -108,7 +306,7 @@ def load_config_file(config_path: Path):
         raise exception
 
     if validate_configuration(configuration):
-        _loaded_config = configuration
+        return configuration
     else:
         config_log.error(f'Configuration file \'{config_path}\' is invalid')
         raise InvalidConfigurationError(f'Configuration file \'{config_path}\' is invalid')
@@ -128,6 +326,9 @@ def validate_configuration(configuration):
     is_valid_config = True
 
     for key, value in default_config.items():
+        if key in _OPTIONAL_KEYS:
+            continue
+
         try:
             configuration[key]
         except KeyError:
@@ -152,9 +353,13 @@ def validate_configuration(configuration):
     return is_valid_config
 
 
-def get_config():
+def get_config(configuration=None):
     """Fetches the configuration dictionary loaded into memory.
 
+    Args:
+      configuration:  (Default value = None) A configuration dictionary to use instead
+        of the loaded configuration.
+
     Returns:
       The dictionary storing a mapping configuration keys and values.
 
@@ -163,6 +368,9 @@ def get_config():
         file being loaded first.
     """
 
+    if configuration is not None:
+        return configuration
+
     global _loaded_config
     if _loaded_config is None:
         config_log.error(
@@ -173,43 +381,149 @@ def get_config():
     return _loaded_config
 
 
-def get_remote_name():
+def get_remote_name(configuration=None):
     """Fetches remote repository name from the loaded configuration."""
 
-    config = get_config()
+    config = get_config(configuration)
     return config[_REMOTE_NAME]
 
 
-def get_remote_url():
+def get_remote_url(configuration=None):
     """Fetches remote repository URL from the loaded configuration."""
 
-    config = get_config()
+    config = get_config(configuration)
     return config[_REMOTE_URL]
 
 
-def get_branch():
+def get_branch(configuration=None):
     """Fetches remote repository branch name from the loaded configuration."""
 
-    config = get_config()
+    config = get_config(configuration)
     return config[_BRANCH]
 
 
-def get_source_paths():
+def get_source_paths(configuration=None):
     """Fetches source paths from the loaded configuration."""
 
-    config = get_config()
+    config = get_config(configuration)
     return config[_SOURCE_PATHS]
 
 
-def get_destination_paths():
+def get_destination_paths(configuration=None):
     """Fetches destination paths from the loaded configuration."""
 
-    config = get_config()
+    config = get_config(configuration)
     return config[_DESTINATION_PATHS]
 
 
-def get_cleanup_paths():
+def get_cleanup_paths(configuration=None):
     """Fetches cleanup paths from the loaded configuration."""
 
-    config = get_config()
+    config = get_config(configuration)
     return config[_CLEANUP_PATHS]
+
+
+def get_use_ref_namespace(configuration=None):
+    """Fetches whether to fetch into a persistent private ref namespace from the loaded
+    configuration."""
+
+    return _get_optional_value(_USE_REF_NAMESPACE, configuration)
+
+
+def get_prune_refs(configuration=None):
+    """Fetches whether to prune refs of branches deleted upstream from the private ref
+    namespace from the loaded configuration."""
+
+    return _get_optional_value(_PRUNE_REFS, configuration)
+
+
+def get_staged_writes(configuration=None):
+    """Fetches whether to stage destination folders and swap them into place from the
+    loaded configuration."""
+
+    return _get_optional_value(_STAGED_WRITES, configuration)
+
+
+def get_blob_store(configuration=None):
+    """Fetches the shared blob store folder from the loaded configuration. An empty
+    string disables the blob store."""
+
+    return _get_optional_value(_BLOB_STORE, configuration)
+
+
+def get_blob_store_hardlinks(configuration=None):
+    """Fetches whether files may be hard linked from the blob store from the loaded
+    configuration."""
+
+    return _get_optional_value(_BLOB_STORE_HARDLINKS, configuration)
+
+
+def get_blob_store_size_limit_mb(configuration=None):
+    """Fetches the blob store's size limit in megabytes from the loaded configuration.
+    A limit of 0 disables garbage collection."""
+
+    return _get_optional_value(_BLOB_STORE_SIZE_LIMIT_MB, configuration)
+
+
+def get_lfs(configuration=None):
+    """Fetches whether to resolve Git LFS pointer files from the loaded configuration."""
+
+    return _get_optional_value(_LFS, configuration)
+
+
+def get_lfs_endpoint(configuration=None):
+    """Fetches the local folder or server URL to fetch missing LFS objects from from the
+    loaded configuration."""
+
+    return _get_optional_value(_LFS_ENDPOINT, configuration)
+
+
+def get_lfs_workers(configuration=None):
+    """Fetches the maximum number of LFS objects to resolve at once from the loaded
+    configuration."""
+
+    return _get_optional_value(_LFS_WORKERS, configuration)
+
+
+def get_partial_fetch(configuration=None):
+    """Fetches whether to only download the blobs under source paths from the loaded
+    configuration."""
+
+    return _get_optional_value(_PARTIAL_FETCH, configuration)
+
+
+def get_bundles(configuration=None):
+    """Fetches the git bundle files to fetch from before the remote URL from the loaded
+    configuration."""
+
+    return _get_optional_value(_BUNDLES, configuration)
+
+
+def get_bundles_offline(configuration=None):
+    """Fetches whether to skip fetching from the remote URL after fetching from bundles
+    from the loaded configuration."""
+
+    return _get_optional_value(_BUNDLES_OFFLINE, configuration)
+
+
+def get_snapshot_retention(configuration=None):
+    """Fetches the number of destination snapshots to keep from the loaded
+    configuration."""
+
+    return _get_optional_value(_SNAPSHOT_RETENTION, configuration)
+
+
+def _get_optional_value(key, configuration=None):
+    """Fetches an optional value from the loaded configuration.
+
+    Args:
+      key: The configuration variable name to fetch.
+      configuration:  (Default value = None) A configuration dictionary to use instead
+        of the loaded configuration.
+
+    Returns:
+      The configured value, or its default value if the configuration omits it.
+    """
+
+    config = get_config(configuration)
+    return config.get(key, _DEFAULT_CONFIG[key])
@@ -1,176 +1,2184 @@
 """Automates checking out files and folders from a remote repository."""
 
+import contextlib
+import datetime
+import functools
+import hashlib
 import logging
+import os
+import statistics
+import time
 
 from pathlib import Path
 
+from . import archive
+from . import blobstore
+from . import bundle
 from . import config
+from . import fetch
+from . import lfs
+from . import lock
+from . import manifest
+from . import metrics
+from . import snapshot
+from . import progress as progressutil
 from . import command as commandutil
 
 
+# Private ref namespace used when fetching without adding a remote
+_REF_NAMESPACE = 'refs/subtreeutil'
+
+# Number of hex digits of a remote URL's hash used to tell apart remotes sharing a name
+_REMOTE_URL_HASH_LENGTH = 12
+
+# Prefix of the promisor remotes configured for partial fetches
+_PROMISOR_REMOTE_PREFIX = 'subtreeutil-'
+
+# Object filter used for partial fetches
+_PARTIAL_FETCH_FILTER = 'blob:none'
+
+# Maximum number of blobs requested by a single 'git fetch' command
+_BLOB_FETCH_BATCH_SIZE = 500
+
+
 core_log = logging.getLogger('subtreeutil.core')
 
 
-def perform_checkout(config_path: Path):
-    """Performs the entire checkout operation using a configuration file.
+class SyncResult:
+    """The outcome of a Syncer run.
+
+    Attributes:
+      commits: A dictionary mapping each remote URL to a dictionary of fetched branch
+        names and commit hashes.
+      files_written: A list of Path objects for the destination files written.
+      files_skipped: A list of Path objects for destination files that already matched
+        their source and were not rewritten.
+      files_deleted: A list of Path objects for the cleanup paths deleted.
+      errors: A list of Path objects for the sources or cleanup paths that could not be
+        written or deleted.
+      timings: A dictionary mapping phase names to the seconds spent in them.
+    """
+
+    __slots__ = ('commits', 'files_written', 'files_skipped', 'files_deleted', 'errors', 'timings')
+
+    def __init__(self):
+        self.commits = {}
+        self.files_written = []
+        self.files_skipped = []
+        self.files_deleted = []
+        self.errors = []
+        self.timings = {}
+
+    def __repr__(self):
+        return (
+            f'SyncResult(written={len(self.files_written)}, skipped={len(self.files_skipped)}, '
+            f'deleted={len(self.files_deleted)}, errors={len(self.errors)})'
+        )
+
+    @property
+    def success(self):
+        return not self.errors
+
+    def add_timing(self, phase, seconds):
+        """Adds time spent in a phase.
+
+        Args:
+          phase: The phase's name.
+          seconds: The seconds spent in the phase.
+        """
+
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+
+class Syncer:
+    """Performs checkout operations for a list of configurations in one repository.
+
+    A Syncer carries all of its own state and never reads the loaded configuration, so
+    Syncers for different repositories can run concurrently in one process.
+
+    Example:
+      configuration = config.Configuration(remote_url='...', source_paths=['Assets'])
+      result = Syncer([configuration], repository_folder='path/to/repository').run()
+    """
+
+    def __init__(self, configurations, repository_folder=None, progress=None):
+        """Creates a Syncer.
+
+        Args:
+          configurations: A list of Configuration objects or configuration
+            dictionaries to check out.
+          repository_folder:  (Default value = None) The local repository's root
+            folder. Relative configuration paths are resolved against it. Defaults to
+            the current working directory.
+          progress:  (Default value = None) A callable receiving ProgressEvent objects
+            while the Syncer runs.
+        """
+
+        self.configurations = tuple(configurations)
+        self.repository_folder = Path(repository_folder or Path.cwd()).resolve()
+        self.progress = progress
+        self._fetched_commits = {}
+
+    def run(self):
+        """Fetches every configuration's remote and checks out its sources.
+
+        Configurations that share a remote URL are fetched with a single fetch command
+        before any of them are checked out.
+
+        Returns:
+          A SyncResult object describing the run.
+        """
+
+        result = SyncResult()
+        self._fetched_commits = {}
+
+        with self.phase('fetch', result):
+            result.commits = self.fetch()
+
+        for configuration in self.configurations:
+            remote_url = config.get_remote_url(configuration)
+            branch = config.get_branch(configuration)
+            self.checkout(configuration, result.commits[remote_url][branch], result)
+
+        core_log.info('Checkout complete!')
+        return result
+
+    def fetch(self):
+        """Fetches the remotes of all configurations, once per remote URL.
+
+        Returns:
+          A dictionary mapping each remote URL to a dictionary of fetched branch names
+          and commit hashes.
+        """
+
+        # TODO: Handle case where an existing repository doesn't exist
+        cwd = self.repository_folder
+        git_folder = get_git_folder(cwd)
+        progress = self.progress
+
+        commits = {}
+        for remote_url, group in fetch.group_by_remote(self.configurations).items():
+            remote_name = config.get_remote_name(group[0])
+
+            # Note: Configurations sharing a remote URL are fetched with one command, so
+            # they must agree on how it is fetched.
+            partial_fetch = self.get_fetch_setting(group, 'partial_fetch', config.get_partial_fetch)
+            use_ref_namespace = self.get_fetch_setting(
+                group, 'use_ref_namespace', config.get_use_ref_namespace
+            )
+
+            if partial_fetch or use_ref_namespace:
+                prune = self.get_fetch_setting(group, 'prune_refs', config.get_prune_refs)
+                fetch_function = functools.partial(
+                    fetch_partial_branches if partial_fetch else fetch_namespace_branches,
+                    remote_name,
+                    remote_url,
+                    prune=prune,
+                    cwd=cwd,
+                    progress=progress,
+                )
+            else:
+                fetch_function = functools.partial(
+                    fetch_branches, remote_name, remote_url, cwd=cwd, progress=progress
+                )
+
+            bundle_paths = self.get_bundle_paths(group)
+            if bundle_paths:
+                fetch_function = functools.partial(
+                    fetch_with_bundles,
+                    remote_name,
+                    remote_url,
+                    bundle_paths,
+                    fetch_function=fetch_function,
+                    offline=any(config.get_bundles_offline(c) for c in group),
+                    cwd=cwd,
+                    progress=progress,
+                )
+
+            commits[remote_url] = fetch.fetch_upstream(
+                git_folder,
+                remote_url,
+                fetch.get_branches(group),
+                fetch_function,
+                self._fetched_commits,
+            )
+
+        return commits
+
+    def bundle(self, bundle_path, since=None, full=False):
+        """Fetches every configuration's remote and writes the fetched commits to a git
+        bundle file.
+
+        Bundles are incremental by default and only contain the commits made since the
+        commit each configuration's destinations were last checked out from.
+
+        Args:
+          bundle_path: The bundle file's path.
+          since:  (Default value = None) A commit to create the bundle relative to,
+            instead of each configuration's last checked out commit.
+          full:  (Default value = False) Creates a bundle containing every fetched commit's
+            full history if True.
+
+        Returns:
+          A SyncResult object describing the fetch, or None if there were no new commits
+          to bundle.
+        """
+
+        cwd = self.repository_folder
+        result = SyncResult()
+        self._fetched_commits = {}
+
+        with self.phase('fetch', result):
+            result.commits = self.fetch()
+
+        refs = []
+        excluded_commits = []
+        for configuration in self.configurations:
+            remote_name = config.get_remote_name(configuration)
+            remote_url = config.get_remote_url(configuration)
+            branch = config.get_branch(configuration)
+            commit_hash = result.commits[remote_url][branch]
+
+            if not commit_hash:
+                core_log.error(f'Unable to bundle {remote_name}/{branch}, it was not fetched')
+                continue
+
+            base_commit = None
+            if not full:
+                base_commit = since or self.get_checked_out_commit(configuration)
+                if base_commit is None:
+                    core_log.warning(
+                        f'No checkout of {remote_name}/{branch} found, bundling its full history'
+                    )
+
+            if base_commit == commit_hash:
+                continue
+
+            # Note: Bundles store refs by name, so the fetched commit is given a namespace
+            # ref even when fetching without one.
+            ref = f'{get_ref_namespace(remote_name, remote_url)}/{branch}'
+            update_namespace_ref(remote_name, remote_url, branch, commit_hash, cwd)
+
+            if ref not in refs:
+                refs.append(ref)
+            if base_commit and base_commit not in excluded_commits:
+                excluded_commits.append(base_commit)
+
+        if not refs:
+            core_log.info('No new commits to bundle')
+            return None
+
+        with self.phase('bundle', result):
+            create_bundle(self.resolve(Path(bundle_path).expanduser()), refs, excluded_commits, cwd)
+
+        return result
+
+    def checkout(self, configuration, commit_hash, result: SyncResult):
+        """Checks out, moves and cleans up a configuration's sources from a fetched commit.
+
+        Args:
+          configuration: The configuration to check out.
+          commit_hash: The fetched commit hash of the configuration's branch.
+          result: SyncResult: The result to record the checkout in.
+        """
+
+        remote_name = config.get_remote_name(configuration)
+        branch = config.get_branch(configuration)
+        source_paths = config.get_source_paths(configuration)
+
+        if not commit_hash:
+            core_log.error(f'Unable to check out files, {remote_name}/{branch} was not fetched')
+            result.errors.extend(self.resolve(source_path) for source_path in source_paths)
+            return
+
+        core_log.info(f'Checking out files from {remote_name}/{branch} ({commit_hash})\n')
+
+        # Note: Other invocations writing to overlapping paths wait until this one is done.
+        with lock.claim_paths(
+            self.get_lock_folder(), self.get_claimed_paths(configuration), f'{remote_name}/{branch}'
+        ):
+            self.write_sources(configuration, commit_hash, result)
+
+    def write_sources(self, configuration, commit_hash, result: SyncResult):
+        """Writes a configuration's sources from a fetched commit to their destinations
+        and cleans up.
+
+        Args:
+          configuration: The configuration to check out.
+          commit_hash: The fetched commit hash of the configuration's branch.
+          result: SyncResult: The result to record the checkout in.
+        """
+
+        cwd = self.repository_folder
+        remote_name = config.get_remote_name(configuration)
+        source_paths = config.get_source_paths(configuration)
+        destination_paths = config.get_destination_paths(configuration)
+        staged = config.get_staged_writes(configuration)
+        store_folder = config.get_blob_store(configuration)
+        written_count = len(result.files_written)
+        skipped_count = len(result.files_skipped)
+
+        # Note: Staged folders are swapped into place once LFS pointers have been resolved
+        # and cleanup has been applied in them.
+        staging_folders = {}
+
+        if config.get_partial_fetch(configuration):
+            with self.phase('blob_fetch', result):
+                fetch_source_blobs(
+                    get_promisor_remote(remote_name, config.get_remote_url(configuration)),
+                    commit_hash,
+                    source_paths,
+                    cwd,
+                    self.progress,
+                )
+
+        retention = config.get_snapshot_retention(configuration)
+        if retention > 0:
+            with self.phase('snapshot', result):
+                self.take_snapshot(configuration, commit_hash, retention)
+
+        if store_folder:
+            store_folder = self.resolve(Path(store_folder).expanduser())
+            hardlink = config.get_blob_store_hardlinks(configuration)
+
+            # Note: Sources without a matching destination are written to their source path.
+            destination_paths = destination_paths or source_paths
+
+            with self.phase('materialize', result) as callback:
+                for source_path, destination_path in zip(source_paths, destination_paths):
+                    materialize_source(
+                        store_folder,
+                        commit_hash,
+                        Path(source_path),
+                        self.resolve(destination_path),
+                        staged,
+                        hardlink,
+                        cwd,
+                        result,
+                        callback,
+                        staging_folders,
+                    )
+        else:
+            with self.phase('checkout', result), hold_repository_lock('index', cwd):
+                for source_path in source_paths:
+                    checkout_remote_source(commit_hash, source_path, cwd)
+
+                unstage_all(cwd)
+
+            # Note: zip() will stop as soon as the shortest list is exhausted.
+            with self.phase('move', result) as callback:
+                for source_path, destination_path in zip(source_paths, destination_paths):
+                    move_source(
+                        self.resolve(source_path),
+                        self.resolve(destination_path),
+                        staged,
+                        result,
+                        callback,
+                        staging_folders,
+                    )
+
+        if config.get_lfs(configuration):
+            with self.phase('lfs', result) as callback:
+                self.resolve_lfs_pointers(
+                    configuration,
+                    result.files_written[written_count:],
+                    result,
+                    callback,
+                    staging_folders,
+                )
+
+        with self.phase('cleanup', result) as callback:
+            for cleanup_path in config.get_cleanup_paths(configuration):
+                cleanup_path = self.resolve(cleanup_path)
+                staged_path = get_staged_path(cleanup_path, staging_folders)
+                delete_source(cleanup_path, result, callback, staged_path)
+
+        if staging_folders:
+            with self.phase('swap', result):
+                for destination_path, staging_folder in staging_folders.items():
+                    swap_destination(staging_folder, destination_path, result)
+
+        # Note: The manifest is written after cleanup, so deleted files are left out of it.
+        with self.phase('manifest', result):
+            files = result.files_written[written_count:] + result.files_skipped[skipped_count:]
+            self.write_manifest(configuration, commit_hash, files)
+
+        size_limit_mb = config.get_blob_store_size_limit_mb(configuration)
+        if store_folder and size_limit_mb > 0:
+            with self.phase('garbage_collection', result), hold_store_lock(store_folder):
+                blobstore.collect_garbage(store_folder, size_limit_mb * 1024 * 1024)
+
+    def get_claimed_paths(self, configuration):
+        """Fetches the working tree paths a configuration's checkout writes to or deletes.
+
+        Args:
+          configuration: The configuration to inspect.
+
+        Returns:
+          A list of resolved Path objects.
+        """
+
+        paths = self.get_destination_roots(configuration)
+        paths.extend(self.resolve(path) for path in config.get_cleanup_paths(configuration))
+
+        # Note: Without a blob store, sources are checked out into the working tree first.
+        if not config.get_blob_store(configuration):
+            paths.extend(self.resolve(path) for path in config.get_source_paths(configuration))
+
+        return paths
+
+    def get_lock_folder(self):
+        """Fetches the folder containing the local repository's locks.
+
+        Returns:
+          A Path object for the lock folder.
+        """
+
+        return lock.get_lock_folder(get_git_folder(self.repository_folder))
+
+    def write_manifest(self, configuration, commit_hash, files):
+        """Records the files written to a configuration's destinations in its manifest.
+
+        Args:
+          configuration: The configuration the files were written for.
+          commit_hash: The commit hash the files were written from.
+          files: A list of Path objects for the files written to the destinations.
+        """
+
+        roots = self.get_destination_roots(configuration)
+        manifest_path = self.get_manifest_path(roots)
+
+        try:
+            previous = manifest.read_manifest(manifest_path)
+        except manifest.ManifestError:
+            previous = None
+
+        data = manifest.build_manifest(
+            self.repository_folder, roots, files, commit_hash, previous
+        )
+        manifest.write_manifest(manifest_path, data)
+
+    def export(self, archive_path, compression='none'):
+        """Fetches every configuration's remote and writes its sources to a tar archive
+        instead of the working tree.
+
+        Files are placed at their destination paths, files inside cleanup paths are
+        left out and Git LFS pointers are resolved if enabled, so importing the archive
+        produces the same files as a checkout.
+
+        Args:
+          archive_path: The archive's path, or '-' to write to standard output.
+          compression:  (Default value = 'none') 'none', 'gzip' or 'zstd'.
+
+        Returns:
+          A SyncResult object describing the export. Its files_written lists the
+          archive's member names.
+        """
+
+        archive.check_compression(compression)
+
+        cwd = self.repository_folder
+        result = SyncResult()
+        self._fetched_commits = {}
+
+        with self.phase('fetch', result):
+            result.commits = self.fetch()
+
+        exports = []
+        for configuration in self.configurations:
+            remote_name = config.get_remote_name(configuration)
+            remote_url = config.get_remote_url(configuration)
+            branch = config.get_branch(configuration)
+            source_paths = config.get_source_paths(configuration)
+            commit_hash = result.commits[remote_url][branch]
+
+            if not commit_hash:
+                core_log.error(f'Unable to export files, {remote_name}/{branch} was not fetched')
+                result.errors.extend(Path(source_path) for source_path in source_paths)
+                continue
+
+            if config.get_partial_fetch(configuration):
+                with self.phase('blob_fetch', result):
+                    promisor_remote = get_promisor_remote(remote_name, remote_url)
+                    fetch_source_blobs(
+                        promisor_remote, commit_hash, source_paths, cwd, self.progress
+                    )
+
+            entries = archive.list_entries(
+                commit_hash,
+                source_paths,
+                config.get_destination_paths(configuration),
+                config.get_cleanup_paths(configuration),
+                cwd,
+            )
+            export = {
+                'remote_url': remote_url,
+                'branch': branch,
+                'commit': commit_hash,
+                'time': get_commit_time(commit_hash, cwd),
+                'roots': [
+                    archive.get_member_name(path)
+                    for path in config.get_destination_paths(configuration) or source_paths
+                ],
+            }
+            if config.get_lfs(configuration):
+                with self.phase('lfs', result):
+                    self.resolve_lfs_entries(configuration, result, entries)
+
+            exports.append((export, entries))
+            result.files_written.extend(Path(entry.name) for entry in entries)
+
+        with self.phase('export', result):
+            archive.write_archive(archive_path, exports, compression, cwd)
+
+        return result
+
+    def verify(self, workers=None):
+        """Compares every configuration's destinations with the manifest written by its
+        last checkout.
+
+        Manifests are updated with the stat data of files that were rehashed and found
+        unchanged, so later verifications can skip them.
+
+        Args:
+          workers:  (Default value = None) The maximum number of files to hash at once.
+            Defaults to the number of processors.
+
+        Returns:
+          A list containing a Drift object for each configuration, or None for
+          configurations without a manifest.
+
+        Raises:
+          ManifestError: A manifest could not be read.
+        """
+
+        drifts = []
+        for configuration in self.configurations:
+            roots = self.get_destination_roots(configuration)
+            manifest_path = self.get_manifest_path(roots)
+
+            data = manifest.read_manifest(manifest_path)
+            if data is None:
+                core_log.warning(
+                    f'No manifest found for {config.get_remote_name(configuration)}, '
+                    f'run a checkout first'
+                )
+                drifts.append(None)
+                continue
+
+            drift = manifest.verify_manifest(self.repository_folder, data, workers)
+            if drift.refreshed:
+                manifest.write_manifest(manifest_path, data)
+
+            drifts.append(drift)
+
+        return drifts
+
+    def take_snapshot(self, configuration, commit_hash, retention):
+        """Takes a snapshot of a configuration's destinations before they are written and
+        deletes snapshots beyond the retention limit.
+
+        No snapshot is taken if the destinations do not exist yet or were last checked
+        out from the commit about to be written.
+
+        Args:
+          configuration: The configuration about to be checked out.
+          commit_hash: The commit hash about to be checked out.
+          retention: The number of snapshots to keep.
+
+        Returns:
+          A Snapshot object, or None if no snapshot was taken.
+        """
+
+        roots = self.get_destination_roots(configuration)
+        if not any(os.path.lexists(root) for root in roots):
+            return None
+
+        previous_commit = self.get_checked_out_commit(configuration)
+        if previous_commit == commit_hash:
+            core_log.debug(f'Skipping snapshot, destinations are already at {commit_hash}')
+            return None
+
+        keys = [manifest.get_key(self.repository_folder, root) for root in roots]
+        snapshots_folder = self.get_snapshots_folder(roots)
+
+        try:
+            taken = snapshot.create_snapshot(
+                snapshots_folder, roots, keys, previous_commit or '', self.get_manifest_path(roots)
+            )
+        except snapshot.SnapshotError:
+            # Note: The error is already logged and the checkout can proceed without it.
+            return None
+
+        snapshot.prune_snapshots(snapshots_folder, retention)
+        return taken
+
+    def rollback(self):
+        """Restores every configuration's destinations from the snapshot taken before
+        their last checkout.
+
+        Returns:
+          A list containing the restored Snapshot object for each configuration, or None
+          for configurations without a snapshot.
+
+        Raises:
+          RestoreSnapshotError: A snapshot could not be restored.
+        """
+
+        restored = []
+        for configuration in self.configurations:
+            remote_name = config.get_remote_name(configuration)
+            roots = self.get_destination_roots(configuration)
+
+            snapshots = snapshot.list_snapshots(self.get_snapshots_folder(roots))
+            if not snapshots:
+                core_log.warning(f'No snapshot of {remote_name} found to roll back to')
+                restored.append(None)
+                continue
+
+            latest = snapshots[0]
+            paths = {manifest.get_key(self.repository_folder, root): root for root in roots}
+
+            with lock.claim_paths(self.get_lock_folder(), roots, f'rollback of {remote_name}'):
+                start = time.perf_counter()
+                snapshot.restore_snapshot(
+                    latest, [paths[key] for key in latest.roots], self.get_manifest_path(roots)
+                )
+                seconds = time.perf_counter() - start
+
+            core_log.info(
+                f'Rolled back {remote_name} to {latest.commit or "an unknown commit"} '
+                f'in {seconds * 1000:.1f} ms'
+            )
+            restored.append(latest)
+
+        return restored
+
+    def list_snapshots(self):
+        """Lists the snapshots of every configuration's destinations.
+
+        Returns:
+          A list containing a list of Snapshot objects, newest first, for each
+          configuration.
+        """
+
+        return [
+            snapshot.list_snapshots(self.get_snapshots_folder(self.get_destination_roots(c)))
+            for c in self.configurations
+        ]
+
+    def get_fetch_setting(self, configurations, name, get_setting):
+        """Fetches a setting controlling how configurations that share a remote URL are
+        fetched.
+
+        Args:
+          configurations: A list of configurations sharing a remote URL.
+          name: The setting's configuration key, used for logging.
+          get_setting: A config module accessor returning the setting of a configuration.
+
+        Returns:
+          The setting of the first configuration. A warning is logged if any of the other
+          configurations set it differently.
+        """
+
+        value = get_setting(configurations[0])
+        if any(get_setting(c) != value for c in configurations[1:]):
+            remote_url = config.get_remote_url(configurations[0])
+            core_log.warning(
+                f'Configurations fetching {remote_url} set \'{name}\' differently, '
+                f'using {str(value).lower()} for all of them'
+            )
+
+        return value
+
+    def get_bundle_paths(self, configurations):
+        """Fetches the bundle files of configurations that share a remote URL.
+
+        Args:
+          configurations: A list of configurations sharing a remote URL.
+
+        Returns:
+          A list of resolved Path objects without duplicates, in configuration order.
+        """
+
+        bundle_paths = []
+        for configuration in configurations:
+            for bundle_path in config.get_bundles(configuration):
+                bundle_path = self.resolve(Path(bundle_path).expanduser())
+                if bundle_path not in bundle_paths:
+                    bundle_paths.append(bundle_path)
+
+        return bundle_paths
+
+    def get_checked_out_commit(self, configuration):
+        """Fetches the commit a configuration's destinations were last checked out from.
+
+        Args:
+          configuration: The configuration to inspect.
+
+        Returns:
+          The commit hash recorded in the configuration's manifest, or None if there is
+          no readable manifest.
+        """
+
+        manifest_path = self.get_manifest_path(self.get_destination_roots(configuration))
+        try:
+            data = manifest.read_manifest(manifest_path)
+        except manifest.ManifestError:
+            return None
+
+        if data is None or not data['commit']:
+            return None
+
+        return data['commit']
+
+    def get_destination_roots(self, configuration):
+        """Fetches the destination files and folders of a configuration.
+
+        Args:
+          configuration: The configuration to inspect.
+
+        Returns:
+          A list of resolved Path objects. Source paths are used for configurations
+          without destination paths.
+        """
+
+        destination_paths = config.get_destination_paths(configuration)
+        destination_paths = destination_paths or config.get_source_paths(configuration)
+        return [self.resolve(destination_path) for destination_path in destination_paths]
+
+    def get_manifest_path(self, roots):
+        """Fetches the path of the manifest for a list of destination roots.
+
+        Args:
+          roots: A list of resolved Path objects for the destination files and folders.
+
+        Returns:
+          A Path object for the manifest file.
+        """
+
+        keys = [manifest.get_key(self.repository_folder, root) for root in roots]
+        return manifest.get_manifest_path(get_git_folder(self.repository_folder), keys)
+
+    def get_snapshots_folder(self, roots):
+        """Fetches the folder containing the snapshots of a list of destination roots.
+
+        Args:
+          roots: A list of resolved Path objects for the destination files and folders.
+
+        Returns:
+          A Path object for the snapshots folder.
+        """
+
+        keys = [manifest.get_key(self.repository_folder, root) for root in roots]
+        return snapshot.get_snapshots_folder(
+            get_git_folder(self.repository_folder), manifest.get_roots_key(keys)
+        )
+
+    def resolve_lfs_pointers(
+        self, configuration, files, result: SyncResult, callback=None, staging_folders=None
+    ):
+        """Replaces Git LFS pointer files among written files with their objects.
+
+        Args:
+          configuration: The configuration the files were written for.
+          files: A list of Path objects for the written destination files.
+          result: SyncResult: The result to record unresolved pointers in.
+          callback:  (Default value = None) A callable receiving a Path object for each
+            file after it is replaced.
+          staging_folders:  (Default value = None) A dictionary mapping destination
+            folders to the staging folders they have not been swapped with yet. Files
+            in them are resolved in the staging folder.
+        """
+
+        endpoint = self.get_lfs_endpoint(configuration)
+
+        staged_files = {}
+        for file in files:
+            staged_files[get_staged_path(file, staging_folders or {}) or file] = file
+
+        objects_folder = get_git_folder(self.repository_folder) / 'lfs' / 'objects'
+        _, failed = lfs.resolve_pointers(
+            list(staged_files),
+            objects_folder,
+            endpoint,
+            config.get_lfs_workers(configuration),
+            callback,
+        )
+        result.errors.extend(staged_files[file] for file in failed)
+
+    def resolve_lfs_entries(self, configuration, result: SyncResult, entries):
+        """Points exported Git LFS pointer files at the objects they point to, so the
+        objects are written to the archive instead.
+
+        Only blobs small enough to be pointers are read, and all of their objects are
+        fetched up front in parallel.
+
+        Args:
+          configuration: The configuration the files are exported for.
+          result: SyncResult: The result to record unresolved pointers in.
+          entries: A list of ArchiveEntry objects for the exported files.
+        """
+
+        cwd = self.repository_folder
+        files = [entry for entry in entries if not entry.blob.is_symlink]
+        sizes = blobstore.read_blob_sizes([entry.blob for entry in files], cwd)
+        candidates = [entry for entry in files if lfs.is_pointer_size(sizes[entry.blob.blob_id])]
+
+        pointers = {}
+        blobs = blobstore.read_blobs([entry.blob for entry in candidates], cwd)
+        with contextlib.closing(blobs) as contents_reader:
+            for entry, (blob, contents) in zip(candidates, contents_reader):
+                pointer = lfs.parse_pointer(contents)
+                if pointer is not None:
+                    pointers.setdefault(pointer, []).append(entry)
+
+        objects_folder = get_git_folder(cwd) / 'lfs' / 'objects'
+        objects, failed = lfs.fetch_objects(
+            list(pointers),
+            objects_folder,
+            self.get_lfs_endpoint(configuration),
+            config.get_lfs_workers(configuration),
+        )
+
+        for pointer, object_path in objects.items():
+            for entry in pointers[pointer]:
+                entry.object_path = object_path
+
+        # Note: Unresolved pointers are exported as they are.
+        result.errors.extend(Path(entry.name) for pointer in failed for entry in pointers[pointer])
+
+    def get_lfs_endpoint(self, configuration):
+        """Fetches a configuration's LFS endpoint.
+
+        Args:
+          configuration: The configuration to inspect.
+
+        Returns:
+          The endpoint's URL, the resolved path of a local endpoint folder, or an empty
+          string if there is no endpoint.
+        """
+
+        endpoint = config.get_lfs_endpoint(configuration)
+        if endpoint and not lfs.is_url(endpoint):
+            endpoint = str(self.resolve(Path(endpoint).expanduser()))
+
+        return endpoint
+
+    @contextlib.contextmanager
+    def phase(self, name, result: SyncResult):
+        """Times a phase of the run and publishes its progress.
+
+        Args:
+          name: The phase's name.
+          result: SyncResult: The result to record the phase's timing in.
+
+        Yields:
+          A callable counting each file the phase processes, or None if the Syncer has
+          no progress callback.
+        """
+
+        counter = None
+        if self.progress is not None:
+            self.progress(progressutil.PhaseProgress(name, 'started'))
+            counter = progressutil.FileCounter(self.progress, name)
+
+        start = time.perf_counter()
+        try:
+            yield counter.add if counter is not None else None
+        finally:
+            seconds = time.perf_counter() - start
+            result.add_timing(name, seconds)
+
+            if counter is not None:
+                if counter.files:
+                    counter.finish()
+
+                self.progress(progressutil.PhaseProgress(name, 'finished', seconds))
+
+    def resolve(self, path):
+        """Resolves a configured path against the repository folder.
+
+        Args:
+          path: A relative or absolute path.
+
+        Returns:
+          An absolute Path object.
+        """
+
+        return self.repository_folder / path
+
+
+def perform_checkout(config_path: Path):
+    """Performs the entire checkout operation using a configuration file.
+
+    A full checkout operation includes the following steps:
+    - Adds a remote repository
+    - Fetches the remote
+    - Checks out a list of sources (files or folders) from the remote
+    - If destination paths are defined, will move sources to the matching destinations
+    - Performs any configured cleanup (deletion of files or folders)
+    - Removes the remote
+
+    Args:
+      config_path: Path: A Path object for the configuration file to perform the
+      checkout operation with.
+
+    Returns:
+      A SyncResult object describing the checkout.
+    """
+
+    return perform_checkouts([config_path])
+
+
+def perform_checkouts(config_paths, progress=None, textfile_path: Path = None):
+    """Performs checkout operations for several configuration files.
+
+    Configurations that share a remote URL are fetched with a single fetch command
+    before any of them are checked out. The run's metrics are recorded in the local
+    repository's metrics history.
+
+    Args:
+      config_paths: A list of Path objects for the configuration files to perform
+        checkout operations with.
+      progress:  (Default value = None) A callable receiving ProgressEvent objects
+        during the checkouts.
+      textfile_path: Path:  (Default value = None) A Path object for a Prometheus
+        textfile collector file to update with the metrics history after the run.
+
+    Returns:
+      A SyncResult object describing the checkouts.
+    """
+
+    configurations = [config.Configuration.from_file(config_path) for config_path in config_paths]
+    syncer = Syncer(configurations, progress=progress)
+
+    cwd = syncer.repository_folder
+    object_size = get_object_database_size(cwd)
+    subprocess_count = commandutil.get_subprocess_count()
+    start_time = time.time()
+    start = time.perf_counter()
+
+    result = None
+    try:
+        result = syncer.run()
+    finally:
+        # Note: Metrics are best effort, so no error recording them may fail the checkout
+        # or replace an exception raised by the run.
+        try:
+            seconds = time.perf_counter() - start
+            subprocess_count = commandutil.get_subprocess_count() - subprocess_count
+            bytes_fetched = None
+            if object_size is not None:
+                bytes_fetched = max(0, (get_object_database_size(cwd) or 0) - object_size)
+
+            peak_rss, child_peak_rss = metrics.get_peak_rss()
+            run = metrics.RunMetrics(
+                metrics.get_config_key(config_paths),
+                ','.join(sorted({config.get_remote_url(c) for c in configurations})),
+                time=start_time,
+                seconds=seconds,
+                success=result is not None and result.success,
+                files_written=len(result.files_written) if result else 0,
+                files_skipped=len(result.files_skipped) if result else 0,
+                files_deleted=len(result.files_deleted) if result else 0,
+                bytes_fetched=bytes_fetched,
+                subprocesses=subprocess_count,
+                peak_rss_bytes=peak_rss,
+                child_peak_rss_bytes=child_peak_rss,
+                phases=result.timings if result else {},
+            )
+            record_metrics(run, textfile_path, cwd)
+        except Exception as exception:
+            core_log.warning(f'Unable to record checkout metrics, {exception}')
+
+    return result
+
+
+def perform_export(config_paths, archive_path, compression=None):
+    """Exports the sources of several configuration files to a tar archive.
+
+    Args:
+      config_paths: A list of Path objects for the configuration files to export.
+      archive_path: The archive's path, or '-' to write to standard output.
+      compression:  (Default value = None) 'none', 'gzip' or 'zstd'. Chosen from the
+        archive's file name if None.
+
+    Returns:
+      A SyncResult object describing the export.
+    """
+
+    if compression is None:
+        compression = archive.get_compression(archive_path)
+
+    configurations = [config.Configuration.from_file(config_path) for config_path in config_paths]
+    return Syncer(configurations).export(archive_path, compression)
+
+
+def perform_import(archive_path, destination_folder=None, workers=None):
+    """Writes the files in an archive created by an export to a folder.
+
+    Args:
+      archive_path: The archive's path, or '-' to read from standard input.
+      destination_folder:  (Default value = None) The folder to write files to.
+        Defaults to the current working directory.
+      workers:  (Default value = None) The maximum number of files to write at once.
+        Defaults to the number of processors.
+
+    Returns:
+      A list of Path objects for the files written.
+    """
+
+    exports, written = archive.import_archive(
+        archive_path, Path(destination_folder or Path.cwd()), workers
+    )
+    return written
+
+
+def perform_bundle(config_paths, bundle_path, since=None, full=False):
+    """Writes the commits fetched for several configuration files to a git bundle file.
+
+    Args:
+      config_paths: A list of Path objects for the configuration files to bundle.
+      bundle_path: The bundle file's path.
+      since:  (Default value = None) A commit to create the bundle relative to, instead
+        of each configuration's last checked out commit.
+      full:  (Default value = False) Creates a bundle containing every fetched commit's
+        full history if True.
+
+    Returns:
+      A SyncResult object describing the fetch, or None if there were no new commits to
+      bundle.
+    """
+
+    configurations = [config.Configuration.from_file(config_path) for config_path in config_paths]
+    return Syncer(configurations).bundle(bundle_path, since, full)
+
+
+def perform_rollback(config_paths, list_only=False):
+    """Restores the destinations of several configuration files from the snapshots
+    taken before their last checkouts.
+
+    Args:
+      config_paths: A list of Path objects for the configuration files to roll back.
+      list_only:  (Default value = False) Logs the available snapshots instead of
+        restoring them if True.
+
+    Returns:
+      True if every configuration had a snapshot.
+    """
+
+    configurations = [config.Configuration.from_file(config_path) for config_path in config_paths]
+    syncer = Syncer(configurations)
+
+    if not list_only:
+        return all(restored is not None for restored in syncer.rollback())
+
+    snapshot_lists = syncer.list_snapshots()
+    for config_path, snapshots in zip(config_paths, snapshot_lists):
+        core_log.info(f'{config_path}: {len(snapshots)} snapshot(s)')
+        for taken in snapshots:
+            time_taken = datetime.datetime.fromtimestamp(taken.time_ns / 1e9)
+            core_log.info(
+                f'    {time_taken:%Y-%m-%d %H:%M:%S} {taken.commit or "(unknown commit)"}'
+            )
+
+    return all(snapshot_lists)
+
+
+def perform_stats(config_paths=None, window=20, threshold=1.5, textfile_path: Path = None):
+    """Summarizes the metrics history of recent checkouts, logging regressions of the
+    latest run of each configuration against a rolling baseline.
+
+    Args:
+      config_paths:  (Default value = None) A list of Path objects for the
+        configuration files to summarize. All recorded configurations are summarized
+        if None.
+      window:  (Default value = 20) The number of earlier runs forming the baseline.
+      threshold:  (Default value = 1.5) The multiple of the baseline's median a value
+        must exceed to be a regression.
+      textfile_path: Path:  (Default value = None) A Path object for a Prometheus
+        textfile collector file to write the metrics history to.
+
+    Returns:
+      True if no regressions were found, False if any were, or None if the metrics
+      history could not be read.
+    """
+
+    database_path = metrics.get_database_path(get_git_folder())
+    config_key = metrics.get_config_key(config_paths) if config_paths else None
+
+    try:
+        keys = metrics.list_keys(database_path)
+        if config_key is not None:
+            keys = [key for key in keys if key[0] == config_key]
+
+        if not keys:
+            core_log.info('No checkout runs have been recorded')
+
+        clean = True
+        for config_key, remote_key in keys:
+            runs = metrics.read_runs(database_path, config_key, remote_key, window + 1)
+            latest = runs[0]
+            durations = [run.seconds for run in runs[1:] if run.success]
+
+            baseline = f'{statistics.median(durations):.2f} s' if durations else 'none'
+            core_log.info(
+                f'{config_key} ({remote_key}): latest {latest.seconds:.2f} s, '
+                f'{"succeeded" if latest.success else "failed"}, baseline median {baseline} '
+                f'over {len(durations)} run(s)'
+            )
+
+            for regression in metrics.find_regressions(runs, threshold):
+                clean = False
+                core_log.warning(
+                    f'    Regression in {regression.name}: {regression.value:.2f} vs '
+                    f'{regression.baseline:.2f} ({regression.ratio:.1f}x)'
+                )
+
+        if textfile_path is not None:
+            metrics.write_textfile(textfile_path, database_path)
+    except metrics.MetricsError:
+        # Note: The error is already logged.
+        return None
+
+    return clean
+
+
+def perform_verify(config_paths):
+    """Verifies the destinations of several configuration files against the manifests
+    written by their last checkouts, logging any drift.
+
+    Args:
+      config_paths: A list of Path objects for the configuration files to verify.
+
+    Returns:
+      True if every destination matches its manifest.
+    """
+
+    configurations = [config.Configuration.from_file(config_path) for config_path in config_paths]
+    drifts = Syncer(configurations).verify()
+
+    clean = True
+    for config_path, drift in zip(config_paths, drifts):
+        if drift is None:
+            clean = False
+            continue
+
+        if drift.clean:
+            core_log.info(f'{config_path}: destinations match the last checkout')
+            continue
+
+        clean = False
+        core_log.info(
+            f'{config_path}: {len(drift.modified)} modified, {len(drift.missing)} missing, '
+            f'{len(drift.extra)} extra'
+        )
+        for state, keys in (
+            ('modified', drift.modified),
+            ('missing', drift.missing),
+            ('extra', drift.extra),
+        ):
+            for key in keys:
+                core_log.info(f'    {state}: {key}')
+
+    return clean
+
+
+def record_metrics(run, textfile_path: Path = None, cwd=None):
+    """Adds a run to the local repository's metrics history.
+
+    Metrics are best effort, so errors are logged rather than raised.
+
+    Args:
+      run: The RunMetrics object to record.
+      textfile_path: Path:  (Default value = None) A Path object for a Prometheus
+        textfile collector file to update with the metrics history.
+      cwd:  (Default value = None) The local repository's root folder.
+    """
+
+    database_path = metrics.get_database_path(get_git_folder(cwd))
+    try:
+        metrics.record_run(database_path, run)
+        if textfile_path is not None:
+            metrics.write_textfile(textfile_path, database_path)
+    except metrics.MetricsError:
+        # Note: The error is already logged and should not fail the checkout.
+        pass
+
+
+def get_object_database_size(cwd=None):
+    """Executes a 'git count-objects' command to measure the local object database.
+
+    Args:
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      The size of the loose objects and packs in bytes, or None if it could not be
+      measured.
+    """
+
+    command = ['git', 'count-objects', '-v']
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+
+    values = dict(line.split(': ', 1) for line in o.splitlines() if ': ' in line)
+    try:
+        return (int(values['size']) + int(values['size-pack'])) * 1024
+    except (KeyError, ValueError):
+        return None
+
+
+def fetch_branches(remote_name, remote_url, branches, cwd=None, progress=None):
+    """Adds a remote, fetches branches from it and removes it again.
+
+    Args:
+      remote_name: The name to give the remote.
+      remote_url: The remote repository's URL.
+      branches: A list of branch names to fetch.
+      cwd:  (Default value = None) The local repository's root folder.
+      progress:  (Default value = None) A callable receiving TransferProgress events.
+
+    Returns:
+      A dictionary mapping each branch name to its fetched commit hash.
+    """
+
+    # Note: The remote only exists while fetching, so invocations using the same remote
+    # name take turns.
+    with hold_repository_lock(f'remote-{remote_name}', cwd):
+        add_remote(remote_name, remote_url, cwd)
+        fetch_remote(remote_name, branches, cwd, progress)
+
+        commits = {branch: get_remote_head_hash(remote_name, branch, cwd) for branch in branches}
+
+        remove_remote(remote_name, cwd)
+
+    return commits
+
+
+def fetch_namespace_branches(
+    remote_name, remote_url, branches, prune=True, cwd=None, progress=None
+):
+    """Fetches branches from a remote URL into a persistent private ref namespace.
+
+    Refs are written to 'refs/subtreeutil/<remote_name>-<url_hash>/<branch>' and kept
+    between runs, so subsequent fetches only transfer what changed upstream. No remote is
+    added to the local repository's configuration.
+
+    Args:
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+      branches: A list of branch names to fetch.
+      prune:  (Default value = True) Deletes refs in the namespace for branches that
+        no longer exist at the remote if True.
+      cwd:  (Default value = None) The local repository's root folder.
+      progress:  (Default value = None) A callable receiving TransferProgress events.
+
+    Returns:
+      A dictionary mapping each branch name to its fetched commit hash.
+    """
+
+    namespace = get_ref_namespace(remote_name, remote_url)
+
+    command = ['git', 'fetch', '--no-tags', remote_url]
+    command.extend(f'+refs/heads/{branch}:{namespace}/{branch}' for branch in branches)
+
+    with hold_repository_lock(f'remote-{remote_name}', cwd):
+        execute_fetch_command(command, cwd, progress)
+
+        if prune:
+            prune_namespace_refs(remote_name, remote_url, branches, cwd)
+
+        return {branch: get_ref_hash(f'{namespace}/{branch}', cwd) for branch in branches}
+
+
+def fetch_partial_branches(
+    remote_name, remote_url, branches, prune=True, cwd=None, progress=None
+):
+    """Fetches branches' commits and trees without their blobs into a private ref
+    namespace.
+
+    The remote is configured as a promisor remote named
+    'subtreeutil-<remote_name>-<url_hash>' and kept between runs, so git can fetch any
+    blob it is missing on demand. Blobs needed for checkouts are fetched in batches with
+    fetch_source_blobs().
+
+    Args:
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+      branches: A list of branch names to fetch.
+      prune:  (Default value = True) Deletes refs in the namespace for branches that
+        no longer exist at the remote if True.
+      cwd:  (Default value = None) The local repository's root folder.
+      progress:  (Default value = None) A callable receiving TransferProgress events.
+
+    Returns:
+      A dictionary mapping each branch name to its fetched commit hash.
+    """
+
+    promisor_remote = get_promisor_remote(remote_name, remote_url)
+    namespace = get_ref_namespace(remote_name, remote_url)
+
+    command = ['git', 'fetch', '--no-tags', f'--filter={_PARTIAL_FETCH_FILTER}', promisor_remote]
+    command.extend(f'+refs/heads/{branch}:{namespace}/{branch}' for branch in branches)
 
-    A full checkout operation includes the following steps:
-    - Adds a remote repository
-    - Fetches the remote
-    - Checks out a list of sources (files or folders) from the remote
-    - If destination paths are defined, will move sources to the matching destinations
-    - Performs any configured cleanup (deletion of files or folders)
-    - Removes the remote
+    with hold_repository_lock(f'remote-{remote_name}', cwd):
+        configure_promisor_remote(promisor_remote, remote_url, cwd)
+        execute_fetch_command(command, cwd, progress)
+
+        if prune:
+            prune_namespace_refs(remote_name, remote_url, branches, cwd)
+
+        return {branch: get_ref_hash(f'{namespace}/{branch}', cwd) for branch in branches}
+
+
+def fetch_with_bundles(
+    remote_name,
+    remote_url,
+    bundle_paths,
+    branches,
+    fetch_function,
+    offline=False,
+    cwd=None,
+    progress=None,
+):
+    """Fetches branches from bundle files and then from the remote URL.
+
+    Bundles seed the local repository with objects, so the remote URL only transfers
+    newer commits. Branches the bundles already hold at the remote's commit are not
+    fetched from it. If the remote URL can not be reached or a branch can not be
+    fetched from it, the branch's commit from the bundles is used.
 
     Args:
-      config_path: Path: A Path object for the configuration file to perform the
-      checkout operation with.
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+      bundle_paths: A list of Path objects for the bundle files, oldest first.
+      branches: A list of branch names to fetch.
+      fetch_function: A callable taking a list of branch names, fetching them from the
+        remote URL and returning a dictionary that maps each branch name to its commit
+        hash.
+      offline:  (Default value = False) Only fetches from the bundles if True.
+      cwd:  (Default value = None) The local repository's root folder.
+      progress:  (Default value = None) A callable receiving TransferProgress events.
+
+    Returns:
+      A dictionary mapping each branch name to its fetched commit hash, or an empty
+      string for branches that could not be fetched.
+    """
+
+    commits = fetch_bundles(remote_name, remote_url, bundle_paths, branches, cwd, progress)
+
+    if offline:
+        core_log.info(f'Skipping {remote_url}, only fetching from bundles')
+        return {branch: commits.get(branch, '') for branch in branches}
+
+    remote_commits = get_remote_branch_hashes(remote_url, branches, cwd)
+    if not remote_commits:
+        core_log.warning(f'Unable to reach {remote_url}, using the commits fetched from bundles')
+        return {branch: commits.get(branch, '') for branch in branches}
+
+    url_branches = [
+        branch
+        for branch in branches
+        if branch in remote_commits and commits.get(branch) != remote_commits[branch]
+    ]
+    if url_branches:
+        core_log.info(f'Fetching {", ".join(url_branches)} from the remote URL')
+        url_commits = fetch_function(url_branches)
+
+        for branch in url_branches:
+            # Note: A failed fetch leaves a namespace ref at the commit from the bundles.
+            if url_commits.get(branch) and url_commits[branch] != commits.get(branch):
+                commits[branch] = url_commits[branch]
+            elif branch in commits:
+                core_log.warning(
+                    f'Unable to fetch {branch} from {remote_url}, using the commit fetched '
+                    f'from bundles'
+                )
+
+    for branch in branches:
+        if branch not in remote_commits and branch in commits:
+            core_log.warning(
+                f'{branch} was not found at {remote_url}, using the commit fetched from bundles'
+            )
+
+        # Note: Fetching from the remote URL may prune or fail to update the refs fetched
+        # from bundles.
+        if branch in commits:
+            update_namespace_ref(remote_name, remote_url, branch, commits[branch], cwd)
+
+    return {branch: commits.get(branch, '') for branch in branches}
+
+
+def fetch_bundles(remote_name, remote_url, bundle_paths, branches, cwd=None, progress=None):
+    """Fetches branches from git bundle files into a private ref namespace.
+
+    Each bundle's header is verified before fetching and unreadable bundles are skipped.
+    Incremental bundles whose prerequisite commits have not been fetched are retried
+    after the other bundles, and skipped if their prerequisites are still missing.
+    Branches in later bundles replace those fetched from earlier ones.
+
+    Args:
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+      bundle_paths: A list of Path objects for the bundle files, oldest first.
+      branches: A list of branch names to fetch.
+      cwd:  (Default value = None) The local repository's root folder.
+      progress:  (Default value = None) A callable receiving TransferProgress events.
+
+    Returns:
+      A dictionary mapping each branch name found in a bundle to its fetched commit hash.
+    """
+
+    namespace = get_ref_namespace(remote_name, remote_url)
+
+    pending = []
+    for bundle_path in bundle_paths:
+        if not bundle_path.exists():
+            core_log.warning(f'Skipping missing bundle \'{bundle_path}\'')
+            continue
+
+        try:
+            header = bundle.read_bundle_header(bundle_path)
+        except bundle.InvalidBundleError as exception:
+            core_log.warning(f'Skipping bundle, {exception}')
+            continue
+
+        refs = bundle.get_branch_refs(header, namespace)
+        refs = {branch: ref for branch, ref in refs.items() if branch in branches}
+        if refs:
+            pending.append((bundle_path, header, refs))
+
+    commits = {}
+    with hold_repository_lock(f'remote-{remote_name}', cwd):
+        while pending:
+            skipped = []
+            for bundle_path, header, refs in pending:
+                if not all(get_ref_hash(oid, cwd) for oid in header.prerequisites):
+                    skipped.append((bundle_path, header, refs))
+                    continue
+
+                core_log.info(f'Fetching {", ".join(refs)} from bundle \'{bundle_path}\'')
+
+                command = ['git', 'fetch', '--no-tags', str(bundle_path)]
+                command.extend(f'+{ref}:{namespace}/{branch}' for branch, ref in refs.items())
+                execute_fetch_command(command, cwd, progress)
+
+                for branch in refs:
+                    commit_hash = get_ref_hash(f'{namespace}/{branch}', cwd)
+                    if commit_hash:
+                        commits[branch] = commit_hash
+
+            # Note: Stop once a pass fetches nothing, as no more prerequisites can appear.
+            if len(skipped) == len(pending):
+                for bundle_path, header, refs in skipped:
+                    core_log.warning(
+                        f'Skipping bundle \'{bundle_path}\', its prerequisite commits have '
+                        f'not been fetched'
+                    )
+                break
+
+            pending = skipped
+
+    return commits
+
+
+def get_remote_branch_hashes(remote_url, branches, cwd=None):
+    """Executes a 'git ls-remote' command to retrieve the commit hashes of a remote's
+    branches.
+
+    Args:
+      remote_url: The remote repository's URL.
+      branches: A list of branch names to look up.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A dictionary mapping each branch name found at the remote to its commit hash. The
+      dictionary is empty if the remote could not be reached.
+    """
+
+    command = ['git', 'ls-remote', '--heads', remote_url]
+    command.extend(f'refs/heads/{branch}' for branch in branches)
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+
+    commits = {}
+    for line in o.splitlines():
+        commit_hash, _, ref = line.partition('\t')
+        if ref.startswith('refs/heads/'):
+            commits[ref[len('refs/heads/') :]] = commit_hash
+
+    return commits
+
+
+def create_bundle(bundle_path: Path, refs, excluded_commits=None, cwd=None):
+    """Executes a 'git bundle create' command.
+
+    Args:
+      bundle_path: Path: A Path object for the bundle file to write.
+      refs: A list of the full names of the refs to include.
+      excluded_commits:  (Default value = None) A list of commit hashes whose history is
+        left out of the bundle. The bundle requires them to be present when fetching.
+      cwd:  (Default value = None) The local repository's root folder.
+    """
+
+    bundle_path.parent.mkdir(parents=True, exist_ok=True)
+
+    command = ['git', 'bundle', 'create', '--quiet', str(bundle_path)]
+    command.extend(refs)
+    command.extend(f'^{commit_hash}' for commit_hash in excluded_commits or [])
+    commandutil.execute_command(command, cwd=cwd)
+
+
+def get_promisor_remote(remote_name, remote_url):
+    """Fetches the name of the promisor remote used for a remote's partial fetches.
+
+    Args:
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+
+    Returns:
+      A string containing the promisor remote's name.
+    """
+
+    return f'{_PROMISOR_REMOTE_PREFIX}{get_remote_id(remote_name, remote_url)}'
+
+
+def configure_promisor_remote(promisor_remote, remote_url, cwd=None):
+    """Executes 'git config' commands to configure a remote for partial fetches.
+
+    The remote is given no fetch refspec so that only explicitly requested refs and
+    objects are fetched from it. The local repository's configuration is only written
+    if the remote's URL changed.
+
+    Args:
+      promisor_remote: The name of the remote to configure.
+      remote_url: The remote repository's URL.
+      cwd:  (Default value = None) The local repository's root folder.
+    """
+
+    command = ['git', 'config', '--get', f'remote.{promisor_remote}.url']
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+    if o.strip() == remote_url:
+        return
+
+    settings = {
+        'url': remote_url,
+        'promisor': 'true',
+        'partialclonefilter': _PARTIAL_FETCH_FILTER,
+    }
+    with hold_repository_lock('config', cwd):
+        for key, value in settings.items():
+            command = ['git', 'config', f'remote.{promisor_remote}.{key}', value]
+            commandutil.execute_command(command, cwd=cwd)
+
+
+def get_missing_blobs(commit_hash, source_paths, cwd=None):
+    """Executes a 'git rev-list' command to find the blobs under source paths that have
+    not been fetched.
+
+    Args:
+      commit_hash: The fetched commit hash to search.
+      source_paths: A list of file or folder paths to search, relative to the
+        repository's root folder.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A list of missing blob ids.
+    """
+
+    command = ['git', 'rev-list', '--objects', '--no-walk', '--missing=print', commit_hash, '--']
+    command.extend(str(source_path) for source_path in source_paths)
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+
+    return [line[1:] for line in o.splitlines() if line.startswith('?')]
+
+
+def fetch_source_blobs(promisor_remote, commit_hash, source_paths, cwd=None, progress=None):
+    """Fetches the blobs under source paths that a partial fetch left out.
+
+    Blobs are requested by id in batches, so the transfer only includes files that are
+    actually checked out.
+
+    Args:
+      promisor_remote: The name of the promisor remote to fetch blobs from.
+      commit_hash: The fetched commit hash to check out from.
+      source_paths: A list of file or folder paths to fetch blobs for, relative to the
+        repository's root folder.
+      cwd:  (Default value = None) The local repository's root folder.
+      progress:  (Default value = None) A callable receiving TransferProgress events.
+
+    Returns:
+      A list of the fetched blob ids.
+    """
+
+    blob_ids = get_missing_blobs(commit_hash, source_paths, cwd)
+    if not blob_ids:
+        return []
+
+    core_log.info(f'Fetching {len(blob_ids)} blob(s) from {promisor_remote}')
+
+    for start in range(0, len(blob_ids), _BLOB_FETCH_BATCH_SIZE):
+        command = [
+            'git',
+            '-c',
+            'fetch.negotiationAlgorithm=noop',
+            'fetch',
+            '--no-tags',
+            '--no-write-fetch-head',
+            '--recurse-submodules=no',
+            f'--filter={_PARTIAL_FETCH_FILTER}',
+            promisor_remote,
+        ]
+        command.extend(blob_ids[start : start + _BLOB_FETCH_BATCH_SIZE])
+        execute_fetch_command(command, cwd, progress)
+
+    return blob_ids
+
+
+def get_ref_namespace(remote_name, remote_url):
+    """Fetches the private ref namespace for a remote.
+
+    Args:
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+
+    Returns:
+      A string containing the namespace's ref prefix.
+    """
+
+    return f'{_REF_NAMESPACE}/{get_remote_id(remote_name, remote_url)}'
+
+
+def get_remote_id(remote_name, remote_url):
+    """Fetches the name identifying a remote's private refs and promisor remote.
+
+    The remote's URL is hashed into the name, so configurations giving the same remote
+    name to different URLs never share refs or promisor remotes.
+
+    Args:
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+
+    Returns:
+      A string containing the remote name followed by a hash of its URL.
+    """
+
+    url_hash = hashlib.sha1(remote_url.encode('utf-8')).hexdigest()
+    return f'{remote_name}-{url_hash[:_REMOTE_URL_HASH_LENGTH]}'
+
+
+def get_ref_hash(ref, cwd=None):
+    """Executes a 'git rev-parse' command to retrieve the commit hash a ref points to.
+
+    Args:
+      ref: The full name of the ref to resolve.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A string containing the commit hash, or an empty string if the ref does not exist.
+    """
+
+    command = ['git', 'rev-parse', '--verify', '--quiet', f'{ref}^{{commit}}']
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+    return o.strip()
+
+
+def update_namespace_ref(remote_name, remote_url, branch, commit_hash, cwd=None):
+    """Executes a 'git update-ref' command to point a branch's ref in a remote's private
+    namespace at a commit.
+
+    Args:
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+      branch: The branch name.
+      commit_hash: The commit hash to point the ref at.
+      cwd:  (Default value = None) The local repository's root folder.
+    """
+
+    ref = f'{get_ref_namespace(remote_name, remote_url)}/{branch}'
+    command = ['git', 'update-ref', ref, commit_hash]
+    commandutil.execute_command(command, display=False, cwd=cwd)
+
+
+def prune_namespace_refs(remote_name, remote_url, branches, cwd=None):
+    """Deletes refs in a remote's private namespace for branches that no longer exist at
+    the remote.
+
+    Refs of branches that other configurations or invocations fetched from the same
+    remote are kept as long as the branch exists upstream.
+
+    Args:
+      remote_name: The remote repository's name.
+      remote_url: The remote repository's URL.
+      branches: A list of the branch names that were just fetched.
+      cwd:  (Default value = None) The local repository's root folder.
+    """
+
+    namespace = get_ref_namespace(remote_name, remote_url)
+
+    command = ['git', 'for-each-ref', '--format=%(refname)', f'{namespace}/']
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+
+    refs = {ref[len(namespace) + 1 :]: ref for ref in o.splitlines() if ref}
+    unfetched_branches = [branch for branch in refs if branch not in branches]
+    if not unfetched_branches:
+        return
+
+    # Note: The fetched branches are looked up as well, so a remote that could not be
+    # reached is told apart from one whose branches were all deleted.
+    remote_commits = get_remote_branch_hashes(remote_url, branches + unfetched_branches, cwd)
+    if not any(branch in remote_commits for branch in branches):
+        core_log.warning(f'Unable to list the branches of {remote_url}, not pruning refs')
+        return
+
+    for branch in unfetched_branches:
+        if branch not in remote_commits:
+            command = ['git', 'update-ref', '-d', refs[branch]]
+            commandutil.execute_command(command, cwd=cwd)
+
+
+def get_git_folder(cwd=None):
+    """Executes a 'git rev-parse' command to locate the local repository's git folder.
+
+    Args:
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A Path object for the git folder.
     """
 
-    config.load_config_file(config_path)
+    command = ['git', 'rev-parse', '--git-dir']
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+    return Path(cwd or '.') / o.strip()
 
-    # TODO: Handle case where an existing repository doesn't exist
 
-    remote_name = config.get_remote_name()
-    branch = config.get_branch()
-    source_paths = config.get_source_paths()
+def hold_repository_lock(name, cwd=None):
+    """Holds one of the local repository's locks for the duration of a with statement.
 
-    add_remote(remote_name, config.get_remote_url())
-    fetch_remote(remote_name)
+    Args:
+      name: The lock's name, such as 'index' or 'config'.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      A context manager holding the lock.
+    """
 
-    commit_hash = get_remote_head_hash(remote_name, branch)
-    core_log.info(f'Checking out files from {remote_name}/{branch} ({commit_hash})\n')
+    lock_path = lock.get_lock_folder(get_git_folder(cwd)) / f'{name}.lock'
+    return lock.hold_lock(lock_path, f'the repository\'s {name} lock')
 
-    for source_path in source_paths:
-        checkout_remote_source(remote_name, branch, source_path)
 
-    unstage_all()
-    remove_remote(remote_name)
+def hold_store_lock(store_folder: Path):
+    """Holds a blob store's lock for the duration of a with statement.
 
-    # Note: zip() will stop as soon as the shortest list is exhausted.
-    for source_path, destination_path in zip(source_paths, config.get_destination_paths()):
-        move_source(Path(source_path), Path(destination_path))
+    Args:
+      store_folder: Path: A Path object for the blob store.
 
-    for cleanup_path in config.get_cleanup_paths():
-        cleanup_path = Path(cleanup_path)
-        delete_source(cleanup_path)
+    Returns:
+      A context manager holding the lock.
+    """
 
-    core_log.info('Checkout complete!')
+    store_folder.mkdir(parents=True, exist_ok=True)
+    return lock.hold_lock(store_folder / 'store.lock', f'the blob store \'{store_folder}\'')
 
 
-def add_remote(remote_name, remote_url):
+def add_remote(remote_name, remote_url, cwd=None):
     """Executes a 'git add remote' command.
 
     Args:
       remote_name: The remote repository's name.
       remote_url: The remote repository's URL.
+      cwd:  (Default value = None) The local repository's root folder.
     """
 
     command = ['git', 'remote', 'add', remote_name, remote_url]
-    commandutil.execute_command(command)
+    with hold_repository_lock('config', cwd):
+        commandutil.execute_command(command, cwd=cwd)
 
 
-def remove_remote(remote_name):
+def remove_remote(remote_name, cwd=None):
     """Executes a 'git remove remote' command.
 
     Args:
       remote_name: The name of the remote to remove.
+      cwd:  (Default value = None) The local repository's root folder.
     """
 
     command = ['git', 'remote', 'remove', remote_name]
-    commandutil.execute_command(command)
+    with hold_repository_lock('config', cwd):
+        commandutil.execute_command(command, cwd=cwd)
 
 
-def fetch_remote(remote_name):
+def fetch_remote(remote_name, branches=None, cwd=None, progress=None):
     """Executes a 'git fetch' command on a remote.
 
     Args:
       remote_name: The name of the remote to fetch.
+      branches:  (Default value = None) A list of branch names to fetch. All branches
+        are fetched if None.
+      cwd:  (Default value = None) The local repository's root folder.
+      progress:  (Default value = None) A callable receiving TransferProgress events.
     """
 
     command = ['git', 'fetch', remote_name]
-    commandutil.execute_command(command)
+    if branches:
+        command.extend(branches)
+
+    execute_fetch_command(command, cwd, progress)
 
 
-def get_remote_head_hash(remote_name, branch):
+def execute_fetch_command(command, cwd=None, progress=None):
+    """Executes a 'git fetch' command, publishing its transfer progress.
+
+    Args:
+      command: The 'git fetch' command to execute.
+      cwd:  (Default value = None) The local repository's root folder.
+      progress:  (Default value = None) A callable receiving TransferProgress events.
+        Without one, the command is executed without progress reporting.
+    """
+
+    if progress is None:
+        commandutil.execute_command(command, cwd=cwd)
+        return
+
+    index = command.index('fetch') + 1
+    command = command[:index] + ['--progress'] + command[index:]
+    commandutil.execute_command_streamed(
+        command, progressutil.publish_git_progress(progress), cwd=cwd
+    )
+
+
+def get_remote_head_hash(remote_name, branch, cwd=None):
     """Executes a 'git log' command to retrieve a branch's HEAD commit hash.
 
     Args:
       remote_name: The remote name to log.
       branch: The branch name to log.
+      cwd:  (Default value = None) The local repository's root folder.
 
     Returns:
         A string containing the commit hash with the format 'remote_name/branch_name (commit_hash)'
     """
 
     command = ['git', 'log', '-n', '1', f'{remote_name}/{branch}', '--pretty=format:%H']
-    o, e = commandutil.execute_command(command, display=False)
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
     return o
 
 
-def checkout_remote_source(remote_name, remote_branch, source_path: Path):
-    """Executes a 'git checkout' command to retrieve the source path from a remote.
+def get_commit_time(commit_hash, cwd=None):
+    """Executes a 'git show' command to retrieve a commit's timestamp.
+
+    Args:
+      commit_hash: The commit hash to inspect.
+      cwd:  (Default value = None) The local repository's root folder.
+
+    Returns:
+      The commit's committer timestamp as a Unix timestamp.
+    """
+
+    command = ['git', 'show', '-s', '--format=%ct', commit_hash]
+    o, e = commandutil.execute_command(command, display=False, cwd=cwd)
+    return int(o.strip() or 0)
+
+
+def checkout_remote_source(commit_hash, source_path: Path, cwd=None):
+    """Executes a 'git checkout' command to retrieve the source path from a fetched commit.
 
     Args:
-      remote_name: The remote name to check out from.
-      remote_branch: The remote branch to check out from.
-      source_path: Path: A Path object for the file or folder to checkout from the remote branch.
+      commit_hash: The fetched commit hash to check out from.
+      source_path: Path: A Path object for the file or folder to checkout from the commit.
+      cwd:  (Default value = None) The local repository's root folder.
     """
 
-    command = ['git', 'checkout', f'{remote_name}/{remote_branch}', source_path]
-    commandutil.execute_command(command)
+    command = ['git', 'checkout', commit_hash, '--', str(source_path)]
+    commandutil.execute_command(command, cwd=cwd)
 
 
-def unstage_all():
-    """Executes a 'git reset' command."""
+def unstage_all(cwd=None):
+    """Executes a 'git reset' command.
+
+    Args:
+      cwd:  (Default value = None) The local repository's root folder.
+    """
 
     command = ['git', 'reset']
-    commandutil.execute_command(command)
+    commandutil.execute_command(command, cwd=cwd)
 
 
-def move_source(source_path: Path, destination_path: Path):
+def move_source(
+    source_path: Path,
+    destination_path: Path,
+    staged=False,
+    result: SyncResult = None,
+    callback=None,
+    staging_folders=None,
+):
     """Moves a source file or folder to a destination.
 
     Args:
       source_path: Path: A Path object for the source to move.
       destination_path: Path: A Path object for the destination to move the source to.
+      staged:  (Default value = False) Materializes folders in a staging folder and
+        swaps them into place if True.
+      result: SyncResult:  (Default value = None) A result to record written files in.
+      callback:  (Default value = None) A callable receiving a Path object for each
+        file after it is written.
+      staging_folders:  (Default value = None) A dictionary to add staged folders to,
+        mapping each destination to its staging folder, instead of swapping them into
+        place. Swap them with swap_destination().
     """
 
+    written = []
+
     try:
         if source_path.is_dir():
             core_log.info(f'Moving contents of \'{source_path}\' -> \'{destination_path}\'')
-            commandutil.move_folder(source_path, destination_path)
+            if staged and staging_folders is not None:
+                staging_folder, written = commandutil.stage_folder(
+                    source_path, destination_path, callback
+                )
+                if staging_folder is not None:
+                    staging_folders[destination_path] = staging_folder
+            elif staged:
+                written = commandutil.move_folder_staged(source_path, destination_path, callback)
+            else:
+                written = commandutil.move_folder(source_path, destination_path, callback)
 
         if source_path.is_file():
             core_log.info(f'Moving \'{source_path}\' -> \'{destination_path}\'')
             commandutil.move_file(source_path, destination_path)
+            written = [destination_path]
+
+            if callback is not None:
+                callback(destination_path)
     except (commandutil.MoveCommandError, commandutil.DeleteCommandError):
         # Exceptions of these types are already logged in lower level functions.
         # We simply want to intercept and continue as an error moving isn't the end of the world.
-        pass
+        if result is not None:
+            result.errors.append(source_path)
+
+    if result is not None:
+        result.files_written.extend(written)
+
+
+def materialize_source(
+    store_folder: Path,
+    commit_hash,
+    source_path: Path,
+    destination_path: Path,
+    staged=False,
+    hardlink=False,
+    cwd=None,
+    result: SyncResult = None,
+    callback=None,
+    staging_folders=None,
+):
+    """Writes a source file or folder from a fetched commit to a destination through the
+    blob store.
+
+    Unlike checking the source out, this neither writes the source path nor touches
+    the local repository's index.
+
+    Args:
+      store_folder: Path: A Path object for the blob store.
+      commit_hash: The fetched commit hash to read the source from.
+      source_path: Path: A Path object for the source file or folder, relative to the
+        repository's root folder.
+      destination_path: Path: A Path object for the destination to write the source to.
+      staged:  (Default value = False) Materializes folders in a staging folder and
+        swaps them into place if True.
+      hardlink:  (Default value = False) Allows hard linking files to the blob store
+        if True.
+      cwd:  (Default value = None) The local repository's root folder.
+      result: SyncResult:  (Default value = None) A result to record written files in.
+      callback:  (Default value = None) A callable receiving a Path object for each
+        file after it is written.
+      staging_folders:  (Default value = None) A dictionary to add staged folders to,
+        mapping each destination to its staging folder, instead of swapping them into
+        place. Swap them with swap_destination().
+    """
+
+    written = []
+    skipped = []
+
+    blobs = blobstore.list_blobs(commit_hash, source_path, cwd)
+    if not blobs:
+        core_log.warning(f'\'{source_path}\' does not exist in {commit_hash}')
+        if result is not None:
+            result.errors.append(source_path)
+        return
+
+    try:
+        with hold_store_lock(store_folder):
+            blobstore.add_blobs(store_folder, blobs, cwd)
+
+        if len(blobs) == 1 and blobs[0].path == source_path:
+            core_log.info(f'Writing \'{source_path}\' -> \'{destination_path}\'')
+            targets = [(blobs[0], destination_path, destination_path)]
+            target_folder = None
+        else:
+            core_log.info(f'Writing contents of \'{source_path}\' -> \'{destination_path}\'')
+
+            target_folder = destination_path
+            if staged:
+                target_folder = commandutil.prepare_staging_folder(destination_path)
+
+            targets = []
+            for blob in blobs:
+                relative_path = blob.path.relative_to(source_path)
+                targets.append(
+                    (blob, target_folder / relative_path, destination_path / relative_path)
+                )
+
+        for blob, target_file, destination_file in targets:
+            method = materialize_stored_blob(store_folder, blob, target_file, hardlink, cwd)
+            if method == 'unchanged':
+                skipped.append(destination_file)
+            else:
+                written.append(destination_file)
+
+                if callback is not None:
+                    callback(target_file)
+
+        if staged and target_folder is not None:
+            if staging_folders is not None:
+                staging_folders[destination_path] = target_folder
+            else:
+                commandutil.swap_folder(target_folder, destination_path)
+    except (
+        blobstore.BlobStoreError,
+        commandutil.MoveCommandError,
+        commandutil.DeleteCommandError,
+    ):
+        # Exceptions of these types are already logged in lower level functions.
+        if result is not None:
+            result.errors.append(source_path)
+        return
+
+    if result is not None:
+        result.files_written.extend(written)
+        result.files_skipped.extend(skipped)
+
+
+def materialize_stored_blob(
+    store_folder: Path, blob, destination_file: Path, hardlink=False, cwd=None
+):
+    """Writes a blob from the store to a destination file.
+
+    The store is not locked while writing, so a blob deleted by another invocation's
+    garbage collection since it was added is added again.
+
+    Args:
+      store_folder: Path: A Path object for the blob store.
+      blob: The Blob object to write.
+      destination_file: Path: A Path object for the file to write.
+      hardlink:  (Default value = False) Allows hard linking the destination to the
+        store if True.
+      cwd:  (Default value = None) The local repository's root folder.
 
+    Returns:
+      A string naming how the file was written, from blobstore.materialize_blob().
+
+    Raises:
+      MoveCommandError: An OSError occurred while attempting to write the file.
+      BlobStoreError: The blob could not be added to the store again.
+    """
+
+    try:
+        return blobstore.materialize_blob(store_folder, blob, destination_file, hardlink, cwd)
+    except commandutil.MoveCommandError:
+        if blob.is_symlink or blobstore.get_blob_path(store_folder, blob).exists():
+            raise
+
+    with hold_store_lock(store_folder):
+        blobstore.add_blobs(store_folder, [blob], cwd)
+        return blobstore.materialize_blob(store_folder, blob, destination_file, hardlink, cwd)
 
-def delete_source(cleanup_path: Path):
+
+def delete_source(
+    cleanup_path: Path, result: SyncResult = None, callback=None, staged_path: Path = None
+):
     """Deletes a file or folder.
 
     Args:
       cleanup_path: Path: A Path object for the file or folder to delete.
+      result: SyncResult:  (Default value = None) A result to record the deletion in.
+      callback:  (Default value = None) A callable receiving a Path object and size in
+        bytes for each file deleted.
+      staged_path: Path:  (Default value = None) A Path object for the cleanup path's
+        copy in a staging folder, which is deleted instead so that the deletion is
+        swapped into place with the rest of the destination.
     """
 
     core_log.info(f'Deleting \'{cleanup_path}\'')
 
+    delete_path = staged_path or cleanup_path
+
     # TODO: Test whether we need this guard if the command.delete methods handle exception catching
-    if not cleanup_path.exists():
+    if not delete_path.exists():
         core_log.warning(f'{cleanup_path} does not exist')
         return
 
+    # Note: Files are counted before deleting them, as they can't be measured afterwards.
+    deleted_files = []
+    if callback is not None:
+        files = delete_path.rglob('*') if delete_path.is_dir() else [delete_path]
+        deleted_files = [(file, file.lstat().st_size) for file in files if not file.is_dir()]
+
     try:
-        if cleanup_path.is_dir():
-            commandutil.delete_folder(cleanup_path)
+        if delete_path.is_dir():
+            commandutil.delete_folder(delete_path)
 
-        if cleanup_path.is_file():
-            commandutil.delete_file(cleanup_path)
+        if delete_path.is_file():
+            commandutil.delete_file(delete_path)
     except commandutil.DeleteCommandError:
         # Note: OSErrors here are not necessarily fatal and application execution
         # should continue.
-        pass
+        if result is not None:
+            result.errors.append(cleanup_path)
+        return
+
+    for file, size in deleted_files:
+        callback(file, size)
+
+    if result is not None:
+        result.files_deleted.append(cleanup_path)
+
+
+def swap_destination(staging_folder: Path, destination_path: Path, result: SyncResult = None):
+    """Swaps a staged folder into place at its destination.
+
+    If cleanup deleted the staging folder itself, the destination is deleted instead.
+
+    Args:
+      staging_folder: Path: A Path object for the staging folder.
+      destination_path: Path: A Path object for the destination folder.
+      result: SyncResult:  (Default value = None) A result to record errors in.
+    """
+
+    try:
+        if staging_folder.exists():
+            commandutil.swap_folder(staging_folder, destination_path)
+        elif destination_path.exists():
+            commandutil.delete_folder(destination_path)
+    except (commandutil.MoveCommandError, commandutil.DeleteCommandError):
+        # Exceptions of these types are already logged in lower level functions.
+        if result is not None:
+            result.errors.append(destination_path)
+
+
+def get_staged_path(path: Path, staging_folders):
+    """Fetches the path a destination file or folder is staged at.
+
+    Args:
+      path: Path: A Path object for the destination file or folder.
+      staging_folders: A dictionary mapping destination folders to their staging
+        folders.
+
+    Returns:
+      A Path object for the staged path, or None if the path is not in a staged folder.
+    """
+
+    for destination_path, staging_folder in staging_folders.items():
+        if path == destination_path or destination_path in path.parents:
+            return staging_folder / path.relative_to(destination_path)
+
+    return None
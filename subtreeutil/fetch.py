@@ -0,0 +1,187 @@
+"""Coordinates fetches so that each remote repository is only fetched once per run.
+
+Configurations sharing a remote URL are grouped together and their branches are
+fetched with a single command. The resulting commit hashes are recorded in the local
+repository's git folder so that concurrent invocations waiting on an in-flight fetch
+can reuse its result instead of fetching again.
+"""
+
+import hashlib
+import json
+import logging
+import time
+
+from pathlib import Path
+
+from . import config
+from . import lock
+
+
+# Folder (relative to the repository's git folder) used to coordinate fetches
+_FETCH_FOLDER = Path('subtreeutil') / 'fetch'
+
+# Seconds to wait for another invocation's fetch before giving up
+_LOCK_TIMEOUT = 600
+
+
+# Maps remote URLs to the branch commit hashes fetched during this run
+_fetched_commits = {}
+
+
+fetch_log = logging.getLogger('subtreeutil.fetch')
+
+
+class FetchError(Exception):
+    """Base error for fetch module exceptions."""
+
+
+class FetchLockTimeoutError(FetchError):
+    """Timed out while waiting for another invocation to finish fetching a remote."""
+
+
+def group_by_remote(configurations):
+    """Groups configuration dictionaries by their remote URL.
+
+    Args:
+      configurations: A list of configuration dictionaries.
+
+    Returns:
+      A dictionary mapping each remote URL to the list of configurations using it, in
+      the order they were first encountered.
+    """
+
+    groups = {}
+    for configuration in configurations:
+        remote_url = config.get_remote_url(configuration)
+        groups.setdefault(remote_url, []).append(configuration)
+
+    return groups
+
+
+def get_branches(configurations):
+    """Fetches the unique branch names used by a list of configurations.
+
+    Args:
+      configurations: A list of configuration dictionaries.
+
+    Returns:
+      A sorted list of branch names.
+    """
+
+    return sorted({config.get_branch(configuration) for configuration in configurations})
+
+
+def fetch_upstream(
+    git_folder: Path, remote_url, branches, fetch_function, fetched_commits=None
+):
+    """Fetches branches from a remote URL unless they were already fetched.
+
+    Fetches are coalesced at two levels. Within a run, a remote that has already been
+    fetched for the requested branches is not fetched again. Across invocations, a lock
+    file serializes fetches of the same remote URL and an invocation that had to wait
+    reuses the commit hashes recorded by the fetch it waited on.
+
+    Args:
+      git_folder: Path: A Path object for the local repository's git folder.
+      remote_url: The remote repository's URL.
+      branches: A list of branch names to fetch.
+      fetch_function: A callable taking a list of branch names, fetching them and
+        returning a dictionary that maps each branch name to its commit hash.
+      fetched_commits:  (Default value = None) A dictionary mapping remote URLs to the
+        branch commit hashes already fetched during this run. Defaults to a dictionary
+        shared by the whole process.
+
+    Returns:
+      A dictionary mapping each requested branch name to its fetched commit hash.
+
+    Raises:
+      FetchLockTimeoutError: Another invocation held the fetch lock for too long.
+    """
+
+    if fetched_commits is None:
+        fetched_commits = _fetched_commits
+
+    commits = fetched_commits.get(remote_url, {})
+    if all(branch in commits for branch in branches):
+        fetch_log.debug(f'Reusing fetch of \'{remote_url}\'')
+        return {branch: commits[branch] for branch in branches}
+
+    fetch_folder = git_folder / _FETCH_FOLDER
+    fetch_folder.mkdir(parents=True, exist_ok=True)
+
+    key = hashlib.sha1(remote_url.encode('utf-8')).hexdigest()
+    lock_path = fetch_folder / f'{key}.lock'
+    record_path = fetch_folder / f'{key}.json'
+
+    wait_start = time.time()
+    description = f'an in-flight fetch of \'{remote_url}\''
+    try:
+        waited = lock.acquire_lock(lock_path, description, _LOCK_TIMEOUT)
+    except lock.LockTimeoutError as exception:
+        message = f'Timed out waiting for fetch lock \'{lock_path}\''
+        raise FetchLockTimeoutError(message) from exception
+
+    try:
+        if waited:
+            commits = _read_record(record_path, remote_url, wait_start)
+            if all(branch in commits for branch in branches):
+                fetch_log.info(f'Reusing concurrent fetch of \'{remote_url}\'')
+                fetched_commits.setdefault(remote_url, {}).update(commits)
+                return {branch: commits[branch] for branch in branches}
+
+        commits = fetch_function(branches)
+        _write_record(record_path, remote_url, commits)
+        fetched_commits.setdefault(remote_url, {}).update(commits)
+    finally:
+        lock.release_lock(lock_path)
+
+    return commits
+
+
+def clear_fetched():
+    """Forgets all fetches recorded in the dictionary shared by the whole process."""
+
+    _fetched_commits.clear()
+
+
+def _read_record(record_path: Path, remote_url, newer_than):
+    """Reads the commit hashes recorded by another invocation's fetch.
+
+    Args:
+      record_path: Path: A Path object for the fetch record.
+      remote_url: The remote URL the record must belong to.
+      newer_than: A timestamp the record must have been written after.
+
+    Returns:
+      A dictionary mapping branch names to commit hashes, or an empty dictionary if no
+      suitable record exists.
+    """
+
+    try:
+        with record_path.open('r') as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if record.get('remote_url') != remote_url or record.get('time', 0) < newer_than:
+        return {}
+
+    return record.get('commits', {})
+
+
+def _write_record(record_path: Path, remote_url, commits):
+    """Records the commit hashes fetched from a remote URL.
+
+    Args:
+      record_path: Path: A Path object for the fetch record.
+      remote_url: The fetched remote URL.
+      commits: A dictionary mapping branch names to commit hashes.
+    """
+
+    record = {'remote_url': remote_url, 'time': time.time(), 'commits': commits}
+
+    temporary_path = record_path.with_suffix('.tmp')
+    with temporary_path.open('w') as f:
+        json.dump(record, f, indent=4)
+
+    temporary_path.replace(record_path)
@@ -0,0 +1,445 @@
+"""Resolves Git LFS pointer files written to destinations into their object contents.
+
+Objects are looked up by oid in the local repository's LFS object store, which also
+serves as the cache for objects downloaded from an endpoint. An endpoint is either a
+local folder holding objects (in the git-lfs 'ab/cd/<oid>' layout or flat) or the URL
+of an LFS server implementing the batch API. Objects are resolved in parallel with a
+bounded pool of worker threads.
+"""
+
+import concurrent.futures
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import urllib.request
+
+from pathlib import Path
+
+from . import command as commandutil
+
+
+# Pointer files are never larger than this many bytes
+_MAX_POINTER_SIZE = 1024
+
+# Matches the contents of a Git LFS pointer file
+_POINTER_PATTERN = re.compile(
+    rb'^version https://git-lfs\.github\.com/spec/v1\n'
+    rb'oid sha256:(?P<oid>[0-9a-f]{64})\n'
+    rb'size (?P<size>\d+)\n'
+)
+
+# Number of bytes to copy at a time when streaming objects
+_CHUNK_SIZE = 1024 * 1024
+
+# Maximum number of objects requested in a single batch API request
+_BATCH_SIZE = 100
+
+# Seconds to wait for an LFS server to respond
+_HTTP_TIMEOUT = 60
+
+_LFS_MEDIA_TYPE = 'application/vnd.git-lfs+json'
+
+
+lfs_log = logging.getLogger('subtreeutil.lfs')
+
+
+class LfsError(Exception):
+    """Base error for LFS module exceptions."""
+
+
+class LfsObjectNotFoundError(LfsError):
+    """An LFS object could not be found in the local store or at the endpoint."""
+
+
+class LfsIntegrityError(LfsError):
+    """An LFS object's contents did not match its pointer's oid or size."""
+
+
+class LfsPointer:
+    """A parsed Git LFS pointer.
+
+    Attributes:
+      oid: The object's SHA-256 hash as a hexadecimal string.
+      size: The object's size in bytes.
+    """
+
+    __slots__ = ('oid', 'size')
+
+    def __init__(self, oid, size):
+        self.oid = oid
+        self.size = size
+
+    def __eq__(self, other):
+        if not isinstance(other, LfsPointer):
+            return NotImplemented
+
+        return (self.oid, self.size) == (other.oid, other.size)
+
+    def __hash__(self):
+        return hash((self.oid, self.size))
+
+    def __repr__(self):
+        return f'LfsPointer(oid={self.oid!r}, size={self.size!r})'
+
+
+def parse_pointer(data: bytes):
+    """Parses the contents of a Git LFS pointer file.
+
+    Args:
+      data: bytes: The file's contents.
+
+    Returns:
+      An LfsPointer object, or None if the contents are not a pointer.
+    """
+
+    match = _POINTER_PATTERN.match(data)
+    if match is None:
+        return None
+
+    return LfsPointer(match.group('oid').decode('ascii'), int(match.group('size')))
+
+
+def read_pointer(file_path: Path):
+    """Reads a file if it is a Git LFS pointer file.
+
+    Args:
+      file_path: Path: A Path object for the file to read.
+
+    Returns:
+      An LfsPointer object, or None if the file is not a pointer.
+    """
+
+    try:
+        if file_path.is_symlink() or file_path.stat().st_size > _MAX_POINTER_SIZE:
+            return None
+
+        with file_path.open('rb') as f:
+            return parse_pointer(f.read(_MAX_POINTER_SIZE))
+    except OSError:
+        return None
+
+
+def get_object_path(objects_folder: Path, oid):
+    """Fetches the path of an object in a git-lfs layout object folder.
+
+    Args:
+      objects_folder: Path: A Path object for the object folder, such as
+        '.git/lfs/objects'.
+      oid: The object's oid.
+
+    Returns:
+      A Path object for the object's file.
+    """
+
+    return objects_folder / oid[0:2] / oid[2:4] / oid
+
+
+def resolve_pointers(files, objects_folder: Path, endpoint='', workers=8, callback=None):
+    """Replaces Git LFS pointer files with the objects they point to.
+
+    Files that are not pointers are left untouched.
+
+    Args:
+      files: A list of Path objects for the files to check.
+      objects_folder: Path: A Path object for the local LFS object store, which also
+        caches objects fetched from the endpoint.
+      endpoint:  (Default value = '') A local folder or LFS server URL to fetch objects
+        missing from the local store from.
+      workers:  (Default value = 8) The maximum number of objects to resolve at once.
+      callback:  (Default value = None) A callable receiving a Path object for each
+        file after it is replaced.
+
+    Returns:
+      A tuple containing a list of Path objects for the files replaced and a list of
+      Path objects for the pointer files that could not be resolved.
+    """
+
+    pointers = {}
+    for file in files:
+        pointer = read_pointer(file)
+        if pointer is not None:
+            pointers.setdefault(pointer, []).append(file)
+
+    if not pointers:
+        return [], []
+
+    write_object = functools.partial(_write_object, pointers, callback)
+    resolved, failed = _resolve_objects(
+        list(pointers), objects_folder, endpoint, workers, write_object
+    )
+
+    return (
+        [file for pointer_files in resolved.values() for file in pointer_files],
+        [file for pointer in failed for file in pointers[pointer]],
+    )
+
+
+def fetch_objects(pointers, objects_folder: Path, endpoint='', workers=8):
+    """Ensures LFS objects are present in the local store, fetching missing objects in
+    parallel.
+
+    Args:
+      pointers: A list of LfsPointer objects for the objects to fetch.
+      objects_folder: Path: A Path object for the local LFS object store.
+      endpoint:  (Default value = '') A local folder or LFS server URL to fetch objects
+        missing from the local store from.
+      workers:  (Default value = 8) The maximum number of objects to fetch at once.
+
+    Returns:
+      A tuple containing a dictionary mapping each LfsPointer object fetched to a Path
+      object for its object in the local store and a list of the LfsPointer objects
+      that could not be fetched.
+    """
+
+    return _resolve_objects(pointers, objects_folder, endpoint, workers)
+
+
+def is_pointer_size(size):
+    """Checks whether a file of a given size could be a Git LFS pointer file.
+
+    Args:
+      size: The file's size in bytes.
+
+    Returns:
+      True if the file is small enough to be a pointer.
+    """
+
+    return size <= _MAX_POINTER_SIZE
+
+
+def fetch_object(pointer: LfsPointer, objects_folder: Path, endpoint='', download_action=None):
+    """Ensures an LFS object is present in the local store, fetching it if needed.
+
+    Args:
+      pointer: LfsPointer: The pointer to the object.
+      objects_folder: Path: A Path object for the local LFS object store.
+      endpoint:  (Default value = '') A local folder or LFS server URL to fetch the
+        object from if it is not in the local store.
+      download_action:  (Default value = None) The batch API download action for the
+        object, if the endpoint is an LFS server.
+
+    Returns:
+      A Path object for the object in the local store.
+
+    Raises:
+      LfsObjectNotFoundError: The object is not in the local store or at the endpoint.
+      LfsIntegrityError: The fetched object did not match the pointer.
+    """
+
+    object_path = get_object_path(objects_folder, pointer.oid)
+    if object_path.exists():
+        return object_path
+
+    if is_url(endpoint):
+        if download_action is None:
+            raise LfsObjectNotFoundError(
+                f'Object {pointer.oid} is not available at \'{endpoint}\''
+            )
+
+        request = urllib.request.Request(
+            download_action['href'], headers=download_action.get('header', {})
+        )
+        with urllib.request.urlopen(request, timeout=_HTTP_TIMEOUT) as response:
+            _store_object(response, object_path, pointer)
+
+        return object_path
+
+    if endpoint:
+        endpoint_folder = Path(endpoint).expanduser()
+        candidates = (get_object_path(endpoint_folder, pointer.oid), endpoint_folder / pointer.oid)
+        for candidate in candidates:
+            if candidate.is_file():
+                with candidate.open('rb') as f:
+                    _store_object(f, object_path, pointer)
+
+                return object_path
+
+    raise LfsObjectNotFoundError(f'Object {pointer.oid} was not found')
+
+
+def is_url(endpoint):
+    """Checks whether an endpoint is an HTTP(S) URL rather than a local folder.
+
+    Args:
+      endpoint: The endpoint to check.
+
+    Returns:
+      True if the endpoint is an HTTP(S) URL.
+    """
+
+    return endpoint.startswith(('http://', 'https://'))
+
+
+def _resolve_objects(pointers, objects_folder, endpoint, workers, function=None):
+    """Fetches LFS objects with a bounded pool of worker threads.
+
+    Objects missing from the local store are requested from an LFS server's batch API
+    up front, in batches.
+
+    Args:
+      pointers: A list of LfsPointer objects for the objects to fetch.
+      objects_folder: Path: A Path object for the local LFS object store.
+      endpoint: A local folder or LFS server URL to fetch missing objects from.
+      workers: The maximum number of objects to fetch at once.
+      function:  (Default value = None) A callable taking an LfsPointer object and a
+        Path object for its object, run by the worker thread that fetched it.
+
+    Returns:
+      A tuple containing a dictionary mapping each LfsPointer object resolved to the
+      function's return value, or to its object's Path object if there is no function,
+      and a list of the LfsPointer objects that could not be resolved.
+    """
+
+    if not pointers:
+        return {}, []
+
+    lfs_log.info(f'Resolving {len(pointers)} LFS object(s)')
+
+    download_actions = {}
+    missing = [p for p in pointers if not get_object_path(objects_folder, p.oid).exists()]
+    if missing and is_url(endpoint):
+        download_actions = _request_download_actions(endpoint, missing)
+
+    resolved = {}
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(
+                _resolve_object,
+                pointer,
+                objects_folder,
+                endpoint,
+                download_actions.get(pointer.oid),
+                function,
+            ): pointer
+            for pointer in pointers
+        }
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                resolved[futures[future]] = future.result()
+            except (LfsError, OSError) as exception:
+                lfs_log.warning(f'Unable to resolve LFS object, {exception}')
+                failed.append(futures[future])
+
+    return resolved, failed
+
+
+def _resolve_object(pointer, objects_folder, endpoint, download_action, function):
+    """Fetches an LFS object and passes it to a function.
+
+    Returns:
+      The function's return value, or a Path object for the object if there is no
+      function.
+    """
+
+    object_path = fetch_object(pointer, objects_folder, endpoint, download_action)
+    if function is None:
+        return object_path
+
+    return function(pointer, object_path)
+
+
+def _write_object(pointers, callback, pointer, object_path):
+    """Writes an LFS object over the pointer files referencing it.
+
+    Returns:
+      A list of Path objects for the files replaced.
+    """
+
+    pointer_files = pointers[pointer]
+    for file in pointer_files:
+        mode = file.stat().st_mode & 0o777
+        commandutil.materialize_file(object_path, file, mode=mode)
+
+        if callback is not None:
+            callback(file)
+
+    return pointer_files
+
+
+def _store_object(stream, object_path: Path, pointer: LfsPointer):
+    """Streams an object into the local store, verifying its size and hash.
+
+    Args:
+      stream: A binary file-like object to read the object from.
+      object_path: Path: A Path object for the object's file in the local store.
+      pointer: LfsPointer: The pointer the object must match.
+
+    Raises:
+      LfsIntegrityError: The object did not match the pointer.
+    """
+
+    object_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Note: Threads and processes fetching the same object each write their own file.
+    fd, temporary_name = tempfile.mkstemp(
+        suffix='.tmp', prefix=f'{object_path.name}.', dir=object_path.parent
+    )
+    temporary_path = Path(temporary_name)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+
+        if size != pointer.size or digest.hexdigest() != pointer.oid:
+            raise LfsIntegrityError(f'Object {pointer.oid} does not match its pointer')
+
+        os.chmod(temporary_path, 0o644)
+        temporary_path.replace(object_path)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+
+
+def _request_download_actions(endpoint, pointers):
+    """Requests download actions for objects from an LFS server's batch API.
+
+    Args:
+      endpoint: The LFS server URL, such as 'https://example.com/repo.git/info/lfs'.
+      pointers: A list of LfsPointer objects to request.
+
+    Returns:
+      A dictionary mapping oids to download action dictionaries containing an 'href'
+      and optional 'header'. Objects the server can not provide are omitted.
+    """
+
+    actions = {}
+    url = endpoint.rstrip('/') + '/objects/batch'
+
+    for start in range(0, len(pointers), _BATCH_SIZE):
+        batch = pointers[start : start + _BATCH_SIZE]
+        body = {
+            'operation': 'download',
+            'transfers': ['basic'],
+            'objects': [{'oid': pointer.oid, 'size': pointer.size} for pointer in batch],
+        }
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(body).encode('utf-8'),
+            headers={'Accept': _LFS_MEDIA_TYPE, 'Content-Type': _LFS_MEDIA_TYPE},
+            method='POST',
+        )
+
+        try:
+            with urllib.request.urlopen(request, timeout=_HTTP_TIMEOUT) as response:
+                reply = json.load(response)
+        except (OSError, ValueError) as exception:
+            lfs_log.warning(f'Unable to request LFS objects from \'{url}\', {exception}')
+            continue
+
+        for lfs_object in reply.get('objects', []):
+            download = lfs_object.get('actions', {}).get('download')
+            if download is not None:
+                actions[lfs_object['oid']] = download
+
+    return actions
@@ -0,0 +1,461 @@
+"""Coordinates concurrent invocations working in the same local repository.
+
+Locks are files created exclusively in the repository's git folder (or in a shared
+cache's folder). Each records the process holding it, so a lock left behind by a
+process that died is detected and broken instead of blocking every later run.
+
+Files and folders in the working tree are protected with path claims rather than
+individual locks. A claim covers a set of paths and conflicts with any claim holding
+one of those paths, a parent folder of one or a file or folder inside one, so
+invocations writing to unrelated destinations proceed in parallel.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pathlib import Path
+
+
+# Folder (relative to the repository's git folder) containing locks
+_LOCK_FOLDER = Path('subtreeutil') / 'locks'
+
+# Seconds between attempts to acquire a lock or claim held by another invocation
+_LOCK_POLL_INTERVAL = 0.1
+
+# Seconds to wait for a lock or claim before giving up
+_LOCK_TIMEOUT = 600
+
+# Seconds after which a lock file without a readable owner is considered abandoned
+_UNREADABLE_LOCK_AGE = 10
+
+# Windows process access right and exit code used to check whether a process is alive
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+_STILL_ACTIVE = 259
+
+
+lock_log = logging.getLogger('subtreeutil.lock')
+
+
+class LockError(Exception):
+    """Base error for lock module exceptions."""
+
+
+class LockTimeoutError(LockError):
+    """Timed out while waiting for another invocation to release a lock or claim."""
+
+
+def get_lock_folder(git_folder: Path):
+    """Fetches the folder containing a repository's locks.
+
+    Args:
+      git_folder: Path: A Path object for the local repository's git folder.
+
+    Returns:
+      A Path object for the lock folder.
+    """
+
+    return git_folder / _LOCK_FOLDER
+
+
+def acquire_lock(lock_path: Path, description, timeout=_LOCK_TIMEOUT):
+    """Creates a lock file, waiting while another invocation holds it.
+
+    Locks held by processes on this host that are no longer running are broken.
+
+    Args:
+      lock_path: Path: A Path object for the lock file.
+      description: A description of what the lock guards, used for logging and
+        recorded in the lock file.
+      timeout:  (Default value = 600) Seconds to wait before giving up.
+
+    Returns:
+      True if another invocation held the lock while attempting to acquire it.
+
+    Raises:
+      LockTimeoutError: The lock was not released before the timeout elapsed.
+    """
+
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    contents = json.dumps(_get_owner(description))
+
+    waited = False
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            descriptor = os.open(str(lock_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            owner_contents = _read_lock(lock_path)
+            if _is_stale(lock_path, owner_contents):
+                _break_stale_lock(lock_path, owner_contents)
+                continue
+
+            if not waited:
+                lock_log.info(f'Waiting for {description}, {_describe_owner(owner_contents)}')
+                waited = True
+
+            if time.monotonic() > deadline:
+                lock_log.error(f'Timed out waiting for lock \'{lock_path}\'')
+                raise LockTimeoutError(f'Timed out waiting for lock \'{lock_path}\'')
+
+            time.sleep(_LOCK_POLL_INTERVAL)
+            continue
+
+        with os.fdopen(descriptor, 'w') as f:
+            f.write(contents)
+
+        return waited
+
+
+def release_lock(lock_path: Path):
+    """Deletes a lock file.
+
+    Args:
+      lock_path: Path: A Path object for the lock file.
+    """
+
+    try:
+        lock_path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def hold_lock(lock_path: Path, description, timeout=_LOCK_TIMEOUT):
+    """Holds a lock for the duration of a with statement.
+
+    Args:
+      lock_path: Path: A Path object for the lock file.
+      description: A description of what the lock guards.
+      timeout:  (Default value = 600) Seconds to wait before giving up.
+
+    Yields:
+      True if another invocation held the lock while attempting to acquire it.
+
+    Raises:
+      LockTimeoutError: The lock was not released before the timeout elapsed.
+    """
+
+    waited = acquire_lock(lock_path, description, timeout)
+    try:
+        yield waited
+    finally:
+        release_lock(lock_path)
+
+
+@contextlib.contextmanager
+def claim_paths(lock_folder: Path, paths, description, timeout=_LOCK_TIMEOUT):
+    """Claims files and folders for the duration of a with statement.
+
+    Claims are recorded in a registry in the lock folder. A claim waits while another
+    invocation's claim overlaps it, and claims of processes on this host that are no
+    longer running are discarded.
+
+    Args:
+      lock_folder: Path: A Path object for the repository's lock folder.
+      paths: A list of Path objects for the files and folders to claim.
+      description: A description of the claim, used for logging.
+      timeout:  (Default value = 600) Seconds to wait before giving up.
+
+    Raises:
+      LockTimeoutError: An overlapping claim was not released before the timeout
+        elapsed.
+    """
+
+    registry_lock = lock_folder / 'claims.lock'
+    registry_path = lock_folder / 'claims.json'
+
+    claim = _get_owner(description)
+    claim['token'] = uuid.uuid4().hex
+    claim['paths'] = sorted({_normalize_path(path) for path in paths})
+
+    waited = False
+    deadline = time.monotonic() + timeout
+
+    while True:
+        with hold_lock(registry_lock, 'path claims', timeout):
+            claims = _read_claims(registry_path)
+            active = [c for c in claims if not _is_dead(c)]
+
+            conflict = next((c for c in active if _overlaps(c['paths'], claim['paths'])), None)
+            if conflict is None:
+                _write_claims(registry_path, active + [claim])
+                break
+
+            if len(active) != len(claims):
+                _write_claims(registry_path, active)
+
+        if not waited:
+            lock_log.info(
+                f'Waiting for paths claimed by {conflict.get("description")}, '
+                f'{_describe_owner(json.dumps(conflict))}'
+            )
+            waited = True
+
+        if time.monotonic() > deadline:
+            lock_log.error(f'Timed out waiting to claim paths for {description}')
+            raise LockTimeoutError(f'Timed out waiting to claim paths for {description}')
+
+        time.sleep(_LOCK_POLL_INTERVAL)
+
+    try:
+        yield
+    finally:
+        with hold_lock(registry_lock, 'path claims', timeout):
+            claims = _read_claims(registry_path)
+            _write_claims(registry_path, [c for c in claims if c['token'] != claim['token']])
+
+
+def _get_owner(description):
+    """Creates a dictionary identifying the current process and thread.
+
+    Args:
+      description: A description of what is being locked or claimed.
+
+    Returns:
+      A dictionary describing the owner.
+    """
+
+    return {
+        'pid': os.getpid(),
+        'host': socket.gethostname(),
+        'thread': threading.get_ident(),
+        'time': time.time(),
+        'description': description,
+    }
+
+
+def _describe_owner(owner_contents):
+    """Describes the owner recorded in a lock file or claim for logging.
+
+    Args:
+      owner_contents: The owner's JSON string, or None if it could not be read.
+
+    Returns:
+      A string describing the owner.
+    """
+
+    try:
+        owner = json.loads(owner_contents)
+        return f'held by process {owner["pid"]} on {owner["host"]}'
+    except (TypeError, ValueError, KeyError):
+        return 'held by an unknown process'
+
+
+def _read_lock(lock_path: Path):
+    """Reads the owner recorded in a lock file.
+
+    Args:
+      lock_path: Path: A Path object for the lock file.
+
+    Returns:
+      The lock file's contents, or None if it could not be read.
+    """
+
+    try:
+        return lock_path.read_text()
+    except OSError:
+        return None
+
+
+def _is_stale(lock_path: Path, owner_contents):
+    """Checks whether a lock file was left behind by a process that is no longer
+    running.
+
+    Args:
+      lock_path: Path: A Path object for the lock file.
+      owner_contents: The lock file's contents, or None if it could not be read.
+
+    Returns:
+      True if the lock can be broken.
+    """
+
+    try:
+        owner = json.loads(owner_contents)
+    except (TypeError, ValueError):
+        owner = None
+
+    if isinstance(owner, dict):
+        return _is_dead(owner)
+
+    # Note: The owner may not have written its contents yet, so only give up on locks
+    # that stayed unreadable for a while. This also covers lock files from old versions.
+    try:
+        return time.time() - lock_path.stat().st_mtime > _UNREADABLE_LOCK_AGE
+    except FileNotFoundError:
+        return False
+
+
+def _is_dead(owner):
+    """Checks whether the owner of a lock or claim is a process on this host that is no
+    longer running.
+
+    Args:
+      owner: The owner dictionary.
+
+    Returns:
+      True if the owner is known to have exited.
+    """
+
+    if owner.get('host') != socket.gethostname():
+        return False
+
+    return not _is_process_alive(owner.get('pid', 0))
+
+
+def _is_process_alive(pid):
+    """Checks whether a process is running.
+
+    Args:
+      pid: The process id to check.
+
+    Returns:
+      True if the process is running or its state could not be determined.
+    """
+
+    if pid <= 0:
+        return False
+
+    if pid == os.getpid():
+        return True
+
+    if os.name == 'nt':
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+
+            return exit_code.value == _STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+def _break_stale_lock(lock_path: Path, owner_contents):
+    """Deletes a stale lock file.
+
+    Invocations breaking a lock take turns through a '<lock>.break' file created
+    exclusively next to it. While holding that file, the lock is read again and only
+    deleted if it still has the contents it had when found to be stale, so a lock
+    acquired by another invocation in the meantime is never moved or deleted.
+
+    Args:
+      lock_path: Path: A Path object for the lock file.
+      owner_contents: The contents the lock file had when it was found to be stale.
+    """
+
+    break_path = lock_path.with_name(f'{lock_path.name}.break')
+    try:
+        descriptor = os.open(str(break_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # Note: Another invocation is breaking the lock. One that died while doing so
+        # left its file behind, which is discarded so the lock can be broken later.
+        break_contents = _read_lock(break_path)
+        if _is_stale(break_path, break_contents):
+            release_lock(break_path)
+        return
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            f.write(json.dumps(_get_owner(f'breaking \'{lock_path.name}\'')))
+
+        current_contents = _read_lock(lock_path)
+        if current_contents == owner_contents and _is_stale(lock_path, current_contents):
+            lock_log.warning(
+                f'Breaking stale lock \'{lock_path}\', {_describe_owner(owner_contents)}'
+            )
+            release_lock(lock_path)
+    finally:
+        release_lock(break_path)
+
+
+def _read_claims(registry_path: Path):
+    """Reads the registry of path claims.
+
+    Args:
+      registry_path: Path: A Path object for the registry file.
+
+    Returns:
+      A list of claim dictionaries.
+    """
+
+    try:
+        with registry_path.open('r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _write_claims(registry_path: Path, claims):
+    """Writes the registry of path claims.
+
+    Args:
+      registry_path: Path: A Path object for the registry file.
+      claims: A list of claim dictionaries.
+    """
+
+    temporary_path = registry_path.with_suffix('.tmp')
+    with temporary_path.open('w') as f:
+        json.dump(claims, f, indent=4)
+
+    temporary_path.replace(registry_path)
+
+
+def _normalize_path(path):
+    """Normalizes a path for comparison with other claimed paths.
+
+    Args:
+      path: A Path object or string for the file or folder.
+
+    Returns:
+      An absolute, case normalized path string.
+    """
+
+    return os.path.normcase(os.path.abspath(str(path)))
+
+
+def _overlaps(paths, other_paths):
+    """Checks whether two lists of normalized paths contain the same path, or a path
+    inside a folder in the other list.
+
+    Args:
+      paths: A list of normalized path strings.
+      other_paths: A list of normalized path strings.
+
+    Returns:
+      True if the lists overlap.
+    """
+
+    for path in paths:
+        for other_path in other_paths:
+            if (
+                path == other_path
+                or path.startswith(other_path.rstrip(os.sep) + os.sep)
+                or other_path.startswith(path.rstrip(os.sep) + os.sep)
+            ):
+                return True
+
+    return False
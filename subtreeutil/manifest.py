@@ -0,0 +1,415 @@
+"""Records the files a sync wrote to its destinations so that drift can be detected.
+
+A manifest maps each destination file to its git blob id along with the size,
+modification time and inode it had when it was hashed. Verifying a destination only
+rehashes files whose stat data no longer matches the manifest, so checking an
+unchanged tree costs a directory walk rather than reading every file. Files modified
+within the same instant the manifest was written are always rehashed, as their stat
+data can not prove they are unchanged.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import time
+
+from pathlib import Path
+
+
+# Version of the manifest file format
+_MANIFEST_VERSION = 1
+
+# Folder (relative to the repository's git folder) containing manifests
+_MANIFEST_FOLDER = Path('subtreeutil') / 'manifests'
+
+# Number of bytes to hash at a time
+_CHUNK_SIZE = 1024 * 1024
+
+# Number of files each worker hashes per task, amortizing scheduling over small files
+_HASH_BATCH_SIZE = 64
+
+# Files modified less than this many nanoseconds before their manifest was written are
+# rehashed, covering file systems with coarse timestamps
+_RACY_WINDOW_NS = 2 * 1000 ** 3
+
+# Indexes into a manifest file entry
+_BLOB_ID = 0
+_SIZE = 1
+_MTIME = 2
+_INODE = 3
+
+
+manifest_log = logging.getLogger('subtreeutil.manifest')
+
+
+class ManifestError(Exception):
+    """Base error for manifest module exceptions."""
+
+
+class Drift:
+    """The differences between destination folders and their manifest.
+
+    Attributes:
+      modified: A sorted list of manifest keys for files whose contents changed.
+      missing: A sorted list of manifest keys for files that no longer exist.
+      extra: A sorted list of manifest keys for files that are not in the manifest.
+      refreshed: The number of files whose stat data changed but contents did not.
+    """
+
+    __slots__ = ('modified', 'missing', 'extra', 'refreshed')
+
+    def __init__(self, modified=None, missing=None, extra=None, refreshed=0):
+        self.modified = modified or []
+        self.missing = missing or []
+        self.extra = extra or []
+        self.refreshed = refreshed
+
+    def __repr__(self):
+        return (
+            f'Drift(modified={len(self.modified)}, missing={len(self.missing)}, '
+            f'extra={len(self.extra)})'
+        )
+
+    @property
+    def clean(self):
+        """True if the destinations match their manifest."""
+
+        return not (self.modified or self.missing or self.extra)
+
+
+def get_manifest_path(git_folder: Path, roots):
+    """Fetches the path of the manifest for a set of destination paths.
+
+    Args:
+      git_folder: Path: A Path object for the local repository's git folder.
+      roots: A list of manifest keys for the destination files and folders.
+
+    Returns:
+      A Path object for the manifest file.
+    """
+
+    return git_folder / _MANIFEST_FOLDER / f'{get_roots_key(roots)}.json'
+
+
+def get_roots_key(roots):
+    """Fetches a key identifying a set of destination paths.
+
+    Args:
+      roots: A list of manifest keys for the destination files and folders.
+
+    Returns:
+      A string containing a hash of the sorted keys.
+    """
+
+    return hashlib.sha1('\n'.join(sorted(roots)).encode('utf-8')).hexdigest()
+
+
+def get_key(repository_folder: Path, path: Path):
+    """Fetches the manifest key for a path.
+
+    Args:
+      repository_folder: Path: A Path object for the local repository's root folder.
+      path: Path: A Path object for the file or folder.
+
+    Returns:
+      The path relative to the repository folder, with forward slashes.
+    """
+
+    folder = str(repository_folder)
+    path = str(path)
+
+    if path.startswith(folder) and path[len(folder) : len(folder) + 1] == os.sep:
+        key = path[len(folder) + 1 :]
+    else:
+        key = os.path.relpath(path, folder)
+
+    return key.replace(os.sep, '/')
+
+
+def hash_file(path: Path):
+    """Computes the git blob id of a file, or of a symlink's target.
+
+    Args:
+      path: Path: A Path object for the file.
+
+    Returns:
+      A string containing the blob id.
+    """
+
+    if path.is_symlink():
+        target = os.fsencode(os.readlink(str(path)))
+        digest = hashlib.sha1(b'blob %d\0' % len(target))
+        digest.update(target)
+        return digest.hexdigest()
+
+    with path.open('rb') as f:
+        digest = hashlib.sha1(b'blob %d\0' % os.fstat(f.fileno()).st_size)
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def hash_files(paths, workers=None):
+    """Computes the git blob ids of files in parallel.
+
+    Args:
+      paths: A list of Path objects for the files to hash.
+      workers:  (Default value = None) The maximum number of files to hash at once.
+        Defaults to the number of processors.
+
+    Returns:
+      A dictionary mapping each Path object to its blob id, or to None if the file
+      could not be read.
+    """
+
+    def hash_batch(batch):
+        blob_ids = []
+        for path in batch:
+            try:
+                blob_ids.append(hash_file(path))
+            except OSError:
+                blob_ids.append(None)
+
+        return blob_ids
+
+    if len(paths) <= _HASH_BATCH_SIZE:
+        return dict(zip(paths, hash_batch(paths)))
+
+    batches = [paths[i : i + _HASH_BATCH_SIZE] for i in range(0, len(paths), _HASH_BATCH_SIZE)]
+
+    blob_ids = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for batch, batch_ids in zip(batches, executor.map(hash_batch, batches)):
+            blob_ids.update(zip(batch, batch_ids))
+
+    return blob_ids
+
+
+def build_manifest(repository_folder: Path, roots, files, commit_hash='', previous=None):
+    """Builds a manifest for files written to destinations.
+
+    Files whose stat data matches their entry in a previous manifest keep that entry
+    instead of being rehashed.
+
+    Args:
+      repository_folder: Path: A Path object for the local repository's root folder.
+      roots: A list of Path objects for the destination files and folders.
+      files: A list of Path objects for the files written to the destinations.
+      commit_hash:  (Default value = '') The commit hash the files were written from.
+      previous:  (Default value = None) A previously written manifest dictionary.
+
+    Returns:
+      A manifest dictionary.
+    """
+
+    previous_files = previous['files'] if previous else {}
+    previous_time = previous['time_ns'] if previous else 0
+
+    entries = {}
+    stale = []
+    for path in files:
+        key = get_key(repository_folder, path)
+        try:
+            stat = path.lstat()
+        except OSError:
+            continue
+
+        entry = previous_files.get(key)
+        if entry is not None and _is_unchanged(entry, stat, previous_time):
+            entries[key] = entry
+        else:
+            stale.append((key, path, stat))
+
+    blob_ids = hash_files([path for key, path, stat in stale])
+    for key, path, stat in stale:
+        if blob_ids[path] is not None:
+            entries[key] = _create_entry(blob_ids[path], stat)
+
+    return {
+        'version': _MANIFEST_VERSION,
+        'commit': commit_hash,
+        'time_ns': time.time_ns(),
+        'roots': sorted(get_key(repository_folder, root) for root in roots),
+        'files': dict(sorted(entries.items())),
+    }
+
+
+def read_manifest(manifest_path: Path):
+    """Reads a manifest file.
+
+    Args:
+      manifest_path: Path: A Path object for the manifest file.
+
+    Returns:
+      A manifest dictionary, or None if the manifest does not exist.
+
+    Raises:
+      ManifestError: The manifest could not be read.
+    """
+
+    try:
+        with manifest_path.open('r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exception:
+        manifest_log.error(f'Unable to read manifest \'{manifest_path}\', {exception}')
+        raise ManifestError(f'Unable to read manifest \'{manifest_path}\'') from exception
+
+    if manifest.get('version') != _MANIFEST_VERSION:
+        manifest_log.warning(f'Ignoring manifest \'{manifest_path}\' with an unknown version')
+        return None
+
+    return manifest
+
+
+def write_manifest(manifest_path: Path, manifest):
+    """Writes a manifest file, replacing any previous one in a single step.
+
+    Args:
+      manifest_path: Path: A Path object for the manifest file.
+      manifest: The manifest dictionary to write.
+    """
+
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+
+    temporary_path = manifest_path.with_name(f'{manifest_path.name}.{os.getpid()}.tmp')
+    with temporary_path.open('w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+
+    temporary_path.replace(manifest_path)
+
+
+def verify_manifest(repository_folder: Path, manifest, workers=None):
+    """Compares destinations with their manifest.
+
+    Files whose stat data matches the manifest are assumed unchanged. Other files are
+    rehashed in parallel. Entries of files whose contents still match are refreshed
+    with their new stat data, so the manifest should be written again when
+    Drift.refreshed is not zero.
+
+    Args:
+      repository_folder: Path: A Path object for the local repository's root folder.
+      manifest: The manifest dictionary to verify. Refreshed entries are updated in
+        place.
+      workers:  (Default value = None) The maximum number of files to hash at once.
+        Defaults to the number of processors.
+
+    Returns:
+      A Drift object.
+    """
+
+    files = manifest['files']
+    manifest_time = manifest['time_ns']
+    scan_time = time.time_ns()
+
+    drift = Drift()
+    seen = set()
+    stale = []
+
+    for root in manifest['roots']:
+        for key, path, stat in _scan(repository_folder, root):
+            entry = files.get(key)
+            if entry is None:
+                drift.extra.append(key)
+                continue
+
+            seen.add(key)
+            if not _is_unchanged(entry, stat, manifest_time):
+                stale.append((key, Path(path), stat))
+
+    if len(seen) != len(files):
+        drift.missing.extend(key for key in files if key not in seen)
+
+    if stale:
+        manifest_log.info(f'Rehashing {len(stale)} file(s) with changed stat data')
+
+    blob_ids = hash_files([path for key, path, stat in stale], workers)
+    for key, path, stat in stale:
+        blob_id = blob_ids[path]
+        if blob_id is None:
+            drift.missing.append(key)
+        elif blob_id != files[key][_BLOB_ID]:
+            drift.modified.append(key)
+        else:
+            files[key] = _create_entry(blob_id, stat)
+            drift.refreshed += 1
+
+    if drift.refreshed:
+        manifest['time_ns'] = scan_time
+
+    drift.modified.sort()
+    drift.missing.sort()
+    drift.extra.sort()
+    return drift
+
+
+def _scan(repository_folder: Path, root):
+    """Lists the files under a destination file or folder.
+
+    Args:
+      repository_folder: Path: A Path object for the local repository's root folder.
+      root: The manifest key of the destination file or folder.
+
+    Returns:
+      A generator of tuples containing each file's manifest key, path string and
+      os.stat_result object.
+    """
+
+    root_path = os.path.join(str(repository_folder), root)
+    try:
+        stat = os.lstat(root_path)
+    except FileNotFoundError:
+        return
+
+    if not os.path.isdir(root_path) or os.path.islink(root_path):
+        yield root, root_path, stat
+        return
+
+    folders = [(root_path, root)]
+    while folders:
+        folder, prefix = folders.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                key = f'{prefix}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append((entry.path, key))
+                else:
+                    yield key, entry.path, entry.stat(follow_symlinks=False)
+
+
+def _is_unchanged(entry, stat, manifest_time):
+    """Checks whether a file's stat data proves it matches its manifest entry.
+
+    Args:
+      entry: The file's manifest entry.
+      stat: The file's os.stat_result object.
+      manifest_time: The time the manifest was written in nanoseconds.
+
+    Returns:
+      True if the file can be assumed unchanged.
+    """
+
+    return (
+        entry[_SIZE] == stat.st_size
+        and entry[_MTIME] == stat.st_mtime_ns
+        and entry[_INODE] == stat.st_ino
+        and stat.st_mtime_ns < manifest_time - _RACY_WINDOW_NS
+    )
+
+
+def _create_entry(blob_id, stat):
+    """Creates a manifest entry for a file.
+
+    Args:
+      blob_id: The file's blob id.
+      stat: The file's os.stat_result object.
+
+    Returns:
+      A list containing the blob id, size, modification time and inode.
+    """
+
+    return [blob_id, stat.st_size, stat.st_mtime_ns, stat.st_ino]
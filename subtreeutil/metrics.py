@@ -0,0 +1,620 @@
+"""Records the performance of checkout runs in a local history.
+
+Each run's duration, phase durations, file counts, bytes fetched, subprocess count and
+peak memory use are stored in a SQLite database in the repository's git folder, keyed
+by the configuration files and remote URLs it synced. Histograms of durations and
+fetched bytes are accumulated as runs are recorded, so they can be exported in the
+Prometheus textfile collector format without scanning the history. Recent runs are
+compared with a rolling baseline of earlier ones to find regressions.
+"""
+
+import contextlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Note: resource is not available on Windows.
+    resource = None
+
+
+# Database file (relative to the repository's git folder) holding the history
+_DATABASE_PATH = Path('subtreeutil') / 'metrics.sqlite'
+
+# Version of the database schema
+_SCHEMA_VERSION = 1
+
+# Seconds to wait for another invocation to finish writing to the database
+_DATABASE_TIMEOUT = 30
+
+# Days of individual runs to keep. Histograms keep accumulating beyond it.
+_HISTORY_DAYS = 90
+
+# Upper bounds of the buckets of each histogram, and their descriptions
+_HISTOGRAM_BUCKETS = {
+    'run_duration_seconds': (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+    'phase_duration_seconds': (0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+    'fetched_bytes': tuple(1024 ** 2 * 4 ** exponent for exponent in range(-3, 8)),
+}
+_HISTOGRAM_HELP = {
+    'run_duration_seconds': 'Duration of checkout runs.',
+    'phase_duration_seconds': 'Duration of checkout run phases.',
+    'fetched_bytes': 'Growth of the local object database during checkout runs.',
+}
+
+# Prefix of exported metric names
+_METRIC_PREFIX = 'subtreeutil_'
+
+# Default factor over the baseline's median at which a value is considered a regression
+_REGRESSION_THRESHOLD = 1.5
+
+# Minimum number of baseline runs required to look for regressions
+_MINIMUM_BASELINE_RUNS = 5
+
+# Smallest increase in seconds reported as a duration regression, ignoring noise in
+# short phases
+_MINIMUM_REGRESSION_SECONDS = 0.5
+
+# Units of ru_maxrss, which is reported in bytes on macOS and in kilobytes elsewhere
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# Columns of the runs table holding RunMetrics attributes
+_RUN_COLUMNS = (
+    'time',
+    'config',
+    'remote',
+    'seconds',
+    'success',
+    'files_written',
+    'files_skipped',
+    'files_deleted',
+    'bytes_fetched',
+    'subprocesses',
+    'peak_rss_bytes',
+    'child_peak_rss_bytes',
+)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    config TEXT NOT NULL,
+    remote TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    success INTEGER NOT NULL,
+    files_written INTEGER NOT NULL,
+    files_skipped INTEGER NOT NULL,
+    files_deleted INTEGER NOT NULL,
+    bytes_fetched INTEGER,
+    subprocesses INTEGER NOT NULL,
+    peak_rss_bytes INTEGER,
+    child_peak_rss_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_by_key ON runs (config, remote, id);
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs (time);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run_id, phase)
+);
+CREATE TABLE IF NOT EXISTS histograms (
+    name TEXT NOT NULL,
+    config TEXT NOT NULL,
+    remote TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    buckets TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    PRIMARY KEY (name, config, remote, phase)
+);
+'''
+
+
+metrics_log = logging.getLogger('subtreeutil.metrics')
+
+
+class MetricsError(Exception):
+    """Base error for metrics module exceptions."""
+
+
+class RunMetrics:
+    """The measurements of one checkout run.
+
+    Attributes:
+      time: The time the run started as a Unix timestamp.
+      config: The paths of the run's configuration files, from get_config_key().
+      remote: The remote URLs the run synced, separated by commas.
+      seconds: The run's duration in seconds.
+      success: True if the run completed without errors.
+      files_written: The number of destination files written.
+      files_skipped: The number of destination files that already matched.
+      files_deleted: The number of cleanup paths deleted.
+      bytes_fetched: The growth of the local object database in bytes, or None if it
+        could not be measured.
+      subprocesses: The number of subprocesses started.
+      peak_rss_bytes: The peak resident memory of the process in bytes, or None if it
+        could not be measured.
+      child_peak_rss_bytes: The largest peak resident memory of a subprocess in bytes,
+        or None if it could not be measured.
+      phases: A dictionary mapping phase names to the seconds spent in them.
+    """
+
+    __slots__ = _RUN_COLUMNS + ('phases',)
+
+    def __init__(self, config, remote, **values):
+        for key in self.__slots__:
+            setattr(self, key, values.get(key, 0))
+
+        self.config = config
+        self.remote = remote
+        self.success = bool(self.success)
+        self.phases = dict(values.get('phases') or {})
+
+    def __repr__(self):
+        return (
+            f'RunMetrics(config={self.config!r}, remote={self.remote!r}, '
+            f'seconds={self.seconds:.2f}, success={self.success})'
+        )
+
+    def get_values(self):
+        """Fetches the measurements compared against a baseline.
+
+        Returns:
+          A dictionary mapping measurement names, such as 'duration' or 'phase fetch',
+          to their values. Measurements that could not be taken are left out.
+        """
+
+        values = {'duration': self.seconds, 'subprocesses': self.subprocesses}
+        values.update((f'phase {phase}', seconds) for phase, seconds in self.phases.items())
+
+        if self.peak_rss_bytes is not None:
+            values['peak_rss_bytes'] = self.peak_rss_bytes
+
+        return values
+
+
+class Regression:
+    """A measurement of the latest run that is worse than its baseline.
+
+    Attributes:
+      name: The measurement's name, such as 'duration' or 'phase fetch'.
+      value: The latest run's value.
+      baseline: The median value of the baseline runs.
+    """
+
+    __slots__ = ('name', 'value', 'baseline')
+
+    def __init__(self, name, value, baseline):
+        self.name = name
+        self.value = value
+        self.baseline = baseline
+
+    def __repr__(self):
+        return f'Regression(name={self.name!r}, value={self.value}, baseline={self.baseline})'
+
+    @property
+    def ratio(self):
+        """The latest value as a multiple of the baseline."""
+
+        return self.value / self.baseline if self.baseline else math.inf
+
+
+def get_database_path(git_folder: Path):
+    """Fetches the path of a repository's metrics database.
+
+    Args:
+      git_folder: Path: A Path object for the local repository's git folder.
+
+    Returns:
+      A Path object for the database file.
+    """
+
+    return git_folder / _DATABASE_PATH
+
+
+def get_config_key(config_paths):
+    """Fetches the key identifying a set of configuration files in the history.
+
+    Args:
+      config_paths: A list of Path objects for the configuration files.
+
+    Returns:
+      The files' absolute paths with forward slashes, sorted and separated by commas.
+    """
+
+    return ','.join(sorted(Path(path).resolve().as_posix() for path in config_paths))
+
+
+def get_peak_rss():
+    """Measures the peak resident memory of the process and of its subprocesses.
+
+    Both are peaks over the lifetime of the process, so they cover a single run when
+    invoked from the command line. A subprocess's peak includes the memory it shares
+    with this process after being forked.
+
+    Returns:
+      A tuple containing the process's peak in bytes and the largest peak of any
+      subprocess that has exited in bytes. Both are None where they can not be
+      measured.
+    """
+
+    if resource is None:
+        return None, None
+
+    own_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own_usage.ru_maxrss * _RSS_UNIT, child_usage.ru_maxrss * _RSS_UNIT
+
+
+def record_run(database_path: Path, run: RunMetrics):
+    """Adds a run to the history and to its histograms.
+
+    Runs older than the history's retention are deleted.
+
+    Args:
+      database_path: Path: A Path object for the metrics database.
+      run: RunMetrics: The run to record.
+
+    Raises:
+      MetricsError: The database could not be written.
+    """
+
+    with _connect(database_path) as connection:
+        columns = ', '.join(_RUN_COLUMNS)
+        placeholders = ', '.join('?' for _ in _RUN_COLUMNS)
+        cursor = connection.execute(
+            f'INSERT INTO runs ({columns}) VALUES ({placeholders})',
+            [getattr(run, column) for column in _RUN_COLUMNS],
+        )
+        connection.executemany(
+            'INSERT INTO phases (run_id, phase, seconds) VALUES (?, ?, ?)',
+            [(cursor.lastrowid, phase, seconds) for phase, seconds in run.phases.items()],
+        )
+
+        _observe(connection, 'run_duration_seconds', run, '', run.seconds)
+        for phase, seconds in run.phases.items():
+            _observe(connection, 'phase_duration_seconds', run, phase, seconds)
+        if run.bytes_fetched is not None:
+            _observe(connection, 'fetched_bytes', run, '', run.bytes_fetched)
+
+        cutoff = time.time() - _HISTORY_DAYS * 24 * 60 * 60
+        connection.execute('DELETE FROM runs WHERE time < ?', (cutoff,))
+
+
+def list_keys(database_path: Path):
+    """Lists the configuration and remote keys that have recorded runs.
+
+    Args:
+      database_path: Path: A Path object for the metrics database.
+
+    Returns:
+      A sorted list of tuples containing a configuration key and a remote key.
+
+    Raises:
+      MetricsError: The database could not be read.
+    """
+
+    if not database_path.exists():
+        return []
+
+    with _connect(database_path) as connection:
+        rows = connection.execute(
+            'SELECT DISTINCT config, remote FROM runs ORDER BY config, remote'
+        )
+        return [tuple(row) for row in rows]
+
+
+def read_runs(database_path: Path, config, remote, limit=None):
+    """Reads the most recent runs of a configuration and remote key.
+
+    Args:
+      database_path: Path: A Path object for the metrics database.
+      config: The configuration key of the runs.
+      remote: The remote key of the runs.
+      limit:  (Default value = None) The maximum number of runs to read. All runs are
+        read if None.
+
+    Returns:
+      A list of RunMetrics objects, newest first.
+
+    Raises:
+      MetricsError: The database could not be read.
+    """
+
+    if not database_path.exists():
+        return []
+
+    with _connect(database_path) as connection:
+        rows = connection.execute(
+            f'SELECT id, {", ".join(_RUN_COLUMNS)} FROM runs WHERE config = ? AND remote = ? '
+            f'ORDER BY id DESC LIMIT ?',
+            (config, remote, -1 if limit is None else limit),
+        ).fetchall()
+
+        runs = []
+        for run_id, *values in rows:
+            phases = connection.execute(
+                'SELECT phase, seconds FROM phases WHERE run_id = ?', (run_id,)
+            )
+            values = dict(zip(_RUN_COLUMNS, values))
+            values.pop('config')
+            values.pop('remote')
+            runs.append(RunMetrics(config, remote, phases=dict(phases), **values))
+
+    return runs
+
+
+def find_regressions(
+    runs, threshold=_REGRESSION_THRESHOLD, minimum_seconds=_MINIMUM_REGRESSION_SECONDS
+):
+    """Compares the latest run with the median of earlier successful runs.
+
+    Args:
+      runs: A list of RunMetrics objects, newest first. The first is compared with the
+        rest.
+      threshold:  (Default value = 1.5) The multiple of the baseline's median a value
+        must exceed to be a regression.
+      minimum_seconds:  (Default value = 0.5) The smallest increase in seconds reported
+        for durations.
+
+    Returns:
+      A list of Regression objects, or an empty list if there are too few earlier runs
+      to form a baseline.
+    """
+
+    latest = runs[0] if runs else None
+    baseline_runs = [run for run in runs[1:] if run.success]
+    if latest is None or len(baseline_runs) < _MINIMUM_BASELINE_RUNS:
+        return []
+
+    baseline_values = [run.get_values() for run in baseline_runs]
+
+    regressions = []
+    for name, value in latest.get_values().items():
+        values = [values[name] for values in baseline_values if name in values]
+        if len(values) < _MINIMUM_BASELINE_RUNS:
+            continue
+
+        baseline = statistics.median(values)
+        if value <= baseline * threshold:
+            continue
+
+        is_duration = name == 'duration' or name.startswith('phase ')
+        if is_duration and value - baseline < minimum_seconds:
+            continue
+
+        regressions.append(Regression(name, value, baseline))
+
+    return regressions
+
+
+def format_textfile(database_path: Path):
+    """Formats the histograms and each key's latest run in the Prometheus text
+    exposition format.
+
+    Args:
+      database_path: Path: A Path object for the metrics database.
+
+    Returns:
+      A string containing the metrics.
+
+    Raises:
+      MetricsError: The database could not be read.
+    """
+
+    if not database_path.exists():
+        return ''
+
+    lines = []
+    with _connect(database_path) as connection:
+        for name, bounds in _HISTOGRAM_BUCKETS.items():
+            metric = f'{_METRIC_PREFIX}{name}'
+            rows = connection.execute(
+                'SELECT config, remote, phase, buckets, count, sum FROM histograms '
+                'WHERE name = ? ORDER BY config, remote, phase',
+                (name,),
+            ).fetchall()
+            if not rows:
+                continue
+
+            lines.append(f'# HELP {metric} {_HISTOGRAM_HELP[name]}')
+            lines.append(f'# TYPE {metric} histogram')
+
+            for config, remote, phase, buckets, count, total in rows:
+                labels = {'config': config, 'remote': remote}
+                if phase:
+                    labels['phase'] = phase
+
+                cumulative = 0
+                for bound, bucket_count in zip(bounds, json.loads(buckets)):
+                    cumulative += bucket_count
+                    bucket_labels = _format_labels(dict(labels, le=_format_value(bound)))
+                    lines.append(f'{metric}_bucket{bucket_labels} {cumulative}')
+
+                lines.append(f'{metric}_bucket{_format_labels(dict(labels, le="+Inf"))} {count}')
+                lines.append(f'{metric}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{metric}_count{_format_labels(labels)} {count}')
+
+        latest_rows = connection.execute(
+            f'SELECT {", ".join(_RUN_COLUMNS)} FROM runs WHERE id IN '
+            f'(SELECT MAX(id) FROM runs GROUP BY config, remote) ORDER BY config, remote'
+        ).fetchall()
+
+    gauges = {
+        'last_run_timestamp_seconds': ('Start time of the latest run.', 'time'),
+        'last_run_success': ('Whether the latest run completed without errors.', 'success'),
+        'last_run_files_written': ('Files written by the latest run.', 'files_written'),
+        'last_run_files_skipped': ('Files skipped by the latest run.', 'files_skipped'),
+        'last_run_files_deleted': ('Cleanup paths deleted by the latest run.', 'files_deleted'),
+        'last_run_subprocesses': ('Subprocesses started by the latest run.', 'subprocesses'),
+        'last_run_peak_rss_bytes': ('Peak resident memory of the latest run.', 'peak_rss_bytes'),
+        'last_run_child_peak_rss_bytes': (
+            'Largest peak resident memory of a subprocess of the latest run.',
+            'child_peak_rss_bytes',
+        ),
+    }
+    for name, (description, column) in gauges.items():
+        metric = f'{_METRIC_PREFIX}{name}'
+        samples = []
+        for row in latest_rows:
+            values = dict(zip(_RUN_COLUMNS, row))
+            if values[column] is not None:
+                labels = _format_labels({'config': values['config'], 'remote': values['remote']})
+                samples.append(f'{metric}{labels} {_format_value(values[column])}')
+
+        if samples:
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} gauge')
+            lines.extend(samples)
+
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def write_textfile(textfile_path: Path, database_path: Path):
+    """Writes the metrics to a file for the Prometheus node exporter's textfile
+    collector.
+
+    The file is written beside its destination and renamed into place, so the
+    collector never reads a partially written file.
+
+    Args:
+      textfile_path: Path: A Path object for the file to write. Its name should end in
+        '.prom'.
+      database_path: Path: A Path object for the metrics database.
+
+    Raises:
+      MetricsError: The database could not be read or the file could not be written.
+    """
+
+    contents = format_textfile(database_path)
+
+    temporary_path = textfile_path.with_name(f'.{textfile_path.name}.{os.getpid()}.tmp')
+    try:
+        textfile_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path.write_text(contents, encoding='utf-8')
+        temporary_path.replace(textfile_path)
+    except OSError as exception:
+        metrics_log.warning(f'Unable to write metrics to \'{textfile_path}\', {exception}')
+        raise MetricsError(f'Unable to write metrics to \'{textfile_path}\'') from exception
+
+
+@contextlib.contextmanager
+def _connect(database_path: Path):
+    """Opens the metrics database for the duration of a with statement, creating it if
+    it does not exist, and commits the changes made.
+
+    Args:
+      database_path: Path: A Path object for the metrics database.
+
+    Yields:
+      A sqlite3.Connection object.
+
+    Raises:
+      MetricsError: The database could not be opened, read or written.
+    """
+
+    try:
+        database_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(database_path), timeout=_DATABASE_TIMEOUT)
+    except (OSError, sqlite3.Error) as exception:
+        metrics_log.warning(f'Unable to open metrics database \'{database_path}\', {exception}')
+        raise MetricsError(f'Unable to open metrics database \'{database_path}\'') from exception
+
+    try:
+        with connection:
+            connection.execute('PRAGMA foreign_keys = ON')
+            if connection.execute('PRAGMA user_version').fetchone()[0] != _SCHEMA_VERSION:
+                connection.execute('PRAGMA journal_mode = WAL')
+                connection.executescript(_SCHEMA)
+                connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+
+            yield connection
+    except sqlite3.Error as exception:
+        metrics_log.warning(f'Unable to use metrics database \'{database_path}\', {exception}')
+        raise MetricsError(f'Unable to use metrics database \'{database_path}\'') from exception
+    finally:
+        connection.close()
+
+
+def _observe(connection, name, run: RunMetrics, phase, value):
+    """Adds a value to one of a run key's histograms.
+
+    Args:
+      connection: The sqlite3.Connection object to update the histogram with.
+      name: The histogram's name.
+      run: RunMetrics: The run the value belongs to.
+      phase: The phase the value belongs to, or an empty string.
+      value: The value to add.
+    """
+
+    bounds = _HISTOGRAM_BUCKETS[name]
+    key = (name, run.config, run.remote, phase)
+
+    row = connection.execute(
+        'SELECT buckets, count, sum FROM histograms '
+        'WHERE name = ? AND config = ? AND remote = ? AND phase = ?',
+        key,
+    ).fetchone()
+    if row is None:
+        buckets, count, total = [0] * len(bounds), 0, 0
+    else:
+        buckets, count, total = json.loads(row[0]), row[1], row[2]
+
+    # Note: Buckets hold the values between their bound and the previous one, and are
+    # made cumulative when exported. Values above the last bound are only counted.
+    index = next((i for i, bound in enumerate(bounds) if value <= bound), None)
+    if index is not None:
+        buckets[index] += 1
+
+    connection.execute(
+        'INSERT OR REPLACE INTO histograms (name, config, remote, phase, buckets, count, sum) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        key + (json.dumps(buckets), count + 1, total + value),
+    )
+
+
+def _format_labels(labels):
+    """Formats a metric's labels in the Prometheus text exposition format.
+
+    Args:
+      labels: A dictionary mapping label names to values.
+
+    Returns:
+      A string containing the labels in braces.
+    """
+
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    """Formats a sample value in the Prometheus text exposition format.
+
+    Args:
+      value: The number to format.
+
+    Returns:
+      A string containing the value.
+    """
+
+    if isinstance(value, bool):
+        return '1' if value else '0'
+
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+
+    return str(int(value))
@@ -0,0 +1,272 @@
+"""Publishes progress events for long running fetch, checkout and move operations.
+
+Progress is published to a callback: any callable accepting a ProgressEvent. Events
+describe git transfer progress parsed from 'git fetch --progress', the number of files
+and bytes written or deleted, and the start and end of each checkout phase.
+JsonLinesWriter is a callback writing events as JSON lines for other processes.
+"""
+
+import json
+import re
+import threading
+import time
+
+from pathlib import Path
+
+
+# Minimum seconds between file progress events for a phase
+_FILE_EVENT_INTERVAL = 0.1
+
+# Byte multipliers for the units git uses in transfer progress
+_UNITS = {
+    'bytes': 1,
+    'KiB': 1024,
+    'MiB': 1024 ** 2,
+    'GiB': 1024 ** 3,
+}
+
+# Matches git progress lines such as:
+#   Receiving objects:  45% (450/1000), 1.20 MiB | 2.40 MiB/s
+#   remote: Enumerating objects: 5, done.
+_GIT_PROGRESS_PATTERN = re.compile(
+    r'^(?:remote: )?(?P<stage>[A-Za-z][A-Za-z ]*?):\s+'
+    r'(?:(?P<percent>\d+)% \((?P<current>\d+)/(?P<total>\d+)\)|(?P<count>\d+))'
+    r'(?:, (?P<size>[\d.]+) (?P<size_unit>bytes|[KMG]iB))?'
+    r'(?: \| (?P<rate>[\d.]+) (?P<rate_unit>bytes|[KMG]iB)/s)?'
+    r'(?P<done>, done\.?)?'
+)
+
+
+class ProgressEvent:
+    """Base progress event.
+
+    Attributes:
+      phase: The name of the phase the event belongs to, such as 'fetch' or 'move'.
+      time: The event's creation time as a Unix timestamp.
+    """
+
+    __slots__ = ('phase', 'time')
+
+    kind = 'progress'
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.time = time.time()
+
+    def __repr__(self):
+        values = ', '.join(f'{key}={value!r}' for key, value in self.to_dict().items())
+        return f'{type(self).__name__}({values})'
+
+    def to_dict(self):
+        """Creates a dictionary describing the event.
+
+        Returns:
+          A dictionary containing the event's kind and attributes.
+        """
+
+        values = {'event': self.kind}
+        for cls in reversed(type(self).__mro__):
+            for key in getattr(cls, '__slots__', ()):
+                values[key] = getattr(self, key)
+
+        return values
+
+
+class PhaseProgress(ProgressEvent):
+    """A phase started or finished.
+
+    Attributes:
+      state: 'started' or 'finished'.
+      seconds: The seconds spent in the phase, or None when it started.
+    """
+
+    __slots__ = ('state', 'seconds')
+
+    kind = 'phase'
+
+    def __init__(self, phase, state, seconds=None):
+        super().__init__(phase)
+        self.state = state
+        self.seconds = seconds
+
+
+class TransferProgress(ProgressEvent):
+    """Git reported progress transferring objects.
+
+    Attributes:
+      stage: The git progress stage, such as 'Receiving objects'.
+      percent: The stage's completion percentage, or None if git did not report one.
+      current: The number of objects processed.
+      total: The total number of objects, or None if git did not report one.
+      bytes: The number of bytes received, or None if git did not report it.
+      rate: The transfer rate in bytes per second, or None if git did not report it.
+      done: True if the stage is complete.
+    """
+
+    __slots__ = ('stage', 'percent', 'current', 'total', 'bytes', 'rate', 'done')
+
+    kind = 'transfer'
+
+    def __init__(self, phase, stage, percent, current, total, bytes, rate, done):
+        super().__init__(phase)
+        self.stage = stage
+        self.percent = percent
+        self.current = current
+        self.total = total
+        self.bytes = bytes
+        self.rate = rate
+        self.done = done
+
+
+class FileProgress(ProgressEvent):
+    """Files were written or deleted.
+
+    Attributes:
+      files: The number of files processed so far in the phase.
+      bytes: The number of bytes processed so far in the phase.
+      done: True if the phase has finished processing files.
+    """
+
+    __slots__ = ('files', 'bytes', 'done')
+
+    kind = 'files'
+
+    def __init__(self, phase, files, bytes, done=False):
+        super().__init__(phase)
+        self.files = files
+        self.bytes = bytes
+        self.done = done
+
+
+class FileCounter:
+    """Counts files and bytes processed in a phase and publishes throttled FileProgress
+    events."""
+
+    def __init__(self, callback, phase):
+        """Creates a file counter.
+
+        Args:
+          callback: The progress callback to publish events to.
+          phase: The name of the phase files are counted for.
+        """
+
+        self.callback = callback
+        self.phase = phase
+        self.files = 0
+        self.bytes = 0
+        self._last_event = 0.0
+
+    def add(self, path: Path, size=None):
+        """Counts a processed file.
+
+        Args:
+          path: Path: A Path object for the file.
+          size:  (Default value = None) The file's size in bytes. Read from the file if
+            None.
+        """
+
+        if size is None:
+            try:
+                size = path.lstat().st_size
+            except OSError:
+                size = 0
+
+        self.files += 1
+        self.bytes += size
+
+        now = time.monotonic()
+        if now - self._last_event >= _FILE_EVENT_INTERVAL:
+            self._last_event = now
+            self.callback(FileProgress(self.phase, self.files, self.bytes))
+
+    def finish(self):
+        """Publishes the phase's final file counts."""
+
+        self.callback(FileProgress(self.phase, self.files, self.bytes, done=True))
+
+
+class JsonLinesWriter:
+    """A progress callback writing each event to a stream as a line of JSON."""
+
+    def __init__(self, stream):
+        """Creates a JSON lines writer.
+
+        Args:
+          stream: A text stream to write events to, such as sys.stdout.
+        """
+
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, event: ProgressEvent):
+        line = json.dumps(event.to_dict())
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def parse_git_progress(line, phase='fetch'):
+    """Parses a line of git progress output.
+
+    Args:
+      line: A line of git's standard error output.
+      phase:  (Default value = 'fetch') The phase to attribute the event to.
+
+    Returns:
+      A TransferProgress event, or None if the line is not a progress line.
+    """
+
+    match = _GIT_PROGRESS_PATTERN.match(line.strip())
+    if match is None:
+        return None
+
+    percent = match.group('percent')
+    current = match.group('current') or match.group('count')
+    total = match.group('total')
+
+    return TransferProgress(
+        phase,
+        match.group('stage'),
+        int(percent) if percent is not None else None,
+        int(current),
+        int(total) if total is not None else None,
+        _to_bytes(match.group('size'), match.group('size_unit')),
+        _to_bytes(match.group('rate'), match.group('rate_unit')),
+        match.group('done') is not None,
+    )
+
+
+def publish_git_progress(callback, phase='fetch'):
+    """Creates a line callback publishing parsed git progress lines.
+
+    Args:
+      callback: The progress callback to publish events to.
+      phase:  (Default value = 'fetch') The phase to attribute events to.
+
+    Returns:
+      A callable accepting lines of git's standard error output.
+    """
+
+    def publish(line):
+        event = parse_git_progress(line, phase)
+        if event is not None:
+            callback(event)
+
+    return publish
+
+
+def _to_bytes(value, unit):
+    """Converts a size reported by git to bytes.
+
+    Args:
+      value: The size's numeric string, or None.
+      unit: The size's unit.
+
+    Returns:
+      The size in bytes, or None if value is None.
+    """
+
+    if value is None:
+        return None
+
+    return int(float(value) * _UNITS[unit])
@@ -0,0 +1,398 @@
+"""Keeps snapshots of destinations so that a checkout can be rolled back.
+
+A snapshot is a copy of a configuration's destination files and folders taken just
+before a checkout writes to them. Files are reflinked where the file system supports
+it and hard linked otherwise, so taking a snapshot costs one link per file rather than
+copying file contents. Checkouts never modify destination files in place (they are
+always replaced), which keeps hard linked snapshots intact.
+
+Rolling back swaps each snapshotted file or folder back into place with a single
+rename, so restoring a destination does not depend on its size.
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+
+from pathlib import Path
+
+from . import command as commandutil
+
+
+# Folder (relative to the repository's git folder) containing snapshots
+_SNAPSHOT_FOLDER = Path('subtreeutil') / 'snapshots'
+
+# Files and folders within a snapshot
+_METADATA_NAME = 'snapshot.json'
+_MANIFEST_NAME = 'manifest.json'
+_TREE_FOLDER = 'tree'
+
+# Suffixes of snapshot folders being written or deleted
+_INCOMPLETE_SUFFIX = '.tmp'
+_DELETED_SUFFIX = '.deleted'
+
+# Seconds after which an incomplete or partially deleted snapshot is considered
+# abandoned by the invocation that created it
+_ABANDONED_AGE = 60 * 60
+
+
+snapshot_log = logging.getLogger('subtreeutil.snapshot')
+
+
+class SnapshotError(Exception):
+    """Base error for snapshot module exceptions."""
+
+
+class RestoreSnapshotError(SnapshotError):
+    """An error occurred while restoring a snapshot."""
+
+
+class Snapshot:
+    """A snapshot of a configuration's destinations.
+
+    Attributes:
+      path: A Path object for the snapshot's folder.
+      commit: The commit hash the destinations were checked out from, or an empty
+        string if it is not known.
+      time_ns: The time the snapshot was taken in nanoseconds.
+      roots: A list of the destinations' manifest keys.
+      present: A list of the manifest keys of destinations that existed when the
+        snapshot was taken.
+    """
+
+    __slots__ = ('path', 'commit', 'time_ns', 'roots', 'present')
+
+    def __init__(self, path: Path, commit='', time_ns=0, roots=None, present=None):
+        self.path = path
+        self.commit = commit
+        self.time_ns = time_ns
+        self.roots = roots or []
+        self.present = present or []
+
+    def __repr__(self):
+        return f'Snapshot(path={self.path}, commit={self.commit})'
+
+    def get_root_path(self, index):
+        """Fetches the path of a destination's copy within the snapshot.
+
+        Args:
+          index: The destination's index in the snapshot's roots.
+
+        Returns:
+          A Path object for the copy.
+        """
+
+        return self.path / _TREE_FOLDER / str(index)
+
+
+def get_snapshots_folder(git_folder: Path, roots_key):
+    """Fetches the folder containing the snapshots of a set of destinations.
+
+    Args:
+      git_folder: Path: A Path object for the local repository's git folder.
+      roots_key: A key identifying the destinations, from manifest.get_roots_key().
+
+    Returns:
+      A Path object for the snapshots folder.
+    """
+
+    return git_folder / _SNAPSHOT_FOLDER / roots_key
+
+
+def create_snapshot(snapshots_folder: Path, roots, keys, commit_hash='', manifest_path=None):
+    """Takes a snapshot of destination files and folders.
+
+    The snapshot is written to a temporary folder and renamed into place once complete,
+    so an interrupted snapshot is never restored.
+
+    Args:
+      snapshots_folder: Path: A Path object for the folder to keep the snapshot in.
+      roots: A list of Path objects for the destination files and folders.
+      keys: A list of the destinations' manifest keys.
+      commit_hash:  (Default value = '') The commit hash the destinations were checked
+        out from.
+      manifest_path:  (Default value = None) A Path object for the destinations'
+        manifest, which is saved with the snapshot if it exists.
+
+    Returns:
+      A Snapshot object.
+
+    Raises:
+      SnapshotError: An OSError occurred while writing the snapshot.
+    """
+
+    time_ns = time.time_ns()
+    snapshot_path = snapshots_folder / f'{time_ns:020d}'
+    incomplete_path = snapshot_path.with_name(snapshot_path.name + _INCOMPLETE_SUFFIX)
+
+    snapshot = Snapshot(incomplete_path, commit_hash, time_ns, list(keys))
+
+    try:
+        (incomplete_path / _TREE_FOLDER).mkdir(parents=True)
+
+        method = None
+        for index, (root, key) in enumerate(zip(roots, keys)):
+            if not os.path.lexists(root):
+                continue
+
+            method = _copy_tree(root, snapshot.get_root_path(index), method)
+            snapshot.present.append(key)
+
+        if manifest_path is not None and manifest_path.exists():
+            shutil.copy2(manifest_path, incomplete_path / _MANIFEST_NAME)
+
+        metadata = {
+            'commit': snapshot.commit,
+            'time_ns': snapshot.time_ns,
+            'roots': snapshot.roots,
+            'present': snapshot.present,
+        }
+        with (incomplete_path / _METADATA_NAME).open('w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=4)
+
+        incomplete_path.replace(snapshot_path)
+    except OSError as exception:
+        snapshot_log.warning(f'Unable to take snapshot \'{snapshot_path}\', {exception}')
+        _delete_folder(incomplete_path)
+        raise SnapshotError(f'Unable to take snapshot \'{snapshot_path}\'') from exception
+
+    snapshot.path = snapshot_path
+    snapshot_log.info(f'Took snapshot \'{snapshot_path}\' ({method or "empty"})')
+    return snapshot
+
+
+def list_snapshots(snapshots_folder: Path):
+    """Lists the complete snapshots in a folder.
+
+    Args:
+      snapshots_folder: Path: A Path object for the snapshots folder.
+
+    Returns:
+      A list of Snapshot objects, newest first.
+    """
+
+    if not snapshots_folder.is_dir():
+        return []
+
+    snapshots = []
+    for snapshot_path in snapshots_folder.iterdir():
+        if not snapshot_path.name.isdigit():
+            continue
+
+        try:
+            with (snapshot_path / _METADATA_NAME).open('r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        snapshots.append(
+            Snapshot(
+                snapshot_path,
+                metadata.get('commit', ''),
+                metadata.get('time_ns', 0),
+                metadata.get('roots', []),
+                metadata.get('present', []),
+            )
+        )
+
+    snapshots.sort(key=lambda snapshot: snapshot.path.name, reverse=True)
+    return snapshots
+
+
+def restore_snapshot(snapshot: Snapshot, roots, manifest_path=None):
+    """Swaps a snapshot's files and folders back into place at their destinations and
+    deletes the snapshot.
+
+    Destinations that did not exist when the snapshot was taken are removed. Each
+    destination is replaced with a single rename, using an atomic exchange where the
+    platform supports one. The replaced contents are deleted afterwards.
+
+    Args:
+      snapshot: Snapshot: The snapshot to restore.
+      roots: A list of Path objects for the destination files and folders, in the same
+        order as the snapshot's roots.
+      manifest_path:  (Default value = None) A Path object for the destinations'
+        manifest, which is replaced with the manifest saved in the snapshot.
+
+    Raises:
+      RestoreSnapshotError: An OSError occurred while restoring a destination.
+    """
+
+    try:
+        for index, root in enumerate(roots):
+            copy_path = snapshot.get_root_path(index)
+            replaced_path = copy_path.with_name(f'{index}{_DELETED_SUFFIX}')
+
+            if not os.path.lexists(copy_path):
+                if os.path.lexists(root):
+                    os.replace(root, replaced_path)
+                continue
+
+            if not os.path.lexists(root):
+                root.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(copy_path, root)
+            elif not commandutil.exchange_paths(copy_path, root):
+                os.replace(root, replaced_path)
+                os.replace(copy_path, root)
+
+        if manifest_path is not None:
+            saved_manifest_path = snapshot.path / _MANIFEST_NAME
+            if saved_manifest_path.exists():
+                saved_manifest_path.replace(manifest_path)
+            elif manifest_path.exists():
+                manifest_path.unlink()
+    except OSError as exception:
+        snapshot_log.error(f'Unable to restore snapshot \'{snapshot.path}\', {exception}')
+        raise RestoreSnapshotError(
+            f'Unable to restore snapshot \'{snapshot.path}\''
+        ) from exception
+
+    delete_snapshot(snapshot)
+
+
+def delete_snapshot(snapshot: Snapshot):
+    """Deletes a snapshot.
+
+    The snapshot is renamed before its contents are deleted, so a partially deleted
+    snapshot is never listed.
+
+    Args:
+      snapshot: Snapshot: The snapshot to delete.
+    """
+
+    deleted_path = snapshot.path.with_name(snapshot.path.name + _DELETED_SUFFIX)
+    try:
+        snapshot.path.replace(deleted_path)
+    except OSError as exception:
+        snapshot_log.warning(f'Unable to delete snapshot \'{snapshot.path}\', {exception}')
+        return
+
+    _delete_folder(deleted_path)
+
+
+def prune_snapshots(snapshots_folder: Path, retention):
+    """Deletes all but the newest snapshots in a folder, along with any left behind by
+    interrupted invocations.
+
+    Args:
+      snapshots_folder: Path: A Path object for the snapshots folder.
+      retention: The number of snapshots to keep.
+
+    Returns:
+      A list of the deleted Snapshot objects.
+    """
+
+    snapshots = list_snapshots(snapshots_folder)
+    for snapshot in snapshots[retention:]:
+        delete_snapshot(snapshot)
+
+    for path in snapshots_folder.iterdir():
+        if path.name.endswith((_INCOMPLETE_SUFFIX, _DELETED_SUFFIX)) and _is_abandoned(path):
+            _delete_folder(path)
+
+    return snapshots[retention:]
+
+
+def _copy_tree(source: Path, destination: Path, method=None):
+    """Copies a file or folder by reflinking or hard linking its files.
+
+    Args:
+      source: Path: A Path object for the file or folder to copy.
+      destination: Path: A Path object for the copy. Must not exist.
+      method:  (Default value = None) The method used for previous files, 'reflink',
+        'hardlink' or 'copy'. The first file to be copied without a method determines
+        it.
+
+    Returns:
+      The method used to copy files, or None if no files were copied.
+
+    Raises:
+      OSError: A file or folder could not be copied.
+    """
+
+    if source.is_symlink():
+        os.symlink(os.readlink(str(source)), str(destination))
+        return method
+
+    if not source.is_dir():
+        return _copy_file(source, destination, method)
+
+    destination.mkdir()
+
+    folders = [(str(source), str(destination))]
+    while folders:
+        source_folder, destination_folder = folders.pop()
+        with os.scandir(source_folder) as entries:
+            for entry in entries:
+                destination_path = os.path.join(destination_folder, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), destination_path)
+                elif entry.is_dir():
+                    os.mkdir(destination_path)
+                    folders.append((entry.path, destination_path))
+                else:
+                    method = _copy_file(Path(entry.path), Path(destination_path), method)
+
+    return method
+
+
+def _copy_file(source_file: Path, destination_file: Path, method=None):
+    """Copies a file by reflinking or hard linking it, falling back to copying it.
+
+    Args:
+      source_file: Path: A Path object for the file to copy.
+      destination_file: Path: A Path object for the copy. Must not exist.
+      method:  (Default value = None) The method used for previous files. Reflinks are
+        only attempted if None or 'reflink', as failing to reflink costs a file open.
+
+    Returns:
+      The method used to copy the file, 'reflink', 'hardlink' or 'copy'.
+
+    Raises:
+      OSError: The file could not be copied.
+    """
+
+    if method in (None, 'reflink') and commandutil.clone_file(source_file, destination_file):
+        return 'reflink'
+
+    if method in (None, 'reflink', 'hardlink'):
+        try:
+            os.link(source_file, destination_file)
+            return 'hardlink'
+        except OSError:
+            pass
+
+    shutil.copy2(source_file, destination_file)
+    return method or 'copy'
+
+
+def _delete_folder(folder_path: Path):
+    """Deletes a folder, logging rather than raising errors.
+
+    Args:
+      folder_path: Path: A Path object for the folder to delete.
+    """
+
+    try:
+        commandutil.delete_folder(folder_path)
+    except commandutil.DeleteCommandError:
+        pass
+
+
+def _is_abandoned(path: Path):
+    """Checks whether an incomplete or partially deleted snapshot has not been modified
+    for long enough that no invocation can still be using it.
+
+    Args:
+      path: Path: A Path object for the snapshot's folder.
+
+    Returns:
+      True if the snapshot can be deleted.
+    """
+
+    try:
+        return time.time() - path.stat().st_mtime > _ABANDONED_AGE
+    except OSError:
+        return False
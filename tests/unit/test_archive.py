@@ -0,0 +1,72 @@
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+import subtreeutil.archive as archive
+
+
+# Helper methods
+def add_member(tar, name, contents, mode=0o644):
+    info = tarfile.TarInfo(name)
+    info.size = len(contents)
+    info.mode = mode
+    tar.addfile(info, io.BytesIO(contents))
+
+
+def test_get_member_name():
+    """Tests that configuration paths are converted to archive member names."""
+    assert archive.get_member_name('Vendor\\Framework\\') == 'Vendor/Framework'
+
+    with pytest.raises(archive.UnsafeArchiveError):
+        archive.get_member_name('../Framework')
+
+
+def test_import_archive(tmp_path):
+    """Tests that files in an archive are written with their permissions."""
+    archive_path = tmp_path / 'export.tar.gz'
+    export = {'remote_url': 'url', 'branch': 'develop', 'commit': 'hash', 'roots': ['Vendor']}
+
+    with tarfile.open(archive_path, 'w:gz') as tar:
+        add_member(tar, '.subtreeutil-export.json', json.dumps({'exports': [export]}).encode())
+        add_member(tar, 'Vendor/a.txt', b'a')
+        add_member(tar, 'Vendor/Sub/run.sh', b'#!/bin/sh\n', 0o755)
+
+    destination = tmp_path / 'destination'
+    exports, written = archive.import_archive(archive_path, destination, workers=2)
+
+    assert exports == [export]
+    vendor = destination / 'Vendor'
+    assert sorted(written) == [vendor / 'Sub' / 'run.sh', vendor / 'a.txt']
+    assert (vendor / 'a.txt').read_bytes() == b'a'
+    assert os.access(vendor / 'Sub' / 'run.sh', os.X_OK)
+
+
+def test_import_archive_unsafe(tmp_path):
+    """Tests for raising an exception if a member would be written outside the destination."""
+    archive_path = tmp_path / 'export.tar'
+
+    with tarfile.open(archive_path, 'w') as tar:
+        add_member(tar, '../escaped.txt', b'a')
+
+    with pytest.raises(archive.UnsafeArchiveError):
+        archive.import_archive(archive_path, tmp_path / 'destination')
+
+    assert not (tmp_path / 'escaped.txt').exists()
+
+
+def test_import_archive_write_error(tmp_path):
+    """Tests for raising an ArchiveError if a worker is unable to write a file."""
+    archive_path = tmp_path / 'export.tar'
+
+    with tarfile.open(archive_path, 'w') as tar:
+        add_member(tar, 'Vendor/a.txt', b'a')
+
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    (destination / 'Vendor').write_text('not a folder')
+
+    with pytest.raises(archive.ArchiveError):
+        archive.import_archive(archive_path, destination, workers=2)
@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+
+import subtreeutil.blobstore as blobstore
+
+
+BLOB_ID_1 = 'a' * 40
+BLOB_ID_2 = 'b' * 40
+
+
+# Helper methods
+def add_blob(store_folder, blob_id, size, mtime):
+    blob = blobstore.Blob('100644', blob_id, Path('file.txt'))
+    blob_path = blobstore.get_blob_path(store_folder, blob)
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+    blob_path.write_bytes(b'x' * size)
+    os.utime(blob_path, (mtime, mtime))
+    return blob_path
+
+
+def test_get_blob_path_executable(tmp_path):
+    """Tests that executable blobs are stored separately from regular blobs."""
+    regular = blobstore.Blob('100644', BLOB_ID_1, Path('file.txt'))
+    executable = blobstore.Blob('100755', BLOB_ID_1, Path('file.sh'))
+
+    assert blobstore.get_blob_path(tmp_path, regular) != blobstore.get_blob_path(
+        tmp_path, executable
+    )
+
+
+def test_materialize_blob(tmp_path):
+    """Tests that a materialized blob is a writable copy of the stored blob."""
+    store_folder = tmp_path / 'store'
+    blob_path = add_blob(store_folder, BLOB_ID_1, 10, 0)
+    os.chmod(blob_path, 0o444)
+    destination = tmp_path / 'destination' / 'file.txt'
+
+    blob = blobstore.Blob('100644', BLOB_ID_1, Path('file.txt'))
+    method = blobstore.materialize_blob(store_folder, blob, destination)
+
+    assert method in ('reflink', 'copy')
+    assert destination.read_bytes() == blob_path.read_bytes()
+    assert os.access(destination, os.W_OK) is True
+
+
+def test_collect_garbage_deletes_oldest_unlinked(tmp_path):
+    """Tests that garbage collection deletes unreferenced blobs, oldest first, until the
+    store fits its size limit."""
+    old_blob = add_blob(tmp_path, BLOB_ID_1, 10, 1000)
+    linked_blob = add_blob(tmp_path, BLOB_ID_2, 10, 0)
+    os.link(linked_blob, tmp_path / 'working_copy_file')
+
+    deleted = blobstore.collect_garbage(tmp_path, 10)
+
+    assert deleted == 1
+    assert old_blob.exists() is False
+    assert linked_blob.exists() is True
@@ -0,0 +1,56 @@
+import pytest
+
+import subtreeutil.bundle as bundle
+
+
+_PREREQUISITE = 'a' * 40
+_COMMIT = 'b' * 40
+
+
+def test_read_bundle_header(tmp_path):
+    """Tests that an incremental bundle's prerequisites and refs are read."""
+    bundle_path = tmp_path / 'update.bundle'
+    bundle_path.write_bytes(
+        b'# v2 git bundle\n'
+        + f'-{_PREREQUISITE} Previous commit\n'.encode()
+        + f'{_COMMIT} refs/subtreeutil/framework/develop\n'.encode()
+        + b'\nPACK'
+    )
+
+    header = bundle.read_bundle_header(bundle_path)
+
+    assert header.version == 2
+    assert header.is_incremental
+    assert header.prerequisites == [_PREREQUISITE]
+    assert header.refs == {'refs/subtreeutil/framework/develop': _COMMIT}
+
+
+def test_read_bundle_header_invalid(tmp_path):
+    """Tests that files that are not complete bundles are rejected."""
+    bundle_path = tmp_path / 'invalid.bundle'
+
+    bundle_path.write_bytes(b'PACK')
+    with pytest.raises(bundle.InvalidBundleError):
+        bundle.read_bundle_header(bundle_path)
+
+    bundle_path.write_bytes(b'# v2 git bundle\n' + f'{_COMMIT} refs/heads/main\n'.encode())
+    with pytest.raises(bundle.InvalidBundleError):
+        bundle.read_bundle_header(bundle_path)
+
+
+def test_get_branch_refs():
+    """Tests that namespace refs take precedence over ordinary branch refs."""
+    header = bundle.BundleHeader(
+        2,
+        refs={
+            'refs/heads/main': _COMMIT,
+            'refs/heads/develop': _COMMIT,
+            'refs/subtreeutil/framework/develop': _PREREQUISITE,
+            'refs/tags/v1': _COMMIT,
+        },
+    )
+
+    assert bundle.get_branch_refs(header, 'refs/subtreeutil/framework') == {
+        'main': 'refs/heads/main',
+        'develop': 'refs/subtreeutil/framework/develop',
+    }
@@ -283,3 +283,54 @@ def test_delete_file_missing():
     file = get_test_file_path()
     with pytest.raises(command.DeleteCommandError):
         command.delete_file(file)
+
+
+def test_move_folder_staged(fixture_folder_for_move_destination_exists):
+    """Tests for moving a folder's contents into an existing folder through a staging
+    folder, keeping files already present at the destination."""
+    source = get_test_folder_path()
+    destination = get_test_folder_2_path()
+    existing_file = destination / 'existing.txt'
+    existing_file.write_text('existing')
+
+    command.move_folder_staged(source, destination)
+
+    assert source.exists() is False
+    assert get_test_file_3_path().exists() is True
+    assert existing_file.read_text() == 'existing'
+    assert command.get_staging_folder(destination).exists() is False
+
+
+def test_move_folder_staged_destination_missing(fixture_folder_for_move):
+    """Tests for moving a folder through a staging folder to a new location."""
+    source = get_test_folder_path()
+    destination = get_test_folder_2_path()
+
+    command.move_folder_staged(source, destination)
+
+    assert source.exists() is False
+    assert get_test_file_3_path().exists() is True
+
+
+def test_swap_folder(tmp_path):
+    """Tests that swapping a staging folder replaces the destination's contents."""
+    staging = tmp_path / 'staging'
+    destination = tmp_path / 'destination'
+    staging.mkdir()
+    destination.mkdir()
+    (staging / 'new.txt').touch()
+    (destination / 'old.txt').touch()
+
+    command.swap_folder(staging, destination)
+
+    assert (destination / 'new.txt').exists() is True
+    assert (destination / 'old.txt').exists() is False
+    assert staging.exists() is False
+
+
+def test_truncate_output():
+    """Tests that long command output is truncated for logging."""
+    output = 'x' * 20
+
+    assert command.truncate_output(output, 20) == output
+    assert command.truncate_output(output, 5) == 'xxxxx... (15 more characters truncated)'
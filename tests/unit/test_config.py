@@ -0,0 +1,49 @@
+import pytest
+
+import subtreeutil.config as config
+
+
+REMOTE_URL = 'git@example.com:User/Framework.git'
+
+
+def test_configuration_defaults():
+    """Tests that omitted configuration variables use their default values."""
+    configuration = config.Configuration(remote_url=REMOTE_URL)
+
+    assert configuration.remote_url == REMOTE_URL
+    assert configuration.branch == config.get_default_config()['branch']
+    assert config.get_prune_refs(configuration) is True
+
+
+def test_configuration_immutable():
+    """Tests that configuration values can not be changed after creation."""
+    configuration = config.Configuration(remote_url=REMOTE_URL, source_paths=['Assets'])
+
+    with pytest.raises(AttributeError):
+        configuration.branch = 'main'
+
+    assert configuration.source_paths == ('Assets',)
+    assert configuration.replace(branch='main').branch == 'main'
+
+
+def test_configuration_invalid():
+    """Tests for raising an exception if source and destination paths do not match."""
+    with pytest.raises(config.InvalidConfigurationError):
+        config.Configuration(source_paths=['Assets'], destination_paths=['A', 'B'])
+
+
+def test_configuration_from_dict_missing_key():
+    """Tests for raising an exception if a required configuration variable is missing."""
+    configuration = config.get_default_config()
+    del configuration['remote_url']
+
+    with pytest.raises(config.InvalidConfigurationError):
+        config.Configuration.from_dict(configuration)
+
+
+def test_configuration_from_dict_optional_key():
+    """Tests that optional configuration variables may be omitted from dictionaries."""
+    configuration = config.get_default_config()
+    del configuration['staged_writes']
+
+    assert config.Configuration.from_dict(configuration).staged_writes is False
@@ -0,0 +1,440 @@
+import functools
+import hashlib
+import json
+import subprocess
+import tarfile
+
+import pytest
+
+from pathlib import Path
+
+import subtreeutil.blobstore as blobstore
+import subtreeutil.config as config
+import subtreeutil.core as core
+import subtreeutil.lfs as lfs
+
+
+# Helper methods
+def git(repository, *args):
+    command = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args]
+    process = subprocess.run(command, cwd=repository, check=True, capture_output=True)
+    return process.stdout.decode('utf-8').strip()
+
+
+def create_repository(path, bare=False):
+    path.mkdir(parents=True)
+    git(path, 'init', '--quiet', '--initial-branch=main', *(['--bare'] if bare else []))
+    return path
+
+
+def create_partial_upstream(path):
+    work = create_repository(path.with_name(path.name + '_work'))
+    files = {f'Framework/{i}.txt': f'framework {i}' for i in range(5)}
+    files['Other/other.txt'] = 'other'
+    commit_hash = commit_files(work, files)
+
+    git(path.parent, 'clone', '--quiet', '--bare', str(work), str(path))
+    git(path, 'config', 'uploadpack.allowFilter', 'true')
+    git(path, 'config', 'uploadpack.allowAnySHA1InWant', 'true')
+    return str(path), commit_hash
+
+
+def make_pointer(content):
+    oid = hashlib.sha256(content).hexdigest()
+    return f'version https://git-lfs.github.com/spec/v1\noid sha256:{oid}\nsize {len(content)}\n'
+
+
+def commit_files(repository, files):
+    for name, contents in files.items():
+        file = repository / name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(contents)
+
+    git(repository, 'add', '--all')
+    git(repository, 'commit', '--quiet', '--message', 'Update')
+    return git(repository, 'rev-parse', 'HEAD')
+
+
+def test_ref_namespace_keyed_by_url(tmp_path):
+    """Tests that remotes sharing a name but not a URL are fetched into separate refs."""
+    first_url = str(create_repository(tmp_path / 'first'))
+    second_url = str(create_repository(tmp_path / 'second'))
+    first_commit = commit_files(tmp_path / 'first', {'a.txt': 'first'})
+    second_commit = commit_files(tmp_path / 'second', {'a.txt': 'second'})
+    local = create_repository(tmp_path / 'local')
+
+    assert core.fetch_namespace_branches('vendor', first_url, ['main'], cwd=local) == {
+        'main': first_commit
+    }
+    assert core.fetch_namespace_branches('vendor', second_url, ['main'], cwd=local) == {
+        'main': second_commit
+    }
+
+    first_ref = f'{core.get_ref_namespace("vendor", first_url)}/main'
+    assert core.get_ref_hash(first_ref, local) == first_commit
+
+
+def test_prune_namespace_refs(tmp_path):
+    """Tests that separate fetches keep each other's refs until a branch is deleted
+    upstream."""
+    upstream = create_repository(tmp_path / 'upstream')
+    first_commit = commit_files(upstream, {'a.txt': 'a'})
+    git(upstream, 'branch', 'feature')
+    second_commit = commit_files(upstream, {'a.txt': 'b'})
+    remote_url = str(upstream)
+    local = create_repository(tmp_path / 'local')
+
+    core.fetch_namespace_branches('vendor', remote_url, ['feature'], cwd=local)
+    core.fetch_namespace_branches('vendor', remote_url, ['main'], cwd=local)
+
+    namespace = core.get_ref_namespace('vendor', remote_url)
+    assert core.get_ref_hash(f'{namespace}/feature', local) == first_commit
+    assert core.get_ref_hash(f'{namespace}/main', local) == second_commit
+
+    git(upstream, 'branch', '--delete', '--force', 'feature')
+    core.fetch_namespace_branches('vendor', remote_url, ['main'], cwd=local)
+
+    assert core.get_ref_hash(f'{namespace}/feature', local) == ''
+    assert core.get_ref_hash(f'{namespace}/main', local) == second_commit
+
+
+def test_fetch_conflicting_settings(tmp_path, caplog):
+    """Tests that configurations sharing a remote URL are fetched with the first one's
+    settings and a warning if they disagree."""
+    upstream = create_repository(tmp_path / 'upstream')
+    commit_hash = commit_files(upstream, {'a.txt': 'a'})
+    remote_url = str(upstream)
+    local = create_repository(tmp_path / 'local')
+
+    configurations = [
+        config.Configuration(remote_name='vendor', remote_url=remote_url, branch='main'),
+        config.Configuration(
+            remote_name='vendor', remote_url=remote_url, branch='main', use_ref_namespace=True
+        ),
+    ]
+
+    commits = core.Syncer(configurations, local).fetch()
+
+    assert commits == {remote_url: {'main': commit_hash}}
+    assert 'set \'use_ref_namespace\' differently, using false' in caplog.text
+    assert core.get_ref_hash(f'{core.get_ref_namespace("vendor", remote_url)}/main', local) == ''
+
+
+def test_verify_after_cleanup(tmp_path):
+    """Tests that files deleted by cleanup paths are not reported missing by verify."""
+    upstream = create_repository(tmp_path / 'upstream')
+    commit_files(upstream, {'Framework/a.txt': 'a', 'Framework/Tests/b.txt': 'b'})
+    local = create_repository(tmp_path / 'local')
+
+    configuration = config.Configuration(
+        remote_name='framework',
+        remote_url=str(upstream),
+        branch='main',
+        source_paths=['Framework'],
+        destination_paths=['Vendor/Framework'],
+        cleanup_paths=['Vendor/Framework/Tests'],
+    )
+    syncer = core.Syncer([configuration], repository_folder=local)
+
+    assert syncer.run().success
+    assert (local / 'Vendor' / 'Framework' / 'a.txt').exists()
+    assert not (local / 'Vendor' / 'Framework' / 'Tests').exists()
+    assert syncer.verify()[0].clean
+
+
+def test_staged_cleanup(tmp_path):
+    """Tests that cleanup paths inside a staged destination never appear in it."""
+    upstream = create_repository(tmp_path / 'upstream')
+    commit_files(upstream, {'Framework/a.txt': 'new', 'Framework/Tests/b.txt': 'b'})
+    local = create_repository(tmp_path / 'local')
+    destination = local / 'Vendor' / 'Framework'
+    destination.mkdir(parents=True)
+    (destination / 'a.txt').write_text('old')
+
+    configuration = config.Configuration(
+        remote_name='framework',
+        remote_url=str(upstream),
+        branch='main',
+        source_paths=['Framework'],
+        destination_paths=['Vendor/Framework'],
+        cleanup_paths=['Vendor/Framework/Tests'],
+        staged_writes=True,
+    )
+    observed = []
+
+    def progress(event):
+        observed.append((destination / 'Tests').exists())
+
+    assert core.Syncer([configuration], local, progress).run().success
+    assert (destination / 'a.txt').read_text() == 'new'
+    assert not any(observed)
+    assert not (destination / 'Tests').exists()
+
+
+def test_materialize_source_store_error(tmp_path):
+    """Tests that a source whose blobs can not be added to the store is recorded as an
+    error instead of stopping the checkout."""
+    upstream = create_repository(tmp_path / 'upstream')
+    # Note: The blobs are large enough to fill the pipe of the 'git cat-file' process.
+    files = {f'Framework/{i}.txt': str(i) * 1024 * 1024 for i in range(3)}
+    commit_hash = commit_files(upstream, files)
+
+    store_folder = tmp_path / 'store'
+    store_folder.mkdir()
+    (store_folder / 'objects').write_text('not a folder')
+
+    result = core.SyncResult()
+    destination = tmp_path / 'Vendor'
+    core.materialize_source(
+        store_folder, commit_hash, Path('Framework'), destination, cwd=upstream, result=result
+    )
+
+    assert result.errors == [Path('Framework')]
+    assert result.files_written == []
+
+
+def test_staged_lfs_pointers(tmp_path):
+    """Tests that LFS pointers in a staged destination are resolved before it is swapped
+    into place."""
+    content = b'large binary content'
+    oid = hashlib.sha256(content).hexdigest()
+    endpoint = tmp_path / 'endpoint'
+    object_path = lfs.get_object_path(endpoint, oid)
+    object_path.parent.mkdir(parents=True)
+    object_path.write_bytes(content)
+
+    pointer = make_pointer(content)
+    upstream = create_repository(tmp_path / 'upstream')
+    commit_files(upstream, {'Framework/texture.png': pointer})
+    local = create_repository(tmp_path / 'local')
+    texture = local / 'Vendor' / 'Framework' / 'texture.png'
+
+    configuration = config.Configuration(
+        remote_name='framework',
+        remote_url=str(upstream),
+        branch='main',
+        source_paths=['Framework'],
+        destination_paths=['Vendor/Framework'],
+        staged_writes=True,
+        lfs=True,
+        lfs_endpoint=str(endpoint),
+    )
+    observed = []
+
+    def progress(event):
+        observed.append(texture.exists() and lfs.read_pointer(texture))
+
+    assert core.Syncer([configuration], local, progress).run().success
+    assert texture.read_bytes() == content
+    assert not any(observed)
+
+
+def test_fetch_partial_branches(tmp_path):
+    """Tests that partial fetches leave out blobs and configure a promisor remote."""
+    remote_url, commit_hash = create_partial_upstream(tmp_path / 'upstream.git')
+    local = create_repository(tmp_path / 'local')
+
+    commits = core.fetch_partial_branches('framework', remote_url, ['main'], cwd=local)
+
+    assert commits == {'main': commit_hash}
+    assert len(core.get_missing_blobs(commit_hash, ['Framework'], local)) == 5
+    assert len(core.get_missing_blobs(commit_hash, ['Other'], local)) == 1
+
+    promisor_remote = core.get_promisor_remote('framework', remote_url)
+    assert git(local, 'config', f'remote.{promisor_remote}.url') == remote_url
+    assert git(local, 'config', f'remote.{promisor_remote}.promisor') == 'true'
+
+
+def test_configure_promisor_remote(tmp_path):
+    """Tests that a promisor remote's configuration is only written when its URL
+    changes."""
+    local = create_repository(tmp_path / 'local')
+
+    core.configure_promisor_remote('promisor', 'first', local)
+    git(local, 'config', 'remote.promisor.promisor', 'false')
+
+    core.configure_promisor_remote('promisor', 'first', local)
+    assert git(local, 'config', 'remote.promisor.promisor') == 'false'
+
+    core.configure_promisor_remote('promisor', 'second', local)
+    assert git(local, 'config', 'remote.promisor.url') == 'second'
+    assert git(local, 'config', 'remote.promisor.promisor') == 'true'
+
+
+def test_fetch_source_blobs(tmp_path, monkeypatch):
+    """Tests that only the blobs under source paths are fetched, in batches."""
+    remote_url, commit_hash = create_partial_upstream(tmp_path / 'upstream.git')
+    local = create_repository(tmp_path / 'local')
+    core.fetch_partial_branches('framework', remote_url, ['main'], cwd=local)
+
+    commands = []
+    execute_fetch_command = core.execute_fetch_command
+    monkeypatch.setattr(core, '_BLOB_FETCH_BATCH_SIZE', 2)
+    monkeypatch.setattr(
+        core,
+        'execute_fetch_command',
+        lambda command, *args: commands.append(command) or execute_fetch_command(command, *args),
+    )
+
+    promisor_remote = core.get_promisor_remote('framework', remote_url)
+    fetched = core.fetch_source_blobs(promisor_remote, commit_hash, ['Framework'], local)
+
+    assert len(fetched) == 5
+    assert [len(command) - command.index(promisor_remote) - 1 for command in commands] == [2, 2, 1]
+    assert core.get_missing_blobs(commit_hash, ['Framework'], local) == []
+    assert len(core.get_missing_blobs(commit_hash, ['Other'], local)) == 1
+
+
+def test_export_partial_fetch(tmp_path):
+    """Tests that exports of partially fetched remotes only fetch the exported blobs."""
+    remote_url, commit_hash = create_partial_upstream(tmp_path / 'upstream.git')
+    local = create_repository(tmp_path / 'local')
+    archive_path = tmp_path / 'export.tar'
+
+    configuration = config.Configuration(
+        remote_name='framework',
+        remote_url=remote_url,
+        branch='main',
+        source_paths=['Framework'],
+        destination_paths=['Vendor/Framework'],
+        partial_fetch=True,
+    )
+    result = core.Syncer([configuration], local).export(archive_path)
+
+    assert result.success
+    assert 'blob_fetch' in result.timings
+    with tarfile.open(archive_path) as tar:
+        member = tar.extractfile('Vendor/Framework/0.txt')
+        assert member.read() == b'framework 0'
+
+    assert len(core.get_missing_blobs(commit_hash, ['Other'], local)) == 1
+
+
+def test_materialize_stored_blob_readded(tmp_path):
+    """Tests that a blob deleted from the store after it was added is added again."""
+    upstream = create_repository(tmp_path / 'upstream')
+    commit_hash = commit_files(upstream, {'Framework/a.txt': 'a'})
+    store_folder = tmp_path / 'store'
+    blob = blobstore.list_blobs(commit_hash, Path('Framework/a.txt'), upstream)[0]
+    destination = tmp_path / 'a.txt'
+
+    core.materialize_stored_blob(store_folder, blob, destination, cwd=upstream)
+
+    assert destination.read_text() == 'a'
+    assert blobstore.get_blob_path(store_folder, blob).exists()
+
+
+def test_export_lfs_pointers(tmp_path):
+    """Tests that LFS pointers are resolved while exporting."""
+    content = b'large binary content'
+    oid = hashlib.sha256(content).hexdigest()
+    endpoint = tmp_path / 'endpoint'
+    endpoint.mkdir()
+    (endpoint / oid).write_bytes(content)
+
+    pointer = make_pointer(content)
+    missing_pointer = make_pointer(b'missing')
+    upstream = create_repository(tmp_path / 'upstream')
+    files = {
+        'Framework/texture.png': pointer,
+        'Framework/copy.png': pointer,
+        'Framework/missing.png': missing_pointer,
+        'Framework/a.txt': 'a',
+    }
+    commit_files(upstream, files)
+    local = create_repository(tmp_path / 'local')
+    archive_path = tmp_path / 'export.tar'
+
+    configuration = config.Configuration(
+        remote_name='framework',
+        remote_url=str(upstream),
+        branch='main',
+        source_paths=['Framework'],
+        lfs=True,
+        lfs_endpoint=str(endpoint),
+    )
+
+    result = core.Syncer([configuration], local).export(archive_path)
+
+    assert result.errors == [Path('Framework/missing.png')]
+    with tarfile.open(archive_path) as tar:
+        assert tar.extractfile('Framework/texture.png').read() == content
+        assert tar.extractfile('Framework/copy.png').read() == content
+        assert tar.extractfile('Framework/missing.png').read() == missing_pointer.encode()
+        assert tar.extractfile('Framework/a.txt').read() == b'a'
+
+
+def test_fetch_with_bundles_older_than_remote(tmp_path):
+    """Tests that branches in a bundle older than the remote are still fetched from the
+    remote URL, unless fetching offline."""
+    upstream = create_repository(tmp_path / 'upstream')
+    remote_url = str(upstream)
+    bundled_commit = commit_files(upstream, {'a.txt': 'old'})
+    bundle_path = tmp_path / 'old.bundle'
+    git(upstream, 'bundle', 'create', '--quiet', str(bundle_path), 'refs/heads/main')
+    latest_commit = commit_files(upstream, {'a.txt': 'new'})
+
+    local = create_repository(tmp_path / 'local')
+    fetch_function = functools.partial(
+        core.fetch_namespace_branches, 'framework', remote_url, cwd=local
+    )
+
+    commits = core.fetch_with_bundles(
+        'framework', remote_url, [bundle_path], ['main'], fetch_function, offline=True, cwd=local
+    )
+    assert commits == {'main': bundled_commit}
+
+    commits = core.fetch_with_bundles(
+        'framework', remote_url, [bundle_path], ['main'], fetch_function, cwd=local
+    )
+    assert commits == {'main': latest_commit}
+    ref = f'{core.get_ref_namespace("framework", remote_url)}/main'
+    assert core.get_ref_hash(ref, local) == latest_commit
+
+
+def test_fetch_with_bundles_unreachable_remote(tmp_path):
+    """Tests that the commits fetched from bundles are used if the remote URL can not
+    be reached."""
+    upstream = create_repository(tmp_path / 'upstream')
+    bundled_commit = commit_files(upstream, {'a.txt': 'a'})
+    bundle_path = tmp_path / 'a.bundle'
+    git(upstream, 'bundle', 'create', '--quiet', str(bundle_path), 'refs/heads/main')
+
+    local = create_repository(tmp_path / 'local')
+    remote_url = str(tmp_path / 'missing')
+    fetch_function = functools.partial(
+        core.fetch_namespace_branches, 'framework', remote_url, cwd=local
+    )
+
+    commits = core.fetch_with_bundles(
+        'framework', remote_url, [bundle_path], ['main'], fetch_function, cwd=local
+    )
+    assert commits == {'main': bundled_commit}
+
+
+def test_perform_checkouts_metrics_error(tmp_path, monkeypatch):
+    """Tests that errors recording metrics do not replace an error raised by the run."""
+    local = create_repository(tmp_path / 'local')
+    config_path = tmp_path / 'framework.json'
+    config_path.write_text(json.dumps(config.get_default_config()))
+    monkeypatch.chdir(local)
+
+    def fail(*args):
+        raise RuntimeError('run failed')
+
+    monkeypatch.setattr(core.Syncer, 'run', fail)
+    monkeypatch.setattr(core.metrics, 'get_peak_rss', lambda: 1 / 0)
+
+    with pytest.raises(RuntimeError, match='run failed'):
+        core.perform_checkouts([config_path])
+
+
+def test_perform_stats_unreadable_history(tmp_path, monkeypatch):
+    """Tests that an unreadable metrics history is reported apart from regressions."""
+    local = create_repository(tmp_path / 'local')
+    database_path = core.metrics.get_database_path(local / '.git')
+    database_path.parent.mkdir(parents=True, exist_ok=True)
+    database_path.write_text('not a database')
+    monkeypatch.chdir(local)
+
+    assert core.perform_stats() is None
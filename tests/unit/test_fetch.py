@@ -0,0 +1,111 @@
+import logging
+import threading
+
+import pytest
+
+import subtreeutil.fetch as fetch
+import subtreeutil.lock as lock
+
+
+REMOTE_URL = 'git@example.com:User/Framework.git'
+
+
+# Helper methods
+def get_configuration(remote_url, branch):
+    return {'remote_url': remote_url, 'branch': branch}
+
+
+class FakeFetch:
+    def __init__(self, release=None):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = release
+
+    def __call__(self, branches):
+        self.calls.append(list(branches))
+        self.started.set()
+        if self.release is not None:
+            self.release.wait(5)
+        return {branch: f'{branch}-hash' for branch in branches}
+
+
+class WaitingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Event()
+
+    def emit(self, record):
+        if record.getMessage().startswith('Waiting for'):
+            self.waiting.set()
+
+
+# Fixtures
+@pytest.fixture(autouse=True)
+def fixture_clear_fetched():
+    fetch.clear_fetched()
+    yield 'fixture_clear_fetched'
+    fetch.clear_fetched()
+
+
+def test_group_by_remote():
+    """Tests that configurations are grouped by remote URL in encounter order."""
+    configurations = [
+        get_configuration(REMOTE_URL, 'develop'),
+        get_configuration('other', 'develop'),
+        get_configuration(REMOTE_URL, 'main'),
+    ]
+
+    groups = fetch.group_by_remote(configurations)
+
+    assert list(groups) == [REMOTE_URL, 'other']
+    assert fetch.get_branches(groups[REMOTE_URL]) == ['develop', 'main']
+
+
+def test_fetch_upstream_reuses_fetch(tmp_path):
+    """Tests that a remote is only fetched once per run for branches it already has."""
+    fake_fetch = FakeFetch()
+
+    fetch.fetch_upstream(tmp_path, REMOTE_URL, ['develop', 'main'], fake_fetch)
+    commits = fetch.fetch_upstream(tmp_path, REMOTE_URL, ['main'], fake_fetch)
+
+    assert fake_fetch.calls == [['develop', 'main']]
+    assert commits == {'main': 'main-hash'}
+
+
+def test_fetch_upstream_waits_for_in_flight_fetch(tmp_path, caplog):
+    """Tests that a concurrent fetch of the same remote waits and reuses the result."""
+    release = threading.Event()
+    first_fetch = FakeFetch(release)
+    second_fetch = FakeFetch()
+
+    first_thread = threading.Thread(
+        target=fetch.fetch_upstream, args=(tmp_path, REMOTE_URL, ['develop'], first_fetch)
+    )
+    first_thread.start()
+    assert first_fetch.started.wait(5)
+
+    # Note: Simulate a separate invocation by forgetting this run's fetches.
+    fetch.clear_fetched()
+    commits = {}
+    second_thread = threading.Thread(
+        target=lambda: commits.update(
+            fetch.fetch_upstream(tmp_path, REMOTE_URL, ['develop'], second_fetch)
+        )
+    )
+
+    handler = WaitingHandler()
+    caplog.set_level(logging.INFO, logger=lock.lock_log.name)
+    lock.lock_log.addHandler(handler)
+    try:
+        second_thread.start()
+        assert handler.waiting.wait(5)
+    finally:
+        release.set()
+        lock.lock_log.removeHandler(handler)
+
+    first_thread.join()
+    second_thread.join()
+
+    assert first_fetch.calls == [['develop']]
+    assert second_fetch.calls == []
+    assert commits == {'develop': 'develop-hash'}
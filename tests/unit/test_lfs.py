@@ -0,0 +1,80 @@
+import hashlib
+
+import subtreeutil.lfs as lfs
+
+
+CONTENT = b'large binary content'
+OID = hashlib.sha256(CONTENT).hexdigest()
+
+
+# Helper methods
+def make_pointer(oid, size):
+    return f'version https://git-lfs.github.com/spec/v1\noid sha256:{oid}\nsize {size}\n'.encode()
+
+
+def test_parse_pointer():
+    """Tests that pointer files are parsed and other contents are ignored."""
+    assert lfs.parse_pointer(make_pointer(OID, len(CONTENT))) == lfs.LfsPointer(
+        OID, len(CONTENT)
+    )
+    assert lfs.parse_pointer(b'not a pointer\n') is None
+
+
+def test_resolve_pointers_from_folder(tmp_path):
+    """Tests that pointers are replaced with objects fetched from a local folder."""
+    endpoint = tmp_path / 'endpoint'
+    object_path = lfs.get_object_path(endpoint, OID)
+    object_path.parent.mkdir(parents=True)
+    object_path.write_bytes(CONTENT)
+
+    pointer_file = tmp_path / 'destination' / 'texture.png'
+    pointer_file.parent.mkdir()
+    pointer_file.write_bytes(make_pointer(OID, len(CONTENT)))
+    other_file = tmp_path / 'destination' / 'readme.txt'
+    other_file.write_bytes(b'text')
+
+    objects_folder = tmp_path / 'objects'
+    resolved, failed = lfs.resolve_pointers(
+        [pointer_file, other_file], objects_folder, str(endpoint)
+    )
+
+    assert resolved == [pointer_file]
+    assert failed == []
+    assert pointer_file.read_bytes() == CONTENT
+    assert other_file.read_bytes() == b'text'
+    assert lfs.get_object_path(objects_folder, OID).read_bytes() == CONTENT
+
+
+def test_fetch_objects(tmp_path):
+    """Tests that objects are fetched into the local store and missing ones reported."""
+    endpoint = tmp_path / 'endpoint'
+    endpoint.mkdir()
+    (endpoint / OID).write_bytes(CONTENT)
+    missing = lfs.LfsPointer(hashlib.sha256(b'missing').hexdigest(), 7)
+
+    objects_folder = tmp_path / 'objects'
+    pointer = lfs.LfsPointer(OID, len(CONTENT))
+    objects, failed = lfs.fetch_objects([pointer, missing], objects_folder, str(endpoint))
+
+    assert objects == {pointer: lfs.get_object_path(objects_folder, OID)}
+    assert objects[pointer].read_bytes() == CONTENT
+    assert failed == [missing]
+
+
+def test_resolve_pointers_integrity(tmp_path):
+    """Tests that objects not matching their pointer are rejected."""
+    endpoint = tmp_path / 'endpoint'
+    endpoint.mkdir()
+    (endpoint / OID).write_bytes(b'corrupted content')
+
+    pointer_file = tmp_path / 'texture.png'
+    pointer = make_pointer(OID, len(CONTENT))
+    pointer_file.write_bytes(pointer)
+
+    objects_folder = tmp_path / 'objects'
+    resolved, failed = lfs.resolve_pointers([pointer_file], objects_folder, str(endpoint))
+
+    assert resolved == []
+    assert failed == [pointer_file]
+    assert pointer_file.read_bytes() == pointer
+    assert not lfs.get_object_path(objects_folder, OID).exists()
@@ -0,0 +1,113 @@
+import json
+import logging
+import socket
+import threading
+
+import pytest
+
+import subtreeutil.lock as lock
+
+
+# Helper methods
+class WaitingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Event()
+
+    def emit(self, record):
+        if record.getMessage().startswith('Waiting for'):
+            self.waiting.set()
+
+
+def test_acquire_lock_breaks_stale_lock(tmp_path):
+    """Tests that a lock held by a process that is no longer running is broken."""
+    lock_path = tmp_path / 'index.lock'
+    owner = {'pid': 2 ** 22 + 1, 'host': socket.gethostname(), 'description': 'test'}
+    lock_path.write_text(json.dumps(owner))
+
+    waited = lock.acquire_lock(lock_path, 'test', timeout=1)
+
+    assert waited is False
+    assert json.loads(lock_path.read_text())['description'] == 'test'
+
+
+def test_break_stale_lock_keeps_new_owner(tmp_path):
+    """Tests that a stale lock acquired by another invocation before it is broken is
+    kept."""
+    lock_path = tmp_path / 'index.lock'
+    owner = {'pid': 2 ** 22 + 1, 'host': socket.gethostname(), 'description': 'test'}
+    lock.acquire_lock(lock_path, 'new owner')
+
+    lock._break_stale_lock(lock_path, json.dumps(owner))
+
+    assert json.loads(lock_path.read_text())['description'] == 'new owner'
+    assert list(tmp_path.iterdir()) == [lock_path]
+
+
+def test_acquire_lock_abandoned_break(tmp_path):
+    """Tests that a stale lock is broken even if an invocation died while breaking it."""
+    lock_path = tmp_path / 'index.lock'
+    owner = {'pid': 2 ** 22 + 1, 'host': socket.gethostname(), 'description': 'test'}
+    lock_path.write_text(json.dumps(owner))
+    (tmp_path / 'index.lock.break').write_text(json.dumps(owner))
+
+    lock.acquire_lock(lock_path, 'test', timeout=1)
+
+    assert json.loads(lock_path.read_text())['description'] == 'test'
+    assert list(tmp_path.iterdir()) == [lock_path]
+
+
+def test_acquire_lock_timeout(tmp_path):
+    """Tests for raising an exception if a live lock is not released in time."""
+    lock_path = tmp_path / 'index.lock'
+
+    with lock.hold_lock(lock_path, 'test'):
+        with pytest.raises(lock.LockTimeoutError):
+            lock.acquire_lock(lock_path, 'test', timeout=0.2)
+
+    assert not lock_path.exists()
+
+
+def test_claim_paths_waits_for_overlap(tmp_path, caplog):
+    """Tests that a claim waits while an overlapping claim is held."""
+    events = []
+    claimed = threading.Event()
+    release = threading.Event()
+
+    def hold_parent():
+        with lock.claim_paths(tmp_path, [tmp_path / 'Assets'], 'parent'):
+            events.append('parent claimed')
+            claimed.set()
+            release.wait(5)
+            events.append('parent released')
+
+    def claim_child():
+        with lock.claim_paths(tmp_path, [tmp_path / 'Assets' / 'Framework'], 'child'):
+            events.append('child claimed')
+
+    parent_thread = threading.Thread(target=hold_parent)
+    child_thread = threading.Thread(target=claim_child)
+
+    handler = WaitingHandler()
+    caplog.set_level(logging.INFO, logger=lock.lock_log.name)
+    lock.lock_log.addHandler(handler)
+    try:
+        parent_thread.start()
+        assert claimed.wait(5)
+        child_thread.start()
+        assert handler.waiting.wait(5)
+    finally:
+        release.set()
+        lock.lock_log.removeHandler(handler)
+
+    parent_thread.join()
+    child_thread.join()
+
+    assert events == ['parent claimed', 'parent released', 'child claimed']
+
+
+def test_claim_paths_unrelated(tmp_path):
+    """Tests that claims of unrelated paths do not wait for each other."""
+    with lock.claim_paths(tmp_path, [tmp_path / 'Vendor' / 'Framework'], 'first'):
+        with lock.claim_paths(tmp_path, [tmp_path / 'Vendor' / 'FrameworkTools'], 'second', 0.2):
+            pass
@@ -0,0 +1,72 @@
+import os
+
+import subtreeutil.manifest as manifest
+
+
+# Helper methods
+def make_destination(tmp_path):
+    destination = tmp_path / 'Vendor'
+    (destination / 'Sub').mkdir(parents=True)
+    (destination / 'a.txt').write_bytes(b'hello\n')
+    (destination / 'Sub' / 'b.txt').write_bytes(b'b')
+    return destination
+
+
+def age_manifest(data, seconds=10):
+    """Moves a manifest's write time forward so its files are no longer racily clean."""
+    data['time_ns'] += seconds * 1000 ** 3
+
+
+def test_hash_file(tmp_path):
+    """Tests that files are hashed to their git blob ids."""
+    file = tmp_path / 'file.txt'
+    file.write_bytes(b'hello\n')
+
+    assert manifest.hash_file(file) == 'ce013625030ba8dba906f756967f9e9ca394464a'
+
+
+def test_verify_manifest_clean(tmp_path):
+    """Tests that unchanged destinations do not report drift or rehash files."""
+    destination = make_destination(tmp_path)
+    files = [destination / 'a.txt', destination / 'Sub' / 'b.txt']
+    data = manifest.build_manifest(tmp_path, [destination], files)
+    age_manifest(data)
+
+    drift = manifest.verify_manifest(tmp_path, data)
+
+    assert drift.clean
+    assert drift.refreshed == 0
+
+
+def test_verify_manifest_drift(tmp_path):
+    """Tests that modified, missing and extra files are reported."""
+    destination = make_destination(tmp_path)
+    files = [destination / 'a.txt', destination / 'Sub' / 'b.txt']
+    data = manifest.build_manifest(tmp_path, [destination], files)
+    age_manifest(data)
+
+    (destination / 'a.txt').write_bytes(b'changed\n')
+    (destination / 'Sub' / 'b.txt').unlink()
+    (destination / 'c.txt').write_bytes(b'c')
+
+    drift = manifest.verify_manifest(tmp_path, data)
+
+    assert drift.modified == ['Vendor/a.txt']
+    assert drift.missing == ['Vendor/Sub/b.txt']
+    assert drift.extra == ['Vendor/c.txt']
+
+
+def test_verify_manifest_refresh(tmp_path):
+    """Tests that files with new stat data but unchanged contents are refreshed."""
+    destination = make_destination(tmp_path)
+    files = [destination / 'a.txt', destination / 'Sub' / 'b.txt']
+    data = manifest.build_manifest(tmp_path, [destination], files)
+    age_manifest(data)
+
+    stat = (destination / 'a.txt').stat()
+    os.utime(destination / 'a.txt', ns=(stat.st_atime_ns, stat.st_mtime_ns - 1000 ** 3))
+
+    drift = manifest.verify_manifest(tmp_path, data)
+
+    assert drift.clean
+    assert drift.refreshed == 1
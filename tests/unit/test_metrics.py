@@ -0,0 +1,70 @@
+import time
+
+import subtreeutil.metrics as metrics
+
+
+# Helper methods
+def create_run(seconds, fetch_seconds, success=True):
+    return metrics.RunMetrics(
+        '/config.json',
+        'url',
+        time=time.time(),
+        seconds=seconds,
+        success=success,
+        files_written=3,
+        subprocesses=10,
+        bytes_fetched=2048,
+        phases={'fetch': fetch_seconds, 'move': 0.1},
+    )
+
+
+def test_record_run(tmp_path):
+    """Tests that recorded runs are read back newest first with their phases."""
+    database_path = tmp_path / 'metrics.sqlite'
+
+    metrics.record_run(database_path, create_run(2.0, 1.0))
+    metrics.record_run(database_path, create_run(3.0, 2.0, success=False))
+
+    assert metrics.list_keys(database_path) == [('/config.json', 'url')]
+
+    runs = metrics.read_runs(database_path, '/config.json', 'url')
+    assert [run.seconds for run in runs] == [3.0, 2.0]
+    assert runs[0].success is False
+    assert runs[0].files_written == 3
+    assert runs[0].phases == {'fetch': 2.0, 'move': 0.1}
+    assert len(metrics.read_runs(database_path, '/config.json', 'url', limit=1)) == 1
+
+
+def test_find_regressions():
+    """Tests that values well above the baseline's median are reported as regressions."""
+    baseline = [create_run(2.0 + i * 0.1, 1.0) for i in range(5)]
+
+    assert metrics.find_regressions([create_run(2.2, 1.1)] + baseline) == []
+    assert metrics.find_regressions([create_run(9.0, 8.0)] + baseline[:4]) == []
+
+    regressions = metrics.find_regressions([create_run(9.0, 8.0)] + baseline)
+    assert [regression.name for regression in regressions] == ['duration', 'phase fetch']
+    assert regressions[1].baseline == 1.0
+
+
+def test_format_textfile(tmp_path):
+    """Tests that histograms are exported with cumulative buckets and escaped labels."""
+    database_path = tmp_path / 'metrics.sqlite'
+    run = create_run(0.7, 0.2)
+    run.config = 'C:\\config "a".json'
+    metrics.record_run(database_path, run)
+    metrics.record_run(database_path, create_run(2000.0, 0.2))
+
+    lines = metrics.format_textfile(database_path).splitlines()
+
+    labels = 'config="C:\\\\config \\"a\\".json",remote="url"'
+    assert '# TYPE subtreeutil_run_duration_seconds histogram' in lines
+    assert f'subtreeutil_run_duration_seconds_bucket{{{labels},le="0.5"}} 0' in lines
+    assert f'subtreeutil_run_duration_seconds_bucket{{{labels},le="1"}} 1' in lines
+    assert f'subtreeutil_run_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in lines
+    assert f'subtreeutil_run_duration_seconds_count{{{labels}}} 1' in lines
+    assert f'subtreeutil_last_run_files_written{{{labels}}} 3' in lines
+
+    labels = 'config="/config.json",remote="url"'
+    assert f'subtreeutil_run_duration_seconds_bucket{{{labels},le="1800"}} 0' in lines
+    assert f'subtreeutil_run_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in lines
@@ -0,0 +1,46 @@
+import io
+import json
+
+import subtreeutil.progress as progress
+
+
+def test_parse_git_progress_receiving():
+    """Tests parsing a git progress line with object counts, size and rate."""
+    event = progress.parse_git_progress(
+        'Receiving objects:  45% (450/1000), 1.50 MiB | 512.00 KiB/s'
+    )
+
+    assert event.stage == 'Receiving objects'
+    assert event.percent == 45
+    assert (event.current, event.total) == (450, 1000)
+    assert event.bytes == int(1.5 * 1024 ** 2)
+    assert event.rate == 512 * 1024
+    assert event.done is False
+
+
+def test_parse_git_progress_remote_count():
+    """Tests parsing a remote git progress line that only reports a count."""
+    event = progress.parse_git_progress('remote: Enumerating objects: 5, done.')
+
+    assert event.stage == 'Enumerating objects'
+    assert event.current == 5
+    assert event.total is None
+    assert event.done is True
+
+
+def test_parse_git_progress_other_output():
+    """Tests that lines which are not progress lines are ignored."""
+    assert progress.parse_git_progress('From github.com:User/Framework') is None
+
+
+def test_json_lines_writer():
+    """Tests that events are written as one JSON object per line."""
+    stream = io.StringIO()
+    writer = progress.JsonLinesWriter(stream)
+
+    writer(progress.FileProgress('move', 2, 10, done=True))
+
+    event = json.loads(stream.getvalue())
+    assert event['event'] == 'files'
+    assert event['phase'] == 'move'
+    assert (event['files'], event['bytes'], event['done']) == (2, 10, True)
@@ -0,0 +1,51 @@
+import subtreeutil.snapshot as snapshot
+
+
+def test_restore_snapshot(tmp_path):
+    """Tests that restoring a snapshot brings back replaced, deleted and absent paths."""
+    folder = tmp_path / 'Vendor'
+    (folder / 'Sub').mkdir(parents=True)
+    (folder / 'a.txt').write_text('one')
+    (folder / 'Sub' / 'b.txt').write_text('two')
+    new_file = tmp_path / 'Vendor.meta'
+
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text('old')
+
+    snapshots_folder = tmp_path / 'snapshots'
+    roots = [folder, new_file]
+    taken = snapshot.create_snapshot(
+        snapshots_folder, roots, ['Vendor', 'Vendor.meta'], 'commit', manifest_path
+    )
+    assert taken.present == ['Vendor']
+
+    # Note: Checkouts replace files rather than writing them in place.
+    (folder / 'a.tmp').write_text('changed')
+    (folder / 'a.tmp').replace(folder / 'a.txt')
+    (folder / 'Sub' / 'b.txt').unlink()
+    new_file.write_text('meta')
+    manifest_path.write_text('new')
+
+    snapshot.restore_snapshot(snapshot.list_snapshots(snapshots_folder)[0], roots, manifest_path)
+
+    assert (folder / 'a.txt').read_text() == 'one'
+    assert (folder / 'Sub' / 'b.txt').read_text() == 'two'
+    assert not new_file.exists()
+    assert manifest_path.read_text() == 'old'
+    assert snapshot.list_snapshots(snapshots_folder) == []
+
+
+def test_prune_snapshots(tmp_path):
+    """Tests that only the newest snapshots are kept."""
+    root = tmp_path / 'a.txt'
+    snapshots_folder = tmp_path / 'snapshots'
+
+    for commit in ('first', 'second', 'third'):
+        root.write_text(commit)
+        snapshot.create_snapshot(snapshots_folder, [root], ['a.txt'], commit)
+        root.unlink()
+
+    deleted = snapshot.prune_snapshots(snapshots_folder, 2)
+
+    assert [s.commit for s in deleted] == ['first']
+    assert [s.commit for s in snapshot.list_snapshots(snapshots_folder)] == ['third', 'second']